@@ -1,3 +1,9 @@
 from django.contrib import admin
+from .models import Job
 
-# Register your models here.
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file_name', 'status', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('id', 'created_at', 'updated_at')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DiagnosisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'diagnosis'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import tesseract_pool
+        tesseract_pool.TESSERACT_WORKERS = settings.TESSERACT_WORKERS
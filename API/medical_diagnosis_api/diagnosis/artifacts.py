@@ -0,0 +1,127 @@
+import atexit
+import os
+import queue
+import threading
+
+import cv2
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Where preview, processed page and ROI images go. None of them feed back
+# into the result, so production can write them off the request thread
+# ('async') or not at all ('none').
+
+
+def encode_image(image, ext='.png'):
+    # In-memory encoding for uploads, no temp file. PNG compression 1 keeps it
+    # lossless and several times faster than the default level.
+    params = [cv2.IMWRITE_PNG_COMPRESSION, 1] if ext == '.png' else []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Unable to encode image as {ext}")
+    return memoryview(buffer)
+
+
+class NullArtifactSink:
+    def save(self, image, filename):
+        return None
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {'sink': None}
+
+
+class DiskArtifactSink:
+    def __init__(self, folder):
+        self.folder = folder
+        self.written = 0
+        self.failed = 0
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def write(self, image, filename):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            cv2.imwrite(self.path(filename), image)
+            self.written += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error saving {filename}: {str(e)}")
+
+    def save(self, image, filename):
+        self.write(image, filename)
+        return self.path(filename)
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {'sink': type(self).__name__, 'written': self.written, 'failed': self.failed}
+
+
+# Writes from a daemon thread. The image is copied when queued because the
+# caller keeps drawing on its buffer; a full queue drops the artifact rather
+# than slowing the request down.
+class AsyncArtifactSink(DiskArtifactSink):
+    def __init__(self, folder, max_queue=100):
+        super().__init__(folder)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='artifact-sink', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            image, filename = self.queue.get()
+            try:
+                self.write(image, filename)
+            finally:
+                self.queue.task_done()
+
+    def save(self, image, filename):
+        try:
+            self.queue.put_nowait((image.copy(), filename))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return self.path(filename)
+
+    def flush(self):
+        self.queue.join()
+
+    def stats(self):
+        return dict(super().stats(), pending=self.queue.qsize(), dropped=self.dropped)
+
+
+def make_artifact_sink(name, folder, max_queue):
+    if name in ('', 'none'):
+        return NullArtifactSink()
+    if name == 'sync':
+        return DiskArtifactSink(folder)
+    if name == 'async':
+        return AsyncArtifactSink(folder, max_queue)
+    raise ValueError(f"Unknown artifact sink: {name}")
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_artifact_sink():
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = make_artifact_sink(settings.ARTIFACT_SINK, settings.ARTIFACT_FOLDER, settings.ARTIFACT_QUEUE_SIZE)
+    return _sink
+
+
+@receiver(setting_changed)
+def reset_artifact_sink(setting, **kwargs):
+    global _sink
+    if setting.startswith('ARTIFACT_'):
+        _sink = None
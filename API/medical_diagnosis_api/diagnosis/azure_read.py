@@ -0,0 +1,162 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import aiohttp
+
+# Async client for the Azure Computer Vision Read API (v3.2). Many operations
+# can be in flight at once: each read() submits the image, then polls the
+# operation with a growing delay (or the server's Retry-After) on the event
+# loop, without holding a thread. Only submits take a token from the limiter,
+# polls are not metered against the per-minute budget.
+
+READ_PATH = '/vision/v3.2/read/analyze'
+PENDING = ('notStarted', 'running')
+# Time a ReadClientThread caller waits on top of the client's poll timeout,
+# for the submit and the last poll
+READ_TIMEOUT_MARGIN = 10.0
+
+
+class ReadError(Exception):
+    pass
+
+
+def retry_after(response, default):
+    try:
+        return max(0.0, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return default
+
+
+def result_text(result):
+    lines = []
+    for page in result.get('analyzeResult', {}).get('readResults', []):
+        lines.extend(line['text'] for line in page.get('lines', []))
+    return "\n".join(lines).strip()
+
+
+class AsyncReadClient:
+    def __init__(self, endpoint, key, limiter=None, min_poll=0.25, max_poll=4.0, backoff=1.5, timeout=30.0,
+                 max_submit_retries=3):
+        self.endpoint = endpoint.rstrip('/')
+        self.key = key
+        self.limiter = limiter
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_submit_retries = max_submit_retries
+        self.session = None
+        # Moving average of how long operations take, the first poll of the
+        # next operation is scheduled around it instead of after a fixed second
+        self.typical_duration = None
+        self.in_flight = 0
+        self.submits = 0
+        self.polls = 0
+
+    async def _session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers={'Ocp-Apim-Subscription-Key': self.key},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def submit(self, image):
+        session = await self._session()
+        for attempt in range(self.max_submit_retries):
+            if self.limiter is not None:
+                await self.limiter.wait_if_needed_async()
+            self.submits += 1
+            async with session.post(self.endpoint + READ_PATH, data=image,
+                                    headers={'Content-Type': 'application/octet-stream'}) as response:
+                if response.status == 202:
+                    return response.headers['Operation-Location']
+                if response.status == 429 and attempt < self.max_submit_retries - 1:
+                    await asyncio.sleep(retry_after(response, self.max_poll))
+                    continue
+                raise ReadError(f"Read submit failed with {response.status}: {await response.text()}")
+
+    def _first_delay(self):
+        if self.typical_duration is None:
+            return self.min_poll
+        return min(self.max_poll, max(self.min_poll, self.typical_duration * 0.8))
+
+    async def poll(self, operation_location):
+        session = await self._session()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        delay = self._first_delay()
+        while True:
+            # Checked before every poll, throttled polls included
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ReadError(f"Read operation did not finish within {self.timeout}s")
+            await asyncio.sleep(min(delay, remaining))
+            self.polls += 1
+            async with session.get(operation_location) as response:
+                if response.status == 429:
+                    delay = retry_after(response, self.max_poll)
+                    continue
+                if response.status != 200:
+                    raise ReadError(f"Read poll failed with {response.status}: {await response.text()}")
+                result = await response.json()
+                status = result.get('status')
+                if status not in PENDING:
+                    break
+                delay = retry_after(response, min(self.max_poll, max(self.min_poll, delay * self.backoff)))
+
+        if status != 'succeeded':
+            raise ReadError(f"Read operation {status}")
+        duration = time.monotonic() - started
+        self.typical_duration = duration if self.typical_duration is None else 0.8 * self.typical_duration + 0.2 * duration
+        return result
+
+    async def read(self, image):
+        # image is any bytes-like object holding an encoded image
+        self.in_flight += 1
+        try:
+            return result_text(await self.poll(await self.submit(image)))
+        finally:
+            self.in_flight -= 1
+
+    async def read_many(self, images):
+        return await asyncio.gather(*(self.read(image) for image in images), return_exceptions=True)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'submits': self.submits,
+            'polls': self.polls,
+            'typical_duration': round(self.typical_duration, 3) if self.typical_duration is not None else None,
+        }
+
+
+# Runs one AsyncReadClient on an event loop in a daemon thread, so the
+# synchronous request threads share its in-flight operations
+class ReadClientThread:
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='azure-read', daemon=True)
+        self.thread.start()
+
+    def read(self, image, timeout=None):
+        if timeout is None:
+            timeout = self.client.timeout + READ_TIMEOUT_MARGIN
+        future = asyncio.run_coroutine_threadsafe(self.client.read(image), self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ReadError(f"Read did not finish within {timeout}s") from None
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
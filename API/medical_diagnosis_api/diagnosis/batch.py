@@ -0,0 +1,168 @@
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytesseract
+from django.conf import settings
+
+from . import tesseract_pool
+from .artifacts import get_artifact_sink
+from .pipeline import PreprocessingPipeline, decode_page, extract_decoded_page, timed
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+MAX_ARCHIVE_MEMBER_SIZE = 50 * 1024 * 1024  # bytes, uncompressed
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+
+class BatchError(Exception):
+    pass
+
+
+def _init_worker(tesseract_cmd):
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    # Already a worker process, keep the engines here instead of another pool
+    tesseract_pool.TESSERACT_WORKERS = 0
+
+
+def _extract_page_in_worker(shm_name, shape, dtype, unique_filename, skew_engine, artifacts):
+    # Takes the page the parent already decoded from shared memory and saves
+    # the processed page here, only the ROIs and the page's metadata go back
+    # through the pipe. Some library exceptions (e.g. pytesseract's) can't be
+    # unpickled in the parent and would break the whole pool, send back only
+    # the message
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            image = np.ndarray(shape, dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+        page = extract_decoded_page(PreprocessingPipeline(image), skew_engine, save_original=False,
+                                    artifacts=artifacts, unique_filename=unique_filename)
+        get_artifact_sink().save(page.pop('image'), f"processed_{unique_filename}")
+        return page
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
+
+
+def get_process_pool():
+    # CPU stages (skew, OSD, word boxes) run in separate processes
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.BATCH_PROCESSES or None,
+                # Forking a threaded web worker that has OpenCV loaded is unsafe
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(pytesseract.pytesseract.tesseract_cmd,),
+            )
+        return _process_pool
+
+
+def discard_process_pool(pool):
+    # A worker died, shut the pool down and let the next upload start a fresh one
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_thread_pool():
+    # Network stages (Azure Read, Gemini) mostly wait, threads are enough
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=settings.BATCH_THREADS, thread_name_prefix='diagnosis-batch')
+        return _thread_pool
+
+
+def read_batch_uploads(files):
+    # (file_name, bytes) for every uploaded image and every image inside an
+    # uploaded zip archive, in upload order
+    uploads = []
+    for image_file in files.getlist('images'):
+        uploads.append((image_file.name, image_file.read()))
+
+    for archive in files.getlist('archive'):
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if info.file_size > MAX_ARCHIVE_MEMBER_SIZE:
+                        raise BatchError(f"{info.filename} is larger than {MAX_ARCHIVE_MEMBER_SIZE} bytes")
+                    uploads.append((name, zf.read(info)))
+        except zipfile.BadZipFile:
+            raise BatchError(f"{archive.name} is not a valid zip file")
+
+    if len(uploads) > settings.BATCH_MAX_FILES:
+        raise BatchError(f"At most {settings.BATCH_MAX_FILES} images per batch, got {len(uploads)}")
+    return uploads
+
+
+def _process_upload(file_name, image_bytes, ocr_backend=None):
+    from .utils import cached_result, complete_page, lookup_page
+
+    # Decoding here (OpenCV releases the GIL) lets cache hits skip the pool.
+    # Misses hand the decoded page to the worker through shared memory, it is
+    # never decoded twice nor pickled.
+    timings = {}
+    pipeline = decode_page(image_bytes, file_name, timings)
+    cache_key, artifacts = lookup_page(pipeline, timings, ocr_backend)
+    result = cached_result(artifacts, file_name)
+    if result is not None:
+        return result
+
+    unique_filename = f"{uuid.uuid4()}.png"
+    with timed(timings, 'save_original'):
+        get_artifact_sink().save(pipeline.color, f"original_{unique_filename}")
+
+    image = pipeline.color
+    shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    try:
+        np.ndarray(image.shape, image.dtype, buffer=shm.buf)[:] = image
+        pool = get_process_pool()
+        try:
+            page = pool.submit(_extract_page_in_worker, shm.name, image.shape, image.dtype.str, unique_filename,
+                               settings.SKEW_ENGINE, artifacts).result()
+        except BrokenProcessPool:
+            discard_process_pool(pool)
+            raise
+    finally:
+        shm.close()
+        shm.unlink()
+    timings.update(page['timings'])
+    return complete_page(file_name, page, timings, cache_key, artifacts, ocr_backend)
+
+
+def process_batch(uploads, ocr_backend=None):
+    # Yields one process_image shaped result per upload as soon as it is
+    # done, failures are reported per file instead of failing the batch
+    futures = {get_thread_pool().submit(_process_upload, name, data, ocr_backend): name for name, data in uploads}
+    try:
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'file_name': futures[future], 'error': str(e)}
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def ndjson_lines(results):
+    for result in results:
+        yield json.dumps(result) + "\n"
@@ -0,0 +1,297 @@
+import csv
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def content_key(image):
+    # Hash of the decoded pixels, so the same page re-encoded or re-uploaded
+    # under another name still hits
+    digest = hashlib.sha256()
+    digest.update(str(image.shape).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+# In-process LRU, entries expire after ttl seconds
+class MemoryCacheBackend:
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self.entries[key]
+            self.evictions += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self._set(key, value)
+
+    def update(self, key, values):
+        # Merges values into the dict stored under key
+        with self.lock:
+            self._set(key, dict(self._get(key) or {}, **values))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# On-disk cache shared by every worker process on the host, least recently
+# used entries are evicted past max_entries
+class SQLiteCacheBackend:
+    def __init__(self, path, max_entries=10000, ttl=None):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.evictions += 1
+                return None
+            self.conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def _set(self, key, value, now):
+        expires_at = now + self.ttl if self.ttl else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, now),
+        )
+        expired = self.conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,)).rowcount
+        overflow = self.conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += expired + overflow
+
+    def set(self, key, value):
+        with self.lock, self.conn:
+            self._set(key, value, time.time())
+
+    def update(self, key, values):
+        # Merges values into the dict stored under key. The read and the write
+        # share one IMMEDIATE transaction, so updates from other processes
+        # are not lost.
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = self.conn.execute("SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                                    (key, now)).fetchone()
+            self._set(key, dict(json.loads(row[0]) if row else {}, **values), now)
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM cache")
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def read_key(key, ocr_backend=None):
+    # The text read from the ROIs depends on the OCR backend asked for, the
+    # page geometry only on the pixels
+    return f"{key}:{ocr_backend or 'default'}"
+
+
+# Artifacts of one page: 'skew_angle', 'orientation' and 'word_boxes' under
+# its content_key, 'roi_text', 'ocr_backend' and the final 'result' under
+# its read_key
+class ResultCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, *keys):
+        # Artifacts of every key merged
+        artifacts = {}
+        for key in keys:
+            artifacts.update(self.backend.get(key) or {})
+        if 'result' in artifacts:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return artifacts
+
+    def update(self, key, **artifacts):
+        self.backend.update(key, artifacts)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.backend.evictions,
+        }
+
+
+class NullCache:
+    def get(self, *keys):
+        return {}
+
+    def update(self, key, **artifacts):
+        pass
+
+    def stats(self):
+        return {'backend': None}
+
+
+def normalize_diagnosis_text(text):
+    # "  T2DM\n with  HTN " and "t2dm with htn" share one entry
+    return " ".join((text or "").casefold().split())
+
+
+# Gemini's answer ({'provisional_diagnosis', 'ICD10_code'}) for each
+# normalized ROI text, persisted so repeat diagnoses never reach Gemini.
+# Empty text (nothing read, e.g. every OCR backend failed) is never cached.
+class DiagnosisCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        key = normalize_diagnosis_text(text)
+        if not key:
+            return None
+        formatted = self.backend.get(key)
+        if formatted is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return formatted
+
+    def set(self, text, formatted):
+        key = normalize_diagnosis_text(text)
+        if key:
+            self.backend.set(key, formatted)
+
+    def seed_from_csv(self, path):
+        # Columns: diagnosis, icd10_code and optionally corrected_diagnosis
+        # (defaults to the diagnosis text itself)
+        count = 0
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                diagnosis = (row.get('diagnosis') or '').strip()
+                code = (row.get('icd10_code') or '').strip()
+                if not diagnosis or not code:
+                    continue
+                self.set(diagnosis, {
+                    'provisional_diagnosis': (row.get('corrected_diagnosis') or '').strip() or diagnosis,
+                    'ICD10_code': code,
+                })
+                count += 1
+        return count
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def make_cache_backend(name, path, max_entries, ttl):
+    if name == 'memory':
+        return MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+    if name == 'sqlite':
+        return SQLiteCacheBackend(path, max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+_result_cache = None
+_diagnosis_cache = None
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        if settings.RESULT_CACHE_BACKEND in ('', 'none'):
+            _result_cache = NullCache()
+        else:
+            _result_cache = ResultCache(make_cache_backend(
+                settings.RESULT_CACHE_BACKEND,
+                settings.RESULT_CACHE_PATH,
+                settings.RESULT_CACHE_MAX_ENTRIES,
+                settings.RESULT_CACHE_TTL,
+            ))
+    return _result_cache
+
+
+def get_diagnosis_cache():
+    global _diagnosis_cache
+    if _diagnosis_cache is None:
+        _diagnosis_cache = DiagnosisCache(make_cache_backend(
+            settings.DIAGNOSIS_CACHE_BACKEND,
+            settings.DIAGNOSIS_CACHE_PATH,
+            settings.DIAGNOSIS_CACHE_MAX_ENTRIES,
+            None,
+        ))
+    return _diagnosis_cache
+
+
+@receiver(setting_changed)
+def reset_caches(setting, **kwargs):
+    global _result_cache, _diagnosis_cache
+    if setting.startswith('RESULT_CACHE_'):
+        _result_cache = None
+    if setting.startswith('DIAGNOSIS_CACHE_'):
+        _diagnosis_cache = None
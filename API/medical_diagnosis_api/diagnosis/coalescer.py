@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Gathers items submitted by concurrent callers and hands them to
+# send_batch(items) -> answers (same order) in groups of at most
+# max_batch_size, waiting at most max_wait seconds after the first item.
+# Each caller gets a Future for its own answer. Equal items in one batch
+# are sent once.
+class RequestCoalescer:
+    def __init__(self, send_batch, max_batch_size=10, max_wait=0.25, name='coalescer'):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches_sent = 0
+        self.items_sent = 0
+
+    def submit(self, item):
+        future = Future()
+        self.pending.put((item, future))
+        self._ensure_thread()
+        return future
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self._dispatch(self._collect())
+
+    def _dispatch(self, batch):
+        unique = list(dict.fromkeys(item for item, _ in batch))
+        try:
+            answers = self.send_batch(unique)
+            if len(answers) != len(unique):
+                raise ValueError(f"Expected {len(unique)} answers, got {len(answers)}")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches_sent += 1
+        self.items_sent += len(unique)
+        by_item = dict(zip(unique, answers))
+        for item, future in batch:
+            future.set_result(by_item[item])
@@ -0,0 +1,260 @@
+import csv
+import math
+import os
+import pickle
+import re
+from collections import defaultdict
+
+# Offline ICD-10-CM lookup used before Gemini. An index is built once from the
+# CMS code/description file (e.g. icd10cm_codes_2025.txt, "E119    Type 2
+# diabetes mellitus without complications") or a code,description CSV, and
+# saved as a pickle that loads in well under a second.
+
+INDEX_VERSION = 2
+
+# Common handwritten abbreviations, expanded to the wording of the ICD-10-CM
+# description they usually mean. Only abbreviations that are not also an
+# ordinary word or another common abbreviation ("age", "dm", "cap", "ra").
+ABBREVIATIONS = {
+    'htn': 'essential (primary) hypertension',
+    't2dm': 'type 2 diabetes mellitus without complications',
+    'dm2': 'type 2 diabetes mellitus without complications',
+    't1dm': 'type 1 diabetes mellitus without complications',
+    'uti': 'urinary tract infection, site not specified',
+    'urti': 'acute upper respiratory infection, unspecified',
+    'lrti': 'acute lower respiratory infection, unspecified',
+    'copd': 'chronic obstructive pulmonary disease, unspecified',
+    'cad': 'atherosclerotic heart disease of native coronary artery without angina pectoris',
+    'ihd': 'chronic ischemic heart disease, unspecified',
+    'ckd': 'chronic kidney disease, unspecified',
+    'aki': 'acute kidney failure, unspecified',
+    'chf': 'heart failure, unspecified',
+    'mi': 'acute myocardial infarction, unspecified',
+    'cva': 'cerebral infarction, unspecified',
+    'gerd': 'gastro-esophageal reflux disease without esophagitis',
+    'tb': 'respiratory tuberculosis unspecified',
+    'dvt': 'acute embolism and thrombosis of unspecified deep veins of unspecified lower extremity',
+    'oa': 'unspecified osteoarthritis, unspecified site',
+    'af': 'unspecified atrial fibrillation',
+    'afib': 'unspecified atrial fibrillation',
+    'bph': 'benign prostatic hyperplasia without lower urinary tract symptoms',
+}
+
+STOPWORDS = {'of', 'and', 'the', 'a', 'an', 'in', 'on', 'to', 'or', 'for', 'as', 'by', 'at'}
+# Words around the diagnosis on the form that never belong to it
+LABEL_WORDS = {'provisional', 'diagnosis', 'dx', 'known', 'case', 'kco', 'co', 'ho'}
+# Splits "HTN, T2DM" or "T2DM with HTN" into terms. An abbreviation is only
+# expanded when it is a whole term, never inside one ("age 45").
+TERM_SEPARATORS = r"[,;:/+&()\n]|\band\b|\bwith\b"
+
+# Words that only qualify a code ("Anemia, unspecified", "Essential (primary)
+# hypertension"). They carry no weight, so a bare "anemia" or "hypertension"
+# matches the general code rather than a more specific one.
+QUALIFIERS = {'unspecified', 'other', 'essential', 'primary', 'site', 'not', 'specified', 'elsewhere',
+              'classified', 'nos', 'type', 'organism', 'initial', 'encounter'}
+
+FUZZY_PENALTY = 0.9
+MAX_MEMO_ENTRIES = 10000
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", text.casefold()) if token not in STOPWORDS]
+
+
+def format_code(code):
+    code = code.strip().upper().replace('.', '')
+    return f"{code[:3]}.{code[3:]}" if len(code) > 3 else code
+
+
+def deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))} if len(token) > 3 else set()
+
+
+def read_source(path):
+    # (code, description) pairs from a CMS order/codes file or a CSV
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row['code'], row['description']
+            return
+        for line in f:
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2:
+                yield parts[0], parts[1]
+
+
+def read_abbreviations(path):
+    abbreviations = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            abbreviations[row['abbreviation'].strip().casefold()] = row['expansion'].strip()
+    return abbreviations
+
+
+class ICD10Match:
+    def __init__(self, code, description, confidence):
+        self.code = code
+        self.description = description
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"ICD10Match({self.code!r}, {self.description!r}, confidence={self.confidence:.3f})"
+
+
+class ICD10Index:
+    def __init__(self, codes, descriptions, doc_tokens, postings, idf, delete_map, abbreviations):
+        self.codes = codes
+        self.descriptions = descriptions
+        self.doc_tokens = doc_tokens
+        self.postings = postings
+        self.idf = idf
+        self.delete_map = delete_map
+        self.abbreviations = abbreviations
+        self.doc_weight = [sum(self.weight(token) for token in tokens) for tokens in doc_tokens]
+        # Codes sharing the same words ("Other specified cataract", "Unspecified
+        # cataract") resolve to the most general one, else the first listed
+        self.exact = {}
+        for i, tokens in enumerate(doc_tokens):
+            key = self._exact_key(tokens)
+            if key not in self.exact or self.generality(tokens) > self.generality(doc_tokens[self.exact[key]]):
+                self.exact[key] = i
+        self.max_idf = max(idf.values(), default=1.0)
+        self.memo = {}
+
+    def weight(self, token):
+        return 0.0 if token in QUALIFIERS else self.idf[token]
+
+    @staticmethod
+    def generality(tokens):
+        return ('unspecified' in tokens, 'other' not in tokens)
+
+    @staticmethod
+    def _exact_key(tokens):
+        return " ".join(sorted(token for token in tokens if token not in QUALIFIERS))
+
+    @classmethod
+    def build(cls, entries, abbreviations=None):
+        codes, descriptions, doc_tokens = [], [], []
+        postings = defaultdict(list)
+        for code, description in entries:
+            tokens = tuple(dict.fromkeys(tokenize(description)))
+            if not tokens:
+                continue
+            for token in tokens:
+                postings[token].append(len(codes))
+            codes.append(format_code(code))
+            descriptions.append(description.strip())
+            doc_tokens.append(tokens)
+
+        idf = {token: math.log(1 + len(codes) / len(docs)) for token, docs in postings.items()}
+        delete_map = defaultdict(list)
+        for token in postings:
+            for variant in deletes(token):
+                delete_map[variant].append(token)
+
+        merged = dict(ABBREVIATIONS)
+        merged.update(abbreviations or {})
+        return cls(codes, descriptions, doc_tokens, dict(postings), idf, dict(delete_map), merged)
+
+    def save(self, path):
+        state = {
+            'version': INDEX_VERSION,
+            'codes': self.codes,
+            'descriptions': self.descriptions,
+            'doc_tokens': self.doc_tokens,
+            'postings': self.postings,
+            'idf': self.idf,
+            'delete_map': self.delete_map,
+            'abbreviations': self.abbreviations,
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.pop('version', None) != INDEX_VERSION:
+            raise ValueError(f"{path} was built by another version, rebuild it with build_icd10_index")
+        return cls(**state)
+
+    def _query_tokens(self, text):
+        tokens = []
+        for term in re.split(TERM_SEPARATORS, text.casefold()):
+            words = [token for token in re.findall(r"[a-z0-9]+", term)
+                     if token not in STOPWORDS and token not in LABEL_WORDS and not (len(token) == 1 and token.isalpha())]
+            if len(words) == 1 and words[0] in self.abbreviations:
+                tokens.extend(tokenize(self.abbreviations[words[0]]))
+            else:
+                tokens.extend(words)
+        return list(dict.fromkeys(tokens))
+
+    def _resolve(self, token):
+        # Exact vocabulary token, else the most common token one edit away
+        if token in self.postings:
+            return token, 1.0
+        candidates = set(self.delete_map.get(token, ()))
+        for variant in deletes(token) | {token}:
+            candidates.update(self.delete_map.get(variant, ()))
+            if variant in self.postings:
+                candidates.add(variant)
+        if not candidates:
+            return None, 0.0
+        return min(candidates, key=lambda t: (self.idf[t], t)), FUZZY_PENALTY
+
+    def lookup(self, text):
+        # Repeat diagnoses are answered from a small memo
+        tokens = self._query_tokens(text)
+        key = " ".join(tokens)
+        if key not in self.memo:
+            if len(self.memo) >= MAX_MEMO_ENTRIES:
+                self.memo.clear()
+            self.memo[key] = self._lookup(tokens)
+        return self.memo[key]
+
+    def _lookup(self, tokens):
+        if not tokens:
+            return None
+
+        resolved = [self._resolve(token) for token in tokens]
+        matched = {vocab: penalty for vocab, penalty in resolved if vocab is not None}
+        if not matched:
+            return None
+
+        exact = self.exact.get(self._exact_key(matched))
+        if exact is not None and len(matched) == len(tokens) and all(p == 1.0 for p in matched.values()):
+            return ICD10Match(self.codes[exact], self.descriptions[exact], 1.0)
+
+        query_weight = sum(self.weight(vocab) if vocab else self.max_idf for vocab, _ in resolved)
+        if query_weight == 0:
+            return None
+
+        # Candidates are the codes containing the rarest token, each one is
+        # scored on all query tokens (idf weighted Dice)
+        rarest = max(matched, key=lambda t: (self.weight(t), t))
+        best, best_key = None, None
+        for doc in self.postings[rarest]:
+            doc_tokens = self.doc_tokens[doc]
+            overlap = 0.0
+            for token, penalty in matched.items():
+                if token in doc_tokens:
+                    overlap += self.weight(token) * penalty
+            # Ties go to the most general code, then the shortest description
+            key = (2 * overlap / (query_weight + self.doc_weight[doc]), self.generality(doc_tokens), -len(doc_tokens))
+            if best_key is None or key > best_key:
+                best, best_key = doc, key
+
+        return ICD10Match(self.codes[best], self.descriptions[best], round(best_key[0], 4))
+
+
+_index = None
+_index_path = None
+
+
+def get_icd10_index(path):
+    # None when no index has been built, callers then go straight to Gemini
+    global _index, _index_path
+    if _index_path != path:
+        _index = ICD10Index.load(path) if path and os.path.exists(path) else None
+        _index_path = path
+    return _index
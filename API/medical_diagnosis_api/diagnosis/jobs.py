@@ -0,0 +1,227 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.http.request import validate_host
+from django.utils import timezone
+
+from .models import Job
+
+CALLBACK_TIMEOUT = 10  # seconds
+CALLBACK_RETRIES = 3
+CALLBACK_RETRY_DELAY = 5  # seconds
+
+
+# Runs jobs on a pool of threads inside the web worker process. Jobs a
+# previous worker process left behind are picked up when the pool starts
+# (start_job_backend) and every recovery_interval seconds after that. A job
+# submitted twice runs once, run_job claims it first.
+class ThreadJobBackend:
+    def __init__(self, max_workers, recovery_interval=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='diagnosis-job')
+        self.recover()
+        if recovery_interval:
+            threading.Thread(target=self._recover_every, args=(recovery_interval,), name='diagnosis-job-recovery',
+                             daemon=True).start()
+
+    def submit(self, fn, *args):
+        return self.executor.submit(self._run, fn, *args)
+
+    def recover(self):
+        for job_id in recover_stale_jobs():
+            self.submit(run_job, job_id)
+
+    def _recover_every(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.recover()
+            except DatabaseError as e:
+                print(f"Job recovery failed: {str(e)}")
+            finally:
+                connections.close_all()
+
+    @staticmethod
+    def _run(fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            # Each pool thread gets its own DB connection, don't leak it
+            connections.close_all()
+
+
+# Leaves jobs queued in the database, `manage.py run_jobs` processes run them
+# outside the web workers
+class DatabaseJobBackend:
+    def submit(self, fn, *args):
+        return None
+
+
+# Runs jobs inline in the submitting thread, for tests and debugging
+class ImmediateJobBackend:
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+JOB_BACKENDS = {
+    'thread': lambda: ThreadJobBackend(settings.JOB_WORKERS, settings.JOB_HEARTBEAT),
+    'database': DatabaseJobBackend,
+    'immediate': ImmediateJobBackend,
+}
+
+_backend = None
+_backend_name = None
+
+
+def get_job_backend():
+    global _backend, _backend_name
+    if _backend is None or _backend_name != settings.JOB_BACKEND:
+        if settings.JOB_BACKEND not in JOB_BACKENDS:
+            raise ValueError(f"Unknown job backend: {settings.JOB_BACKEND}")
+        _backend = JOB_BACKENDS[settings.JOB_BACKEND]()
+        _backend_name = settings.JOB_BACKEND
+    return _backend
+
+
+def start_job_backend():
+    # Called when the server starts (wsgi.py, asgi.py), so a thread backend
+    # resumes the jobs of a previous process without waiting for a submit
+    try:
+        get_job_backend()
+    except DatabaseError as e:
+        print(f"Job backend not started: {str(e)}")
+
+
+def job_payload(job):
+    payload = {
+        'job_id': str(job.id),
+        'file_name': job.file_name,
+        'status': job.status,
+    }
+    if job.status == Job.SUCCEEDED:
+        payload['result'] = job.result
+    elif job.status == Job.FAILED:
+        payload['error'] = job.error
+    return payload
+
+
+def callback_allowed(url):
+    # Only hosts listed in JOB_CALLBACK_HOSTS, so clients can't make the
+    # server post to internal addresses
+    host = urlsplit(url).hostname
+    return bool(host) and validate_host(host, settings.JOB_CALLBACK_HOSTS)
+
+
+def send_callback(job, retries=CALLBACK_RETRIES):
+    if not callback_allowed(job.callback_url):
+        print(f"Callback for job {job.id} skipped, host not in JOB_CALLBACK_HOSTS")
+        return False
+    for attempt in range(retries):
+        try:
+            # No redirects, they could lead off the allowed hosts
+            response = requests.post(job.callback_url, json=job_payload(job), timeout=CALLBACK_TIMEOUT,
+                                     allow_redirects=False)
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"Callback attempt {attempt + 1} for job {job.id} failed: {str(e)}")
+            if attempt < retries - 1:
+                time.sleep(CALLBACK_RETRY_DELAY)
+    return False
+
+
+def claim_job(job_id):
+    # Queued -> running in one UPDATE, False when another worker got it first
+    return Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+        status=Job.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now()) == 1
+
+
+def recover_stale_jobs():
+    # Running jobs not updated for JOB_STALE_AFTER seconds lost their worker:
+    # they are queued again, or failed once they used up JOB_MAX_ATTEMPTS.
+    # Returns the ids of all queued jobs that old, nobody is going to run them.
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    stale = Job.objects.filter(status=Job.RUNNING, updated_at__lt=cutoff)
+    stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED, error='Job was interrupted too many times', image=None, updated_at=timezone.now())
+    stale.update(status=Job.QUEUED)
+    return list(Job.objects.filter(status=Job.QUEUED, updated_at__lt=cutoff)
+                .order_by('created_at').values_list('pk', flat=True))
+
+
+# Touches a running job every interval seconds while it is processed, so
+# recover_stale_jobs only requeues jobs whose worker went away
+class JobHeartbeat:
+    def __init__(self, job_id, interval):
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, name=f'diagnosis-job-heartbeat-{job_id}', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def _beat(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    Job.objects.filter(pk=self.job_id, status=Job.RUNNING).update(updated_at=timezone.now())
+                except DatabaseError as e:
+                    print(f"Heartbeat for job {self.job_id} failed: {str(e)}")
+        finally:
+            connections.close_all()
+
+
+def next_queued_job():
+    return Job.objects.filter(status=Job.QUEUED).order_by('created_at').values_list('pk', flat=True).first()
+
+
+def run_job(job_id):
+    # Imported here so submitting a job does not need the OCR clients loaded
+    from .utils import process_image
+
+    if not claim_job(job_id):
+        return None
+    job = Job.objects.get(pk=job_id)
+
+    timings = {}
+    try:
+        with JobHeartbeat(job_id, settings.JOB_HEARTBEAT):
+            job.result = process_image(ContentFile(bytes(job.image), name=job.file_name), timings,
+                                       job.ocr_backend or None)
+        job.status = Job.SUCCEEDED
+    except Exception as e:
+        job.error = str(e)
+        job.status = Job.FAILED
+    job.timings = timings
+    job.image = None
+    job.save(update_fields=['status', 'result', 'error', 'timings', 'image', 'updated_at'])
+
+    if job.callback_url:
+        send_callback(job)
+    return job
+
+
+def submit_job(image_file, callback_url='', ocr_backend=None):
+    # Store the upload now, the request's temporary file is gone once we return
+    job = Job.objects.create(file_name=image_file.name, callback_url=callback_url, ocr_backend=ocr_backend or '',
+                             image=image_file.read())
+    get_job_backend().submit(run_job, job.id)
+    return job
@@ -0,0 +1,59 @@
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from diagnosis.skew import SKEW_ENGINES, estimate_skew
+
+
+def make_synthetic_page(width, height, angle, seed=0):
+    # White page with rows of black "words", rotated by angle degrees
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, np.uint8)
+    line_height = max(12, height // 60)
+    for y in range(line_height * 3, height - line_height * 3, line_height * 2):
+        x = width // 12
+        while x < width - width // 12:
+            word = int(rng.integers(line_height, line_height * 6))
+            cv2.rectangle(page, (x, y), (min(x + word, width - width // 12), y + line_height // 2), 0, -1)
+            x += word + line_height
+    center = (width // 2, height // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(page, M, (width, height), flags=cv2.INTER_NEAREST, borderValue=255)
+
+
+class Command(BaseCommand):
+    help = "Compare skew estimator engines on a synthetic scan or an image file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', type=str, default=None, help='Image to benchmark instead of a synthetic page')
+        parser.add_argument('--width', type=int, default=2000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--angles', type=float, nargs='+', default=[-4, -2, 0, 1, 3])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['image']:
+            pages = [(None, cv2.imread(options['image'], cv2.IMREAD_GRAYSCALE))]
+        else:
+            pages = [(angle, make_synthetic_page(options['width'], options['height'], angle))
+                     for angle in options['angles']]
+
+        totals = dict.fromkeys(SKEW_ENGINES, 0.0)
+        for skew, gray in pages:
+            thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+            chosen = {}
+            for engine in SKEW_ENGINES:
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    chosen[engine] = estimate_skew(thresh, engine=engine)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+                totals[engine] += elapsed
+                self.stdout.write(f"skew={skew} engine={engine:<10} angle={chosen[engine]:+.2f} time={elapsed * 1000:.1f}ms")
+
+            same = round(chosen['projection']) == round(chosen['rotate'])
+            self.stdout.write(f"  same chosen angle: {same}")
+
+        speedup = totals['rotate'] / max(totals['projection'], 1e-9)
+        self.stdout.write(self.style.SUCCESS(f"projection engine speedup: {speedup:.1f}x"))
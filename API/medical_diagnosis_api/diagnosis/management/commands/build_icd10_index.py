@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from diagnosis.icd10 import ICD10Index, read_abbreviations, read_source
+
+
+class Command(BaseCommand):
+    help = "Build the offline ICD-10-CM index from a CMS codes file or a code,description CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, help="e.g. icd10cm_codes_2025.txt from the CMS release")
+        parser.add_argument('output', type=str, nargs='?', default=None,
+                            help="Index file to write (defaults to settings.ICD10_INDEX_PATH)")
+        parser.add_argument('--abbreviations', type=str, default=None,
+                            help="CSV of abbreviation,expansion rows added to the built-in list")
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.ICD10_INDEX_PATH
+        abbreviations = read_abbreviations(options['abbreviations']) if options['abbreviations'] else None
+
+        start = time.perf_counter()
+        index = ICD10Index.build(read_source(options['source']), abbreviations)
+        index.save(output)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index.codes)} codes and {len(index.abbreviations)} abbreviations into {output} in {elapsed:.1f}s"
+        ))
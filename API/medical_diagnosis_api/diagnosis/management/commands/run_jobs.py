@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from diagnosis.jobs import next_queued_job, recover_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued diagnosis jobs (JOB_BACKEND=database) outside the web workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            recover_stale_jobs()
+            job_id = next_queued_job()
+            if job_id is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+            job = run_job(job_id)
+            if job is not None:
+                self.stdout.write(f"{job.id} {job.file_name}: {job.status}")
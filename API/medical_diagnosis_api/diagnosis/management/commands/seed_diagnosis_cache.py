@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from diagnosis.cache import get_diagnosis_cache
+
+
+class Command(BaseCommand):
+    help = "Pre-seed the Gemini diagnosis cache from a CSV of diagnosis,icd10_code[,corrected_diagnosis] rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', type=str)
+
+    def handle(self, *args, **options):
+        cache = get_diagnosis_cache()
+        count = cache.seed_from_csv(options['csv_path'])
+        self.stdout.write(self.style.SUCCESS(f"Seeded {count} diagnoses ({len(cache.backend)} cached in total)"))
@@ -0,0 +1,189 @@
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import tesseract_pool
+from .artifacts import encode_image
+
+# Handwritten text engines behind extract_handwritten_text. Each backend
+# reads one ROI (a BGR array, or an encoded image buffer) and returns its
+# text. A backend whose rate
+# budget is spent or which is not set up on this host is skipped, and the
+# next one in the chain is tried.
+
+# Character set of the IAM handwriting model, in the order of its output
+# classes. The CTC blank is the class after the last character.
+DEFAULT_CHARSET = " !\"#&'()*+,-./0123456789:;?ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+class OCRUnavailable(Exception):
+    pass
+
+
+class OCRBackend:
+    name = None
+    limiter = None
+
+    def ready(self, max_wait=0):
+        # False when a request sent now would wait more than max_wait seconds
+        # for the backend's rate budget
+        return self.limiter is None or self.limiter.expected_wait() <= max_wait
+
+    def read(self, roi):
+        raise NotImplementedError
+
+    def read_encoded(self, data):
+        # data is an encoded image (PNG, JPEG, ...), decoded for backends that
+        # work on pixels
+        roi = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if roi is None:
+            raise ValueError("Unable to decode image")
+        return self.read(roi)
+
+
+class AzureReadBackend(OCRBackend):
+    name = 'azure'
+
+    def __init__(self, get_client, limiter):
+        self.get_client = get_client
+        self.limiter = limiter
+
+    def read(self, roi):
+        if not settings.VISION_KEY or not settings.VISION_ENDPOINT:
+            raise OCRUnavailable("Azure Read is not configured")
+        return self.get_client().read(encode_image(roi))
+
+    def read_encoded(self, data):
+        # Azure takes the encoded image as is
+        if not settings.VISION_KEY or not settings.VISION_ENDPOINT:
+            raise OCRUnavailable("Azure Read is not configured")
+        return self.get_client().read(data)
+
+
+class TesseractBackend(OCRBackend):
+    name = 'tesseract'
+
+    def read(self, roi):
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+        return tesseract_pool.image_to_string(gray, config="--psm 6").strip()
+
+
+def ctc_greedy_decode(probabilities, charset):
+    # Best class per time step, repeats collapsed, blanks dropped
+    blank = len(charset)
+    best = np.argmax(probabilities, axis=-1)
+    text = []
+    previous = blank
+    for index in best:
+        if index != previous and index < blank:
+            text.append(charset[index])
+        previous = index
+    return "".join(text)
+
+
+class TFLiteModel:
+    # A .tflite export (future_scope .../export_model.py) on the LiteRT
+    # interpreter, which starts in milliseconds where TensorFlow takes seconds.
+    # The exported graph has a fixed batch size of one.
+    def __init__(self, path):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                raise OCRUnavailable("No TFLite runtime is installed")
+        self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self.input['shape'])
+
+    def predict(self, batch):
+        self.interpreter.set_tensor(self.input['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index'])
+
+
+class KerasModel:
+    def __init__(self, path):
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise OCRUnavailable("TensorFlow is not installed")
+        tf.config.set_visible_devices([], 'GPU')
+        self.model = tf.keras.models.load_model(path, compile=False)
+        self.input_shape = self.model.input_shape
+
+    def predict(self, batch):
+        return self.model(batch, training=False).numpy()
+
+
+# CNN-LSTM-CTC model from future_scope_for_NEURAL_NETWORK_INTEGRATION_WITH_API
+# (models/cnn_lstm_ctc.py), loaded from LOCAL_OCR_MODEL_PATH and run on CPU:
+# a .tflite export if the path ends in .tflite, otherwise a Keras model.
+# The runtime is only imported when the backend is first used.
+class LocalCTCBackend(OCRBackend):
+    name = 'local'
+
+    def __init__(self):
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                path = settings.LOCAL_OCR_MODEL_PATH
+                if not path:
+                    raise OCRUnavailable("LOCAL_OCR_MODEL_PATH is not set")
+                self.model = TFLiteModel(path) if path.endswith('.tflite') else KerasModel(path)
+        return self.model
+
+    def preprocess(self, roi):
+        # Same as image_preprocessing.preprocess_image: grayscale, resized to
+        # the model input, scaled to 0..1, with a channel axis
+        height, width = self.model.input_shape[1:3]
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+        resized = cv2.resize(gray, (width, height))
+        return (resized.astype(np.float32) / 255.0)[np.newaxis, :, :, np.newaxis]
+
+    def read(self, roi):
+        model = self.load()
+        probabilities = model.predict(self.preprocess(roi))[0]
+        return ctc_greedy_decode(probabilities, settings.LOCAL_OCR_CHARSET or DEFAULT_CHARSET)
+
+
+class OCRBackends:
+    def __init__(self, backends):
+        self.backends = {backend.name: backend for backend in backends}
+
+    def __contains__(self, name):
+        return name in self.backends
+
+    def chain(self, preferred=None):
+        # The requested backend first, then the configured fallbacks
+        names = [preferred] if preferred else []
+        names += [name for name in settings.OCR_BACKENDS if name not in names]
+        for name in names:
+            if name not in self.backends:
+                raise ValueError(f"Unknown OCR backend: {name}")
+        return [self.backends[name] for name in names]
+
+    def read(self, roi, preferred=None):
+        # (text, backend name). Backends over their rate budget are passed
+        # over while another one can take the ROI; the last one is always tried.
+        chain = self.chain(preferred)
+        errors = []
+        for i, backend in enumerate(chain):
+            if i < len(chain) - 1 and not backend.ready(settings.OCR_FALLBACK_MAX_WAIT):
+                errors.append(f"{backend.name}: rate budget exhausted")
+                continue
+            try:
+                if isinstance(roi, np.ndarray):
+                    return backend.read(roi), backend.name
+                return backend.read_encoded(roi), backend.name
+            except Exception as e:
+                errors.append(f"{backend.name}: {str(e)}")
+        raise OCRUnavailable("; ".join(errors))
@@ -0,0 +1,111 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Cheap orientation check in front of Tesseract OSD. Almost every scan comes
+# in upright, and a page of horizontal text lines shows it: the row profile
+# (ink per row) swings sharply between lines and gaps while the column
+# profile stays flat, and inside each line more ink sits above the x-height
+# band (capitals, digits, b d f h k l t) than below it (g j p q y). A page
+# that clearly passes both checks is taken as upright without asking OSD.
+# Everything else goes to OSD: sideways pages, pages with too few lines,
+# pages without a clear bias, and upside down pages (rare, and flipping an
+# upright page by mistake costs more than the OSD pass).
+#
+# The Django API (diagnosis/orientation.py) and the Flask OCR backend share
+# this module. Edit the Django copy and copy it over,
+# diagnosis.tests.SharedModuleTests fails when the copies differ.
+
+# Longest side of the page the profiles are taken from
+PROFILE_MAX_SIDE = 1200
+# Rows with less ink than this share of the fullest row are gaps
+LINE_LEVEL = 0.05
+# Rows of a line with at least this share of its fullest row are its x-height band
+CORE_LEVEL = 0.5
+MIN_LINE_ROWS = 3
+MIN_LINES = 3
+# Row profile score over column profile score of a page of horizontal lines
+MIN_LINE_CONTRAST = 2.0
+# Share of the ink outside the x-height band that is above it
+MIN_ASCENDER_SHARE = 0.6
+
+
+def profile_score(histogram):
+    return np.sum((histogram[1:] - histogram[:-1]) ** 2, dtype=float)
+
+
+def profiles_from_points(ys, xs, weights, angle=0.0):
+    # Ink per row and per column (top to bottom, left to right) of the
+    # foreground points rotated by angle degrees
+    theta = np.deg2rad(angle)
+    ys = np.asarray(ys, np.float64)
+    xs = np.asarray(xs, np.float64)
+    rows = np.rint(ys * np.cos(theta) - xs * np.sin(theta)).astype(np.int64)
+    columns = np.rint(xs * np.cos(theta) + ys * np.sin(theta)).astype(np.int64)
+    return {
+        'rows': np.bincount(rows - rows.min(initial=0), weights=weights),
+        'columns': np.bincount(columns - columns.min(initial=0), weights=weights),
+    }
+
+
+def line_profiles(thresh, angle=0.0):
+    # Profiles of an inverted threshold (ink > 0), for pages whose skew
+    # search did not produce them
+    (h, w) = thresh.shape[:2]
+    scale = min(1.0, PROFILE_MAX_SIDE / float(max(h, w)))
+    if scale < 1.0:
+        thresh = cv2.resize(thresh, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    ys, xs = np.nonzero(thresh)
+    return profiles_from_points(ys, xs, thresh[ys, xs].astype(np.float64), angle)
+
+
+def text_lines(rows):
+    # (top, bottom) of every run of inked rows at least MIN_LINE_ROWS tall
+    inked = np.concatenate(([False], rows > rows.max(initial=0) * LINE_LEVEL, [False]))
+    edges = np.flatnonzero(inked[1:] != inked[:-1]).reshape(-1, 2)
+    return [(top, bottom) for top, bottom in edges if bottom - top >= MIN_LINE_ROWS]
+
+
+def precheck_orientation(profiles):
+    # 0 (OSD's "Rotate" for an upright page) when the profiles clearly show
+    # an upright page, None when OSD has to decide
+    rows, columns = profiles['rows'], profiles['columns']
+    if rows.size == 0 or profile_score(rows) < MIN_LINE_CONTRAST * profile_score(columns):
+        return None
+
+    lines = text_lines(rows)
+    above = below = 0.0
+    for top, bottom in lines:
+        line = rows[top:bottom]
+        core = np.flatnonzero(line >= line.max() * CORE_LEVEL)
+        above += line[:core[0]].sum()
+        below += line[core[-1] + 1:].sum()
+    if len(lines) < MIN_LINES or above + below == 0:
+        return None
+
+    if above / (above + below) >= MIN_ASCENDER_SHARE:
+        return 0
+    return None
+
+
+# How each page's orientation was decided: 'precheck' (OSD skipped), 'osd',
+# 'cache' (known from an earlier run) or 'small' (too small to check)
+class OrientationStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(('precheck', 'osd', 'cache', 'small'), 0)
+
+    def record(self, source):
+        if source in self.counts:
+            with self.lock:
+                self.counts[source] += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        checked = counts['precheck'] + counts['osd']
+        return dict(counts, osd_skip_rate=round(counts['precheck'] / checked, 4) if checked else 0.0)
+
+
+orientation_stats = OrientationStats()
@@ -0,0 +1,283 @@
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from fuzzywuzzy import fuzz
+
+from . import tesseract_pool
+from .artifacts import get_artifact_sink
+from .orientation import line_profiles, precheck_orientation
+from .skew import estimate_skew
+
+# Images smaller than this on either side skip OSD and are upscaled for OCR
+MIN_SIDE = 700
+UPSCALE_FACTOR = 2
+
+# Where previews, processed pages and ROIs are written
+IMAGE_FOLDER = 'processed_images'
+
+
+@contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def rotate_buffer(buffer, angle, center=None):
+    (h, w) = buffer.shape[:2]
+    if center is None:
+        center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(buffer, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+# Carries one colour and one grayscale buffer through skew, orientation,
+# upscale and threshold. Each step works on the previous step's output, the
+# page is decoded and converted to grayscale exactly once.
+class PreprocessingPipeline:
+    def __init__(self, image, timings=None):
+        self.timings = {} if timings is None else timings
+        self.color = image
+        with timed(self.timings, 'grayscale'):
+            self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.skew_angle = 0.0
+        self.orientation = 0
+        self.orientation_source = None
+        # Row and column ink profiles of the straightened page, when the skew
+        # search produced them
+        self.profiles = None
+        self.scale_factor = 1
+        self.processed = None
+
+    @classmethod
+    def from_bytes(cls, image_bytes, timings=None):
+        timings = {} if timings is None else timings
+        with timed(timings, 'decode'):
+            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        return cls(image, timings)
+
+    @property
+    def is_small(self):
+        (h, w) = self.gray.shape[:2]
+        return h < MIN_SIDE or w < MIN_SIDE
+
+    def _rotate(self, angle):
+        self.color = rotate_buffer(self.color, angle)
+        self.gray = rotate_buffer(self.gray, angle)
+
+    def correct_skew(self, delta=1, limit=5, engine="projection", angle=None):
+        # A known angle (e.g. from the result cache) skips the search
+        with timed(self.timings, 'skew'):
+            if angle is None:
+                thresh = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+                profiles = {}
+                angle = estimate_skew(thresh, delta=delta, limit=limit, engine=engine, profiles=profiles)
+                self.profiles = profiles or None
+            self.skew_angle = angle
+            if self.skew_angle:
+                self._rotate(self.skew_angle)
+        return self
+
+    def precheck_orientation(self):
+        profiles = self.profiles
+        if profiles is None:
+            thresh = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+            profiles = line_profiles(thresh)
+        return precheck_orientation(profiles)
+
+    def correct_orientation(self, orientation=None):
+        # OSD only runs (and shows up as its own 'osd' timing) when neither
+        # the cache nor the pre-check settles the orientation
+        with timed(self.timings, 'orientation'):
+            if self.is_small:
+                self.orientation_source = 'small'
+                return self
+            self.orientation_source = 'cache'
+            if orientation is None:
+                self.orientation_source = 'precheck'
+                orientation = self.precheck_orientation()
+            if orientation is None:
+                self.orientation_source = 'osd'
+                with timed(self.timings, 'osd'):
+                    orientation = int(tesseract_pool.image_to_osd(self.gray)["rotate"])
+            self.orientation = orientation
+            if self.orientation != 0:
+                self._rotate(-self.orientation)
+        return self
+
+    def threshold(self):
+        # Upscaling only feeds the OCR buffer, the colour buffer keeps its size
+        with timed(self.timings, 'upscale'):
+            ocr_gray = self.gray
+            if self.is_small:
+                self.scale_factor = UPSCALE_FACTOR
+                ocr_gray = cv2.resize(ocr_gray, None, fx=self.scale_factor, fy=self.scale_factor,
+                                      interpolation=cv2.INTER_LANCZOS4)
+
+        with timed(self.timings, 'threshold'):
+            self.processed = cv2.adaptiveThreshold(
+                ocr_gray,
+                255,
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY,
+                65,
+                13
+            )
+        return self
+
+    def run(self, skew_engine="projection", skew_angle=None, orientation=None):
+        return self.correct_skew(engine=skew_engine, angle=skew_angle).correct_orientation(orientation).threshold()
+
+
+def extract_text_with_boxes(processed_image, scale_factor=1):
+    config = "--psm 6 --oem 3"
+
+    data = tesseract_pool.image_to_data(processed_image, config=config)
+
+    extracted_data = []
+    for i in range(len(data['text'])):
+        text = data['text'][i].strip()
+        if text:
+            extracted_data.append({
+                'text': text,
+                'box': {
+                    'x': int(data['left'][i] / scale_factor),
+                    'y': int(data['top'][i] / scale_factor),
+                    'width': int(data['width'][i] / scale_factor),
+                    'height': int(data['height'][i] / scale_factor)
+                }
+            })
+
+    return extracted_data
+
+
+def is_similar_to_diagnosis(text, threshold=50):
+    keywords = ["diagnosis"]
+    for keyword in keywords:
+        if fuzz.ratio(text.lower(), keyword) >= threshold:
+            return True
+    return False
+
+
+def draw_provisional_diagnosis_box_and_extract_rois(image, extracted_data):
+    rois = []
+    height, width, _ = image.shape
+    best_match = None
+    highest_ratio = 0
+
+    for item in extracted_data:
+        text = item['text']
+        box = item['box']
+
+        if is_similar_to_diagnosis(text):
+            ratio = fuzz.ratio(text.lower(), "diagnosis")
+            if ratio > highest_ratio:
+                highest_ratio = ratio
+                best_match = item
+
+    if best_match and (height >= 700 and width >= 700):
+        box = best_match['box']
+        cv2.rectangle(image,
+                      (box['x'] + 100, box['y'] - 40),
+                      (width, box['y'] + box['height'] + 30),
+                      (0, 255, 0), 2)
+        roi = image[box['y'] - 40:box['y'] + box['height'] + 30, box['x'] + 200:width]
+        rois.append(roi)
+
+    return rois
+
+
+def draw_bounding_box(image):
+    height, width, _ = image.shape
+    x = int(0.35 * width)
+    y = int(0.25 * height)
+    box_width = int(width)
+    box_height = int(0.1 * height)
+
+    cv2.rectangle(image, (x, y), (x + box_width, y + box_height), (0, 255, 0), 2)
+
+    return (x, y, box_width, box_height)
+
+
+def save_image(image, filename, folder=None):
+    folder = folder or IMAGE_FOLDER
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    filepath = os.path.join(folder, filename)
+    cv2.imwrite(filepath, image)
+    return filepath
+
+
+def decode_page(image_bytes, file_name, timings=None):
+    pipeline = PreprocessingPipeline.from_bytes(image_bytes, timings)
+
+    if pipeline is None:
+        raise ValueError(f"Error: Unable to read image {file_name}")
+    return pipeline
+
+
+# CPU half of process_image. Only takes and returns picklable values so it
+# can run in a worker process. Cached artifacts ('skew_angle', 'orientation',
+# 'word_boxes') skip the matching steps.
+def extract_page(image_bytes, file_name, skew_engine="projection", save_original=True, artifacts=None):
+    timings = {}
+
+    # Decode once, the pipeline keeps the grayscale and colour buffers
+    pipeline = decode_page(image_bytes, file_name, timings)
+    return extract_decoded_page(pipeline, skew_engine, save_original, artifacts)
+
+
+def extract_decoded_page(pipeline, skew_engine="projection", save_original=True, artifacts=None,
+                         unique_filename=None):
+    timings = pipeline.timings
+    artifacts = artifacts or {}
+
+    # Generate a unique filename
+    unique_filename = unique_filename or f"{uuid.uuid4()}.png"
+
+    # Save the original image for preview
+    if save_original:
+        with timed(timings, 'save_original'):
+            get_artifact_sink().save(pipeline.color, f"original_{unique_filename}")
+
+    # Step 1: Correct skew and orientation, threshold for OCR
+    pipeline.correct_skew(engine=skew_engine, angle=artifacts.get('skew_angle'))
+    pipeline.correct_orientation(artifacts.get('orientation'))
+
+    # Step 2: Extract text and draw diagnosis box
+    extracted_data = artifacts.get('word_boxes')
+    if extracted_data is None:
+        pipeline.threshold()
+        with timed(timings, 'word_boxes'):
+            extracted_data = extract_text_with_boxes(pipeline.processed, pipeline.scale_factor)
+    extracted_image = pipeline.color
+
+    # Step 3: Draw bounding box or extract ROIs
+    rois = []
+    if pipeline.is_small:
+        bounding_box_coords = draw_bounding_box(extracted_image)
+        x, y, box_width, box_height = bounding_box_coords
+        roi = extracted_image[y:y + box_height, x:x + box_width]
+        if roi.size > 0:
+            rois.append(roi)
+    else:
+        rois = draw_provisional_diagnosis_box_and_extract_rois(extracted_image, extracted_data)
+
+    return {
+        'image': extracted_image,
+        'rois': rois,
+        'extracted_data': extracted_data,
+        'skew_angle': pipeline.skew_angle,
+        'orientation': pipeline.orientation,
+        'orientation_source': pipeline.orientation_source,
+        'unique_filename': unique_filename,
+        'timings': timings,
+    }
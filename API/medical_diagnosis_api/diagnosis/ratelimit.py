@@ -0,0 +1,204 @@
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Token buckets for the Azure and Gemini quotas. A caller reserves a token and
+# is told how long to wait for it, the wait happens outside any lock, so
+# concurrent callers queue up in order instead of all sleeping on the same
+# window and then bursting. The bucket state lives in a backend: per process
+# in memory, or in a SQLite file every worker process on the host shares.
+
+
+def refill(tokens, updated_at, now, capacity, rate):
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+def reservation(tokens, rate, max_wait):
+    # Tokens left after taking one and the seconds until that token exists,
+    # None when the wait would exceed max_wait
+    wait = max(0.0, (1 - tokens) / rate)
+    if max_wait is not None and wait > max_wait:
+        return tokens, None
+    return tokens - 1, wait
+
+
+class MemoryBucketBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def reserve(self, name, capacity, rate, max_wait=None):
+        now = time.time()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(name, (capacity, now))
+            tokens, wait = reservation(refill(tokens, updated_at, now, capacity, rate), rate, max_wait)
+            self.buckets[name] = (tokens, now)
+        return wait
+
+    def tokens(self, name, capacity, rate):
+        now = time.time()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(name, (capacity, now))
+        return refill(tokens, updated_at, now, capacity, rate)
+
+
+# One row per bucket, updated inside BEGIN IMMEDIATE so reservations from
+# different processes never interleave
+class SQLiteBucketBackend:
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def reserve(self, name, capacity, rate, max_wait=None):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self.conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens, wait = reservation(refill(tokens, updated_at, now, capacity, rate), rate, max_wait)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now)
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def tokens(self, name, capacity, rate):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        tokens, updated_at = row if row else (capacity, now)
+        return refill(tokens, updated_at, now, capacity, rate)
+
+
+def make_bucket_backend(name, path):
+    if name == 'memory':
+        return MemoryBucketBackend()
+    if name == 'sqlite':
+        return SQLiteBucketBackend(path)
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+_backend = None
+
+
+def get_bucket_backend():
+    global _backend
+    if _backend is None:
+        _backend = make_bucket_backend(settings.RATE_LIMIT_BACKEND, settings.RATE_LIMIT_PATH)
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_bucket_backend(setting, **kwargs):
+    global _backend
+    if setting.startswith('RATE_LIMIT_'):
+        _backend = None
+
+
+# max_requests per time_frame on average: tokens refill at the full quota
+# and up to `burst` of them can be spent at once after an idle spell
+class RateLimiter:
+    def __init__(self, name, max_requests, time_frame, burst=None, backend=None):
+        self.name = name
+        self.max_requests = max_requests
+        self.time_frame = time_frame
+        self.capacity = max(1, min(max_requests, burst if burst is not None else settings.RATE_LIMIT_BURST))
+        self.rate = max_requests / float(time_frame)
+        self._backend = backend
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def backend(self):
+        return self._backend or get_bucket_backend()
+
+    def _reserve(self, max_wait=None):
+        wait = self.backend.reserve(self.name, self.capacity, self.rate, max_wait)
+        with self.lock:
+            if wait is None:
+                self.rejected += 1
+            else:
+                self.acquired += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if wait > 0:
+                    self.waiting += 1
+        return wait
+
+    def _done_waiting(self):
+        with self.lock:
+            self.waiting -= 1
+
+    def wait_if_needed(self):
+        wait = self._reserve()
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    async def wait_if_needed_async(self):
+        # The SQLite backend blocks on its lock, reserve off the event loop
+        wait = await asyncio.to_thread(self._reserve)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    def try_acquire(self, max_wait=0):
+        # Takes a token only if one is available within max_wait seconds,
+        # waits for it and returns True, otherwise returns False at once
+        wait = self._reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+        return True
+
+    def expected_wait(self):
+        # Seconds a request made now would wait, without reserving anything
+        return max(0.0, (1 - self.backend.tokens(self.name, self.capacity, self.rate)) / self.rate)
+
+    def stats(self):
+        tokens = self.backend.tokens(self.name, self.capacity, self.rate)
+        with self.lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'capacity': self.capacity,
+                'per_minute': round(self.rate * 60, 2),
+                'tokens': round(max(tokens, 0.0), 2),
+                # Reservations not yet due, across every process sharing the bucket
+                'queue_depth': math.ceil(-tokens) if tokens < 0 else 0,
+                'waiting': self.waiting,
+                'next_wait': round(max(0.0, (1 - tokens) / self.rate), 3),
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'avg_wait': round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+                'max_wait': round(self.max_wait, 3),
+            }
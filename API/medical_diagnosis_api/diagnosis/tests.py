@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import ast
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from pathlib import Path
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .management.commands.benchmark_skew import make_synthetic_page
+from . import batch, tesseract_pool, utils
+from .artifacts import get_artifact_sink
+from .azure_read import AsyncReadClient, ReadClientThread, ReadError
+from .cache import MemoryCacheBackend, SQLiteCacheBackend, get_diagnosis_cache
+from .coalescer import RequestCoalescer
+from .icd10 import ICD10Index
+from .jobs import JobHeartbeat, ThreadJobBackend, recover_stale_jobs, run_job, start_job_backend
+from .models import Job
+from .ocr import OCRUnavailable, ctc_greedy_decode
+from .orientation import OrientationStats
+from .ratelimit import MemoryBucketBackend, RateLimiter, SQLiteBucketBackend
+from .pipeline import PreprocessingPipeline
+from .skew import estimate_skew
+
+# The Azure and Gemini limiters keep their buckets in memory during the
+# tests instead of in the rate_limit.sqlite3 file in BASE_DIR
+rate_limit_in_memory = override_settings(RATE_LIMIT_BACKEND='memory')
+
+
+def setUpModule():
+    rate_limit_in_memory.enable()
+
+
+def tearDownModule():
+    rate_limit_in_memory.disable()
+
+
+WORDS = ("patient name age provisional diagnosis hypertension type diabetes mellitus fever history "
+         "of present illness blood pressure pulse weight date signature tablets daily after food").split()
+
+
+def make_text_page(width, height, angle=0, seed=0):
+    # White page of printed words, rotated by angle degrees
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, np.uint8)
+    for y in range(100, height - 100, 45):
+        x = 60
+        while True:
+            word = str(rng.choice(WORDS))
+            word_width = cv2.getTextSize(word, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0][0]
+            if x + word_width > width - 60:
+                break
+            cv2.putText(page, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2, cv2.LINE_AA)
+            x += word_width + 20
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+    return cv2.warpAffine(page, M, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+def threshold(gray):
+    return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+
+class SkewEstimatorTests(SimpleTestCase):
+    def test_projection_engine_picks_same_angle_as_rotate(self):
+        thresh = threshold(make_synthetic_page(600, 900, 3))
+        self.assertEqual(round(estimate_skew(thresh, engine="projection")),
+                         round(estimate_skew(thresh, engine="rotate")))
+
+    def test_projection_engine_has_sub_degree_precision(self):
+        thresh = threshold(make_synthetic_page(600, 900, 2.4))
+        self.assertAlmostEqual(estimate_skew(thresh, engine="projection"), -2.4, delta=0.15)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            estimate_skew(threshold(make_synthetic_page(100, 100, 0)), engine="hough")
+
+
+class PreprocessingPipelineTests(SimpleTestCase):
+    def test_small_page_is_upscaled_for_ocr_only(self):
+        page = cv2.cvtColor(make_synthetic_page(400, 500, 2), cv2.COLOR_GRAY2BGR)
+        pipeline = PreprocessingPipeline.from_bytes(cv2.imencode('.png', page)[1].tobytes()).run()
+
+        self.assertEqual(pipeline.color.shape, page.shape)
+        self.assertEqual(pipeline.scale_factor, 2)
+        self.assertEqual(pipeline.processed.shape, (1000, 800))
+        self.assertAlmostEqual(pipeline.skew_angle, -2, delta=0.15)
+        self.assertTrue({'decode', 'skew', 'orientation', 'threshold'} <= set(pipeline.timings))
+
+    def test_undecodable_bytes(self):
+        self.assertIsNone(PreprocessingPipeline.from_bytes(b'not an image'))
+
+    @mock.patch('diagnosis.pipeline.tesseract_pool.image_to_osd')
+    def test_upright_page_skips_osd(self, image_to_osd):
+        page = cv2.cvtColor(make_text_page(1000, 1300, 2), cv2.COLOR_GRAY2BGR)
+        pipeline = PreprocessingPipeline(page).run()
+
+        image_to_osd.assert_not_called()
+        self.assertEqual((pipeline.orientation, pipeline.orientation_source), (0, 'precheck'))
+        self.assertNotIn('osd', pipeline.timings)
+
+    @mock.patch('diagnosis.pipeline.tesseract_pool.image_to_osd', return_value={'rotate': 90})
+    def test_sideways_page_goes_to_osd(self, image_to_osd):
+        page = cv2.cvtColor(np.rot90(make_text_page(1000, 1300)).copy(), cv2.COLOR_GRAY2BGR)
+        pipeline = PreprocessingPipeline(page).run()
+
+        image_to_osd.assert_called_once()
+        self.assertEqual((pipeline.orientation, pipeline.orientation_source), (90, 'osd'))
+        self.assertIn('osd', pipeline.timings)
+
+    @mock.patch('diagnosis.pipeline.tesseract_pool.image_to_osd', return_value={'rotate': 0})
+    def test_precheck_without_skew_profiles(self, image_to_osd):
+        # A cached skew angle skips the search, the pre-check takes its own profiles
+        page = cv2.cvtColor(make_text_page(1000, 1300), cv2.COLOR_GRAY2BGR)
+        pipeline = PreprocessingPipeline(page).run(skew_angle=0.0)
+
+        image_to_osd.assert_not_called()
+        self.assertEqual(pipeline.orientation_source, 'precheck')
+
+    def test_orientation_stats(self):
+        stats = OrientationStats()
+        for source in ('precheck', 'precheck', 'precheck', 'osd', 'cache', 'small'):
+            stats.record(source)
+        self.assertEqual(stats.stats(), {'precheck': 3, 'osd': 1, 'cache': 1, 'small': 1, 'osd_skip_rate': 0.75})
+
+
+RESULT = {
+    'file_name': 'page.png',
+    'extracted_diagnosis': 'HTN',
+    'corrected_diagnosis': 'Hypertension',
+    'icd10_code': 'I10',
+}
+
+
+def fake_process_image(image_file, timings=None, ocr_backend=None):
+    timings['gemini'] = 1.0
+    return dict(RESULT, file_name=image_file.name)
+
+
+@override_settings(JOB_BACKEND='immediate', JOB_CALLBACK_HOSTS=['.example.com'])
+@mock.patch('diagnosis.utils.process_image', side_effect=fake_process_image)
+class JobApiTests(TestCase):
+    def submit(self, **data):
+        data['image'] = SimpleUploadedFile('page.png', b'png bytes')
+        return self.client.post(reverse('job-submit'), data)
+
+    def test_submit_returns_job_id_and_status_has_result(self, process_image):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+
+        status = self.client.get(response.json()['status_url'])
+        self.assertEqual(status.json()['status'], Job.SUCCEEDED)
+        self.assertEqual(status.json()['result'], RESULT)
+        self.assertEqual(status['Server-Timing'], 'gemini;dur=1.0')
+
+    def test_failed_job_reports_error(self, process_image):
+        process_image.side_effect = ValueError('Error: Unable to read image page.png')
+        job_id = self.submit().json()['job_id']
+
+        status = self.client.get(reverse('job-status', args=[job_id])).json()
+        self.assertEqual(status['status'], Job.FAILED)
+        self.assertEqual(status['error'], 'Error: Unable to read image page.png')
+
+    @mock.patch('diagnosis.jobs.requests.post')
+    def test_callback_receives_status_payload(self, post, process_image):
+        job_id = self.submit(callback_url='https://claims.example.com/hook').json()['job_id']
+
+        post.assert_called_once()
+        self.assertEqual(post.call_args.args[0], 'https://claims.example.com/hook')
+        self.assertEqual(post.call_args.kwargs['json']['job_id'], job_id)
+        self.assertEqual(post.call_args.kwargs['json']['result'], RESULT)
+
+    def test_invalid_callback_url(self, process_image):
+        self.assertEqual(self.submit(callback_url='not a url').status_code, 400)
+
+    @mock.patch('diagnosis.jobs.requests.post')
+    def test_callback_host_must_be_allowed(self, post, process_image):
+        for url in ('http://169.254.169.254/latest/meta-data', 'http://localhost:8000/admin/',
+                    'https://example.com.evil.test/hook'):
+            self.assertEqual(self.submit(callback_url=url).status_code, 400)
+        post.assert_not_called()
+
+    def test_database_backend_leaves_job_for_run_jobs(self, process_image):
+        with self.settings(JOB_BACKEND='database'):
+            job_id = self.submit().json()['job_id']
+        self.assertEqual(Job.objects.get(pk=job_id).status, Job.QUEUED)
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        job = Job.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.result, job.image), (Job.SUCCEEDED, RESULT, None))
+        self.assertEqual(process_image.call_args.args[0].read(), b'png bytes')
+
+    @override_settings(JOB_STALE_AFTER=600, JOB_MAX_ATTEMPTS=2)
+    def test_jobs_of_a_stopped_worker_are_recovered(self, process_image):
+        old = timezone.now() - timedelta(hours=1)
+        interrupted = Job.objects.create(file_name='a.png', image=b'png bytes', status=Job.RUNNING, attempts=1)
+        given_up = Job.objects.create(file_name='b.png', image=b'png bytes', status=Job.RUNNING, attempts=2)
+        orphaned = Job.objects.create(file_name='c.png', image=b'png bytes')
+        running = Job.objects.create(file_name='d.png', image=b'png bytes', status=Job.RUNNING, attempts=1)
+        Job.objects.filter(pk__in=[interrupted.pk, given_up.pk, orphaned.pk]).update(updated_at=old)
+
+        self.assertEqual(recover_stale_jobs(), [interrupted.pk, orphaned.pk])
+        self.assertEqual(Job.objects.get(pk=given_up.pk).status, Job.FAILED)
+        self.assertEqual(Job.objects.get(pk=running.pk).status, Job.RUNNING)
+
+        run_job(interrupted.pk)
+        self.assertIsNone(run_job(interrupted.pk))  # already claimed and finished
+        self.assertEqual(Job.objects.get(pk=interrupted.pk).status, Job.SUCCEEDED)
+        self.assertEqual(Job.objects.get(pk=interrupted.pk).attempts, 2)
+
+    @mock.patch('diagnosis.jobs._backend', None)
+    @mock.patch('diagnosis.jobs.threading.Thread')
+    def test_thread_backend_recovers_jobs_at_startup(self, thread, process_image):
+        orphaned = Job.objects.create(file_name='c.png', image=b'png bytes')
+        Job.objects.filter(pk=orphaned.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        with self.settings(JOB_BACKEND='thread'), mock.patch.object(ThreadJobBackend, 'submit') as submit:
+            start_job_backend()
+        submit.assert_called_once_with(run_job, orphaned.pk)
+        # and keeps looking for stale jobs
+        self.assertEqual(thread.call_args.kwargs['args'], (settings.JOB_HEARTBEAT,))
+
+
+class JobHeartbeatTests(TransactionTestCase):
+    @override_settings(JOB_STALE_AFTER=600)
+    def test_long_running_job_is_not_recovered(self):
+        job = Job.objects.create(file_name='a.png', status=Job.RUNNING, attempts=1)
+        Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        with JobHeartbeat(job.pk, 0.05):
+            time.sleep(0.3)
+        self.assertEqual(recover_stale_jobs(), [])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+
+def fake_process_upload(file_name, image_bytes, ocr_backend=None):
+    if image_bytes == b'junk':
+        raise RuntimeError(f"Error: Unable to read image {file_name}")
+    return dict(RESULT, file_name=file_name)
+
+
+@mock.patch('diagnosis.batch._process_upload', side_effect=fake_process_upload)
+class BatchApiTests(TestCase):
+    def test_images_and_zip_stream_one_result_per_file(self, process_upload):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('claim/page_2.png', b'png bytes')
+            zf.writestr('claim/notes.txt', b'skipped')
+            zf.writestr('claim/page_3.jpg', b'junk')
+
+        response = self.client.post(reverse('process-image-batch'), {
+            'images': [SimpleUploadedFile('page_1.png', b'png bytes')],
+            'archive': SimpleUploadedFile('claim.zip', archive.getvalue()),
+        })
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        results = {line['file_name']: line for line in lines}
+        self.assertEqual(set(results), {'page_1.png', 'page_2.png', 'page_3.jpg'})
+        self.assertEqual(results['page_2.png']['icd10_code'], 'I10')
+        self.assertEqual(results['page_3.jpg']['error'], 'Error: Unable to read image page_3.jpg')
+
+    def test_bad_zip(self, process_upload):
+        response = self.client.post(reverse('process-image-batch'), {
+            'archive': SimpleUploadedFile('claim.zip', b'not a zip'),
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(BATCH_PROCESSES=1, ARTIFACT_SINK='none')
+class BatchProcessPoolTests(SimpleTestCase):
+    def setUp(self):
+        # Workers are spawned and read settings from the environment
+        patcher = mock.patch.dict(os.environ, {'ARTIFACT_SINK': 'none'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, batch, '_process_pool', None)
+
+    def tearDown(self):
+        if batch._process_pool is not None:
+            batch._process_pool.shutdown()
+
+    def test_page_runs_through_the_real_pool(self):
+        # Cached word boxes keep tesseract out of the worker
+        page = cv2.cvtColor(make_synthetic_page(400, 500, 2), cv2.COLOR_GRAY2BGR)
+        artifacts = {'word_boxes': [{'text': 'Diagnosis', 'box': {'x': 10, 'y': 30, 'width': 50, 'height': 10}}]}
+        with mock.patch.object(utils, 'lookup_page', return_value=('key', artifacts)), \
+                mock.patch.object(utils, 'complete_page', side_effect=lambda name, page, *args: page) as complete, \
+                mock.patch('diagnosis.batch.decode_page', wraps=batch.decode_page) as decode:
+            result = batch._process_upload('page.png', cv2.imencode('.png', page)[1].tobytes())
+
+        decode.assert_called_once()
+        complete.assert_called_once()
+        # The page itself stays in the worker
+        self.assertNotIn('image', result)
+        self.assertAlmostEqual(result['skew_angle'], -2, delta=0.15)
+        self.assertEqual(result['orientation_source'], 'small')
+        self.assertEqual(len(result['rois']), 1)
+
+    def test_broken_pool_is_shut_down_and_replaced(self):
+        broken = mock.Mock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool()
+        batch._process_pool = broken
+        page = cv2.imencode('.png', make_synthetic_page(200, 200, 0))[1].tobytes()
+        with mock.patch.object(utils, 'lookup_page', return_value=('key', {})):
+            with self.assertRaises(BrokenProcessPool):
+                batch._process_upload('page.png', page)
+
+        broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertIsNone(batch._process_pool)
+
+    def test_thread_pool_is_created_once(self):
+        self.addCleanup(setattr, batch, '_thread_pool', batch._thread_pool)
+        batch._thread_pool = None
+        with ThreadPoolExecutor(8) as pool:
+            pools = set(pool.map(lambda _: batch.get_thread_pool(), range(32)))
+        self.assertEqual(len(pools), 1)
+        pools.pop().shutdown()
+
+
+class CacheBackendTests(SimpleTestCase):
+    def check_backend(self, backend):
+        backend.set('a', {'result': 1})
+        backend.set('b', {'result': 2})
+        self.assertEqual(backend.get('a'), {'result': 1})
+        backend.set('c', {'result': 3})
+
+        # 'b' was least recently used
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.evictions, 1)
+
+    def test_memory_lru(self):
+        self.check_backend(MemoryCacheBackend(max_entries=2))
+
+    def test_sqlite_lru(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteCacheBackend(os.path.join(tmp, 'cache.sqlite3'), max_entries=2)
+            self.check_backend(backend)
+            backend.conn.close()
+
+    def test_ttl(self):
+        backend = MemoryCacheBackend(ttl=-1)
+        backend.set('a', {'result': 1})
+        self.assertIsNone(backend.get('a'))
+
+    def check_concurrent_updates(self, backends):
+        # Every field lands although all threads update the same entry
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: backends[i % len(backends)].update('page', {f'field{i}': i}), range(40)))
+        self.assertEqual(backends[0].get('page'), {f'field{i}': i for i in range(40)})
+
+    def test_memory_update_is_atomic(self):
+        self.check_concurrent_updates([MemoryCacheBackend()])
+
+    def test_sqlite_update_is_atomic_across_connections(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite3')
+            # One connection per worker process sharing the file
+            backends = [SQLiteCacheBackend(path), SQLiteCacheBackend(path)]
+            self.check_concurrent_updates(backends)
+            indexes = {row[0] for row in backends[0].conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            self.assertIn('cache_expires_at', indexes)
+            for backend in backends:
+                backend.conn.close()
+
+
+@override_settings(RESULT_CACHE_BACKEND='memory', DIAGNOSIS_CACHE_BACKEND='memory', ARTIFACT_SINK='none')
+class ResultCacheTests(SimpleTestCase):
+    def test_resubmitted_page_skips_ocr_and_gemini(self):
+        page = cv2.cvtColor(make_synthetic_page(400, 500, 2), cv2.COLOR_GRAY2BGR)
+        png = cv2.imencode('.png', page)[1].tobytes()
+        boxes = {'text': ['Diagnosis'], 'left': [10], 'top': [30], 'width': [50], 'height': [10]}
+
+        with mock.patch('diagnosis.pipeline.tesseract_pool.image_to_data', return_value=boxes) as word_boxes, \
+                mock.patch.object(utils, 'read_roi', return_value=('HTN', 'azure')) as read, \
+                mock.patch.object(utils, 'get_formatted_data_from_gemini',
+                                  return_value={'provisional_diagnosis': 'Hypertension', 'ICD10_code': 'I10'}) as gemini:
+            first = utils.process_image(SimpleUploadedFile('first.png', png))
+            # Same pixels, different encoding and name
+            second = utils.process_image(SimpleUploadedFile('second.bmp', cv2.imencode('.bmp', page)[1].tobytes()))
+
+        self.assertEqual(second, dict(first, file_name='second.bmp'))
+        self.assertEqual((word_boxes.call_count, read.call_count, gemini.call_count), (1, 1, 1))
+        stats = self.client.get(reverse('cache-stats')).json()['result_cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_failed_ocr_is_not_cached(self):
+        # Own result cache, the other test counts hits and misses
+        self.enterContext(self.settings(RESULT_CACHE_MAX_ENTRIES=10))
+        page = cv2.cvtColor(make_synthetic_page(400, 500, 2), cv2.COLOR_GRAY2BGR)
+        png = cv2.imencode('.png', page)[1].tobytes()
+        boxes = {'text': ['Diagnosis'], 'left': [10], 'top': [30], 'width': [50], 'height': [10]}
+
+        with mock.patch('diagnosis.pipeline.tesseract_pool.image_to_data', return_value=boxes), \
+                mock.patch.object(utils, 'read_roi', side_effect=[('', None), ('HTN', 'azure')]) as read, \
+                mock.patch.object(utils, 'get_formatted_data_from_gemini',
+                                  return_value={'provisional_diagnosis': 'Hypertension', 'ICD10_code': 'I10'}):
+            utils.process_image(SimpleUploadedFile('first.png', png))
+            second = utils.process_image(SimpleUploadedFile('second.png', png))
+
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual((second['extracted_diagnosis'], second['ocr_backend']), ('HTN', 'azure'))
+
+    def test_result_is_cached_per_requested_ocr_backend(self):
+        self.enterContext(self.settings(RESULT_CACHE_MAX_ENTRIES=10))
+        page = cv2.cvtColor(make_synthetic_page(400, 500, 2), cv2.COLOR_GRAY2BGR)
+        png = cv2.imencode('.png', page)[1].tobytes()
+        boxes = {'text': ['Diagnosis'], 'left': [10], 'top': [30], 'width': [50], 'height': [10]}
+
+        with mock.patch('diagnosis.pipeline.tesseract_pool.image_to_data', return_value=boxes) as word_boxes, \
+                mock.patch.object(utils, 'read_roi', side_effect=[('HTN', 'azure'), ('HIN', 'tesseract')]) as read, \
+                mock.patch.object(utils, 'get_formatted_data_from_gemini',
+                                  return_value={'provisional_diagnosis': 'Hypertension', 'ICD10_code': 'I10'}):
+            utils.process_image(SimpleUploadedFile('first.png', png))
+            tesseract = utils.process_image(SimpleUploadedFile('second.png', png), ocr_backend='tesseract')
+            again = utils.process_image(SimpleUploadedFile('third.png', png), ocr_backend='tesseract')
+
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(read.call_args.args[1], 'tesseract')
+        self.assertEqual(tesseract['ocr_backend'], 'tesseract')
+        self.assertEqual(again, dict(tesseract, file_name='third.png'))
+        # The page geometry is shared by every backend
+        self.assertEqual(word_boxes.call_count, 1)
+
+
+@override_settings(DIAGNOSIS_CACHE_BACKEND='memory', ICD10_INDEX_PATH='')
+@mock.patch.object(utils.gemini_limiter, 'wait_if_needed')
+@mock.patch.object(utils.model, 'generate_content')
+class DiagnosisCacheTests(SimpleTestCase):
+    def test_seeded_diagnosis_skips_gemini_and_limiter(self, generate_content, wait_if_needed):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'seed.csv')
+        with open(path, 'w') as f:
+            f.write("diagnosis,icd10_code,corrected_diagnosis\nHTN,I10,\nT2DM,E11.9,Type 2 diabetes mellitus\n")
+        self.assertEqual(get_diagnosis_cache().seed_from_csv(path), 2)
+
+        self.assertEqual(utils.get_formatted_data_from_gemini("  htn\n"),
+                         {'provisional_diagnosis': 'HTN', 'ICD10_code': 'I10'})
+        self.assertEqual(utils.get_formatted_data_from_gemini("t2dm")['ICD10_code'], 'E11.9')
+        generate_content.assert_not_called()
+        wait_if_needed.assert_not_called()
+
+    def test_empty_text_is_never_cached(self, generate_content, wait_if_needed):
+        generate_content.return_value.text = '{"provisional_diagnosis": "Unspecified diagnosis", "ICD10_code": "R69"}'
+
+        utils.get_formatted_data_from_gemini("")
+        utils.get_formatted_data_from_gemini(" \n")
+
+        self.assertEqual(generate_content.call_count, 2)
+        self.assertEqual(get_diagnosis_cache().stats()['entries'], 0)
+
+    def test_gemini_answer_is_memoized(self, generate_content, wait_if_needed):
+        generate_content.return_value.text = '{"provisional_diagnosis": "AGE", "ICD10_code": "A09"}'
+
+        first = utils.get_formatted_data_from_gemini("AGE")
+        second = utils.get_formatted_data_from_gemini("age ")
+
+        self.assertEqual(first, second)
+        self.assertEqual(generate_content.call_count, 1)
+        self.assertEqual(get_diagnosis_cache().stats()['hits'], 1)
+
+
+class RequestCoalescerTests(SimpleTestCase):
+    def test_concurrent_items_share_one_batch(self):
+        batches = []
+
+        def send_batch(items):
+            batches.append(items)
+            return [item.upper() for item in items]
+
+        coalescer = RequestCoalescer(send_batch, max_batch_size=10, max_wait=0.5)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            answers = list(pool.map(lambda text: coalescer.submit(text).result(), ['htn', 't2dm', 'htn', 'age']))
+
+        self.assertEqual(answers, ['HTN', 'T2DM', 'HTN', 'AGE'])
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted(batches[0]), ['age', 'htn', 't2dm'])
+
+    def test_max_batch_size(self):
+        coalescer = RequestCoalescer(lambda items: items, max_batch_size=2, max_wait=0.5)
+        futures = [coalescer.submit(i) for i in range(5)]
+        self.assertEqual([future.result() for future in futures], list(range(5)))
+        self.assertEqual(coalescer.batches_sent, 3)
+
+    def test_failed_batch_fails_every_caller(self):
+        coalescer = RequestCoalescer(lambda items: [], max_wait=0)
+        with self.assertRaises(ValueError):
+            coalescer.submit('htn').result()
+
+
+ICD10_SOURCE = [
+    ('I10', 'Essential (primary) hypertension'),
+    ('I97.3', 'Postprocedural hypertension'),
+    ('E11.9', 'Type 2 diabetes mellitus without complications'),
+    ('A09', 'Infectious gastroenteritis and colitis, unspecified'),
+    ('N39.0', 'Urinary tract infection, site not specified'),
+    ('H26.8', 'Other specified cataract'),
+    ('H26.9', 'Unspecified cataract'),
+    ('J18.9', 'Pneumonia, unspecified organism'),
+    ('A90', 'Dengue fever [classical dengue]'),
+    ('A91', 'Dengue hemorrhagic fever'),
+]
+
+
+class ICD10IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = ICD10Index.build(ICD10_SOURCE)
+
+    def test_abbreviations_and_general_codes_match_exactly(self):
+        for text, code in [('HTN', 'I10'), ('Hypertension', 'I10'), ('T2DM', 'E11.9'), ('Known case of HTN', 'I10'),
+                           ('uti', 'N39.0'), ('Cataract', 'H26.9'), ('Provisional diagnosis: Pneumonia', 'J18.9'),
+                           ('Provisional diagnosis: UTI', 'N39.0')]:
+            match = self.index.lookup(text)
+            self.assertEqual((match.code, match.confidence), (code, 1.0), text)
+
+    def test_abbreviation_inside_a_term_is_not_expanded(self):
+        # "age" here is the patient's age, not gastroenteritis
+        for text in ('age 45', 'Age 45 yrs male', 'uti symptoms since age 5'):
+            match = self.index.lookup(text)
+            self.assertTrue(match is None or match.confidence < 0.9, (text, match))
+        self.assertNotIn('dm', self.index.abbreviations)
+
+    def test_misspelling_is_matched_with_lower_confidence(self):
+        match = self.index.lookup('Hypertensoin')
+        self.assertEqual(match.code, 'I10')
+        self.assertLess(match.confidence, 1.0)
+
+    def test_unknown_text(self):
+        self.assertIsNone(self.index.lookup('xyzzy'))
+        self.assertIsNone(self.index.lookup(''))
+        self.assertLess(self.index.lookup('dengue with rash').confidence, 0.9)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'icd10_index.pkl')
+            self.index.save(path)
+            self.assertEqual(ICD10Index.load(path).lookup('Dengue fever').code, 'A90')
+
+
+@override_settings(DIAGNOSIS_CACHE_BACKEND='memory', RATE_LIMIT_BACKEND='memory')
+@mock.patch.object(utils.model, 'generate_content')
+class ICD10FastPathTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'icd10_index.pkl')
+        ICD10Index.build(ICD10_SOURCE).save(self.path)
+
+    def test_confident_match_skips_gemini(self, generate_content):
+        with self.settings(ICD10_INDEX_PATH=self.path):
+            self.assertEqual(utils.get_formatted_data_from_gemini(" HTN \n"),
+                             {'provisional_diagnosis': 'HTN', 'ICD10_code': 'I10'})
+        generate_content.assert_not_called()
+
+    def test_uncertain_match_goes_to_gemini(self, generate_content):
+        generate_content.return_value.text = '{"provisional_diagnosis": "Dengue with rash", "ICD10_code": "A90"}'
+        with self.settings(ICD10_INDEX_PATH=self.path, GEMINI_BATCH_SIZE=1):
+            self.assertEqual(utils.get_formatted_data_from_gemini("dengue with rash")['ICD10_code'], 'A90')
+        self.assertEqual(generate_content.call_count, 1)
+
+
+@override_settings(DIAGNOSIS_CACHE_BACKEND='memory', ICD10_INDEX_PATH='', GEMINI_BATCH_SIZE=10, GEMINI_BATCH_WAIT=0.5)
+@mock.patch.object(utils.gemini_limiter, 'wait_if_needed')
+@mock.patch.object(utils.model, 'generate_content')
+class GeminiBatchTests(SimpleTestCase):
+    def setUp(self):
+        utils._gemini_coalescer = None
+
+    def test_concurrent_diagnoses_use_one_prompt(self, generate_content, wait_if_needed):
+        def answer(prompt):
+            items = json.loads(prompt.split("Texts to analyze:")[1].split("Please return")[0])
+            response = mock.Mock()
+            response.text = json.dumps([{'id': item['id'], 'provisional_diagnosis': item['text'].upper(),
+                                         'ICD10_code': 'X' + str(item['id'])} for item in items])
+            return response
+
+        generate_content.side_effect = answer
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(utils.get_formatted_data_from_gemini, ['htn', 't2dm', 'age']))
+
+        self.assertEqual([result['provisional_diagnosis'] for result in results], ['HTN', 'T2DM', 'AGE'])
+        self.assertEqual(generate_content.call_count, 1)
+        self.assertEqual(wait_if_needed.call_count, 1)
+
+    def test_one_coalescer_per_process(self, generate_content, wait_if_needed):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            coalescers = set(pool.map(lambda _: utils.get_gemini_coalescer(), range(32)))
+        self.assertEqual(len(coalescers), 1)
+
+
+@override_settings(DIAGNOSIS_CACHE_BACKEND='memory', ICD10_INDEX_PATH='')
+@mock.patch.object(utils.model, 'generate_content')
+class GeminiUnbatchedTests(SimpleTestCase):
+    @mock.patch.object(utils, 'get_gemini_coalescer')
+    def test_single_request_does_not_wait_for_a_batch_by_default(self, get_gemini_coalescer, generate_content):
+        generate_content.return_value.text = '{"provisional_diagnosis": "Hypertension", "ICD10_code": "I10"}'
+        with mock.patch.object(utils.gemini_limiter, 'wait_if_needed'):
+            self.assertEqual(utils.get_formatted_data_from_gemini('htn')['ICD10_code'], 'I10')
+        get_gemini_coalescer.assert_not_called()
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_burst_then_spaced(self):
+        limiter = RateLimiter('test', 60, 60, burst=2, backend=MemoryBucketBackend())
+        waits = [limiter._reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 1.0, places=2)
+        self.assertAlmostEqual(waits[3], 2.0, places=2)
+        self.assertEqual(limiter.stats()['queue_depth'], 2)
+
+    def test_refills_at_the_full_quota(self):
+        limiter = RateLimiter('test', 15, 60, burst=3, backend=MemoryBucketBackend())
+        self.assertEqual(limiter.stats()['per_minute'], 15)
+
+    def test_concurrent_callers_never_share_a_token(self):
+        limiter = RateLimiter('test', 60, 60, burst=5, backend=MemoryBucketBackend())
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            waits = sorted(pool.map(lambda _: limiter._reserve(), range(40)))
+        self.assertEqual(waits.count(0.0), 5)
+        self.assertEqual(len(set(round(wait, 6) for wait in waits[5:])), 35)
+
+    def test_try_acquire_does_not_queue(self):
+        limiter = RateLimiter('test', 2, 60, burst=1, backend=MemoryBucketBackend())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual((limiter.acquired, limiter.rejected), (1, 1))
+        self.assertEqual(limiter.stats()['queue_depth'], 0)
+
+    def test_sqlite_budget_is_shared(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'rate_limit.sqlite3')
+            first = RateLimiter('gemini', 15, 60, burst=3, backend=SQLiteBucketBackend(path))
+            second = RateLimiter('gemini', 15, 60, burst=3, backend=SQLiteBucketBackend(path))
+            self.assertTrue(first.try_acquire())
+            self.assertTrue(second.try_acquire())
+            self.assertTrue(first.try_acquire())
+            self.assertFalse(second.try_acquire())
+            first.backend.conn.close()
+            second.backend.conn.close()
+
+    def test_async_variant(self):
+        limiter = RateLimiter('test', 11, 1, burst=1, backend=MemoryBucketBackend())
+
+        async def acquire_two():
+            return [await limiter.wait_if_needed_async() for _ in range(2)]
+
+        with mock.patch('diagnosis.ratelimit.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+            waits = asyncio.run(acquire_two())
+        self.assertEqual(waits[0], 0.0)
+        self.assertGreater(waits[1], 0.0)
+        self.assertEqual(limiter.waiting, 0)
+        self.assertEqual(to_thread.call_count, 2)
+
+
+# Minimal stand-in for the Read API: every operation reports 'running' for
+# `pending_polls` polls, then returns the submitted bytes as one text line
+class FakeReadServer:
+    def __init__(self, pending_polls=2, retry_after=None, throttle_submits=0, throttle_polls=False):
+        self.pending_polls = pending_polls
+        self.retry_after = retry_after
+        self.throttle_submits = throttle_submits
+        self.throttle_polls = throttle_polls
+        self.operations = {}
+        self.submits = 0
+        self.polls = 0
+        self.app = web.Application()
+        self.app.router.add_post('/vision/v3.2/read/analyze', self.analyze)
+        self.app.router.add_get('/vision/v3.2/read/analyzeResults/{id}', self.result)
+
+    async def analyze(self, request):
+        self.submits += 1
+        if self.throttle_submits:
+            self.throttle_submits -= 1
+            return web.Response(status=429, headers={'Retry-After': '0'})
+        operation_id = str(len(self.operations))
+        self.operations[operation_id] = [(await request.read()).decode(), 0]
+        location = f"{request.scheme}://{request.host}/vision/v3.2/read/analyzeResults/{operation_id}"
+        return web.Response(status=202, headers={'Operation-Location': location})
+
+    async def result(self, request):
+        self.polls += 1
+        if self.throttle_polls:
+            return web.Response(status=429, headers={'Retry-After': '0.05'})
+        operation = self.operations[request.match_info['id']]
+        operation[1] += 1
+        if operation[1] <= self.pending_polls:
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+            return web.json_response({'status': 'running'}, headers=headers)
+        lines = [{'text': operation[0]}]
+        return web.json_response({'status': 'succeeded', 'analyzeResult': {'readResults': [{'lines': lines}]}})
+
+    async def read(self, images, **kwargs):
+        async with TestServer(self.app) as server:
+            client = AsyncReadClient(str(server.make_url('')), 'key', min_poll=0.01, max_poll=0.05, **kwargs)
+            try:
+                return client, await client.read_many(images)
+            finally:
+                await client.close()
+
+
+class AsyncReadClientTests(SimpleTestCase):
+    def test_concurrent_operations_and_polls_are_not_metered(self):
+        fake = FakeReadServer(pending_polls=3)
+        limiter = RateLimiter('vision', 1000, 60, burst=100, backend=MemoryBucketBackend())
+        client, texts = asyncio.run(fake.read([f"roi {i}".encode() for i in range(10)], limiter=limiter))
+
+        self.assertEqual(texts, [f"roi {i}" for i in range(10)])
+        self.assertEqual(limiter.acquired, 10)
+        self.assertEqual((fake.submits, fake.polls), (10, 40))
+        self.assertEqual(client.in_flight, 0)
+
+    def test_retry_after_is_honoured(self):
+        fake = FakeReadServer(pending_polls=1, retry_after=0.3)
+        with mock.patch('diagnosis.azure_read.asyncio.sleep', wraps=asyncio.sleep) as sleep:
+            client, texts = asyncio.run(fake.read([b'htn']))
+        self.assertEqual(texts, ['htn'])
+        self.assertIn(mock.call(0.3), sleep.call_args_list)
+
+    def test_throttled_submit_is_retried(self):
+        fake = FakeReadServer(pending_polls=0, throttle_submits=1)
+        client, texts = asyncio.run(fake.read([b't2dm']))
+        self.assertEqual(texts, ['t2dm'])
+        self.assertEqual(fake.submits, 2)
+
+    def test_timeout(self):
+        fake = FakeReadServer(pending_polls=1000)
+        client, results = asyncio.run(fake.read([b'age'], timeout=0.2))
+        self.assertIsInstance(results[0], ReadError)
+
+    def test_timeout_while_polls_are_throttled(self):
+        fake = FakeReadServer(throttle_polls=True)
+        started = time.monotonic()
+        client, results = asyncio.run(fake.read([b'htn'], timeout=0.2))
+        self.assertIsInstance(results[0], ReadError)
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class ReadClientThreadTests(SimpleTestCase):
+    class HangingClient:
+        timeout = 0.1
+
+        async def read(self, image):
+            await asyncio.sleep(60)
+
+        async def close(self):
+            pass
+
+    def test_read_gives_up_after_the_client_timeout(self):
+        thread = ReadClientThread(self.HangingClient())
+        self.addCleanup(thread.stop)
+        with mock.patch('diagnosis.azure_read.READ_TIMEOUT_MARGIN', 0.1):
+            with self.assertRaises(ReadError):
+                thread.read(b'htn')
+
+
+class ArtifactSinkTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def page(self):
+        return cv2.cvtColor(make_synthetic_page(200, 300, 0), cv2.COLOR_GRAY2BGR)
+
+    @override_settings(VISION_KEY='k', VISION_ENDPOINT='https://x.example')
+    def test_rois_are_sent_from_memory(self):
+        rois = [self.page()[:80, :120], self.page()[:0, :0]]
+        client = mock.Mock()
+        client.read.return_value = 'HTN'
+        with self.settings(ARTIFACT_SINK='sync', ARTIFACT_FOLDER=self.folder, OCR_BACKENDS=['azure']), \
+                mock.patch.object(utils, '_read_client', client), \
+                mock.patch.object(utils.vision_limiter, 'expected_wait', return_value=0.0):
+            self.assertEqual(utils.read_handwritten_diagnosis('page.png', rois, {}), ('HTN', 'azure'))
+
+        (buffer,), _ = client.read.call_args
+        self.assertIsInstance(buffer, memoryview)
+        self.assertEqual(cv2.imdecode(buffer.obj, cv2.IMREAD_COLOR).shape, (80, 120, 3))
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_async_sink_copies_and_writes_in_background(self):
+        with self.settings(ARTIFACT_SINK='async', ARTIFACT_FOLDER=self.folder):
+            sink = get_artifact_sink()
+            image = self.page()
+            sink.save(image, 'processed_a.png')
+            image[:] = 0
+            sink.flush()
+        self.assertEqual(os.listdir(self.folder), ['processed_a.png'])
+        self.assertGreater(cv2.imread(os.path.join(self.folder, 'processed_a.png')).max(), 0)
+        self.assertEqual(sink.stats()['written'], 1)
+
+    def test_disabled_sink(self):
+        with self.settings(ARTIFACT_SINK='none', ARTIFACT_FOLDER=self.folder):
+            self.assertIsNone(get_artifact_sink().save(self.page(), 'processed_a.png'))
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+@override_settings(OCR_BACKENDS=['azure', 'tesseract'], OCR_FALLBACK_MAX_WAIT=5)
+@mock.patch('diagnosis.ocr.tesseract_pool.image_to_string', return_value='T2DM\n')
+class OCRBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.roi = cv2.cvtColor(make_synthetic_page(80, 200, 0), cv2.COLOR_GRAY2BGR)
+        self.read_client = mock.Mock()
+        self.read_client.read.return_value = 'HTN'
+        patcher = mock.patch.object(utils, '_read_client', self.read_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(VISION_KEY='k', VISION_ENDPOINT='https://x.example')
+    def test_azure_first(self, image_to_string):
+        with mock.patch.object(utils.vision_limiter, 'expected_wait', return_value=0.0):
+            self.assertEqual(utils.read_roi(self.roi), ('HTN', 'azure'))
+        image_to_string.assert_not_called()
+
+    @override_settings(VISION_KEY='k', VISION_ENDPOINT='https://x.example')
+    def test_encoded_image_goes_to_azure_as_is(self, image_to_string):
+        png = cv2.imencode('.png', self.roi)[1].tobytes()
+        with mock.patch.object(utils.vision_limiter, 'expected_wait', return_value=0.0), \
+                mock.patch('diagnosis.ocr.encode_image') as encode, mock.patch('diagnosis.ocr.cv2.imdecode') as decode:
+            self.assertEqual(utils.extract_handwritten_text(png), 'HTN')
+        self.read_client.read.assert_called_once_with(png)
+        encode.assert_not_called()
+        decode.assert_not_called()
+
+    def test_encoded_image_is_decoded_for_fallbacks(self, image_to_string):
+        png = cv2.imencode('.png', self.roi)[1].tobytes()
+        self.assertEqual(utils.extract_handwritten_text(png, ocr_backend='tesseract'), 'T2DM')
+        self.assertEqual(image_to_string.call_args.args[0].shape, self.roi.shape[:2])
+
+    def test_falls_back_when_rate_budget_is_spent(self, image_to_string):
+        with mock.patch.object(utils.vision_limiter, 'expected_wait', return_value=30.0):
+            self.assertEqual(utils.read_roi(self.roi), ('T2DM', 'tesseract'))
+        self.read_client.read.assert_not_called()
+
+    def test_falls_back_on_error(self, image_to_string):
+        self.read_client.read.side_effect = RuntimeError('Read submit failed with 500')
+        with mock.patch.object(utils.vision_limiter, 'expected_wait', return_value=0.0):
+            self.assertEqual(utils.read_roi(self.roi), ('T2DM', 'tesseract'))
+
+    def test_requested_backend_goes_first(self, image_to_string):
+        self.assertEqual(utils.read_roi(self.roi, 'tesseract'), ('T2DM', 'tesseract'))
+        self.read_client.read.assert_not_called()
+
+    def test_local_backend_needs_a_model(self, image_to_string):
+        with self.settings(OCR_BACKENDS=['local'], LOCAL_OCR_MODEL_PATH=''):
+            with self.assertRaises(OCRUnavailable):
+                utils.ocr_backends.read(self.roi)
+
+    def test_local_backend_runs_tflite_export(self, image_to_string):
+        # 'ab' charset, outputs decode to "ab"
+        interpreter = mock.Mock()
+        interpreter.get_input_details.return_value = [{'index': 0, 'shape': np.array([1, 32, 128, 1])}]
+        interpreter.get_output_details.return_value = [{'index': 1}]
+        interpreter.get_tensor.return_value = np.eye(3)[[0, 2, 1, 1]][np.newaxis]
+        litert = mock.Mock()
+        litert.interpreter.Interpreter.return_value = interpreter
+        backend = utils.ocr_backends.backends['local']
+        self.addCleanup(setattr, backend, 'model', None)
+        with mock.patch.dict('sys.modules', {'ai_edge_litert': litert, 'ai_edge_litert.interpreter': litert.interpreter}):
+            with self.settings(OCR_BACKENDS=['local'], LOCAL_OCR_MODEL_PATH='model.int8.tflite', LOCAL_OCR_CHARSET='ab'):
+                self.assertEqual(utils.ocr_backends.read(self.roi), ('ab', 'local'))
+        self.assertEqual(interpreter.set_tensor.call_args[0][1].shape, (1, 32, 128, 1))
+
+    def test_unknown_backend_is_rejected(self, image_to_string):
+        response = self.client.post(reverse('process-image'), {
+            'image': SimpleUploadedFile('page.png', b'png bytes'),
+            'ocr_backend': 'abbyy',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_ctc_greedy_decode(self, image_to_string):
+        charset = 'ab'
+        # a a blank a b b blank -> "aab"
+        steps = [0, 0, 2, 0, 1, 1, 2]
+        self.assertEqual(ctc_greedy_decode(np.eye(3)[steps], charset), 'aab')
+
+
+class FakeWordIterator:
+    # Words as (text, box, beginnings of block/paragraph/line), like tesserocr's
+    # result iterator at word level
+    def __init__(self, words):
+        self.words = words
+        self.word = None
+
+    def IsAtBeginningOf(self, level):
+        return level in self.word[2]
+
+    def BoundingBox(self, level):
+        return self.word[1]
+
+    def Confidence(self, level):
+        return 90.0
+
+    def GetUTF8Text(self, level):
+        return self.word[0]
+
+
+def fake_tesserocr(words, osd=None):
+    module = mock.Mock()
+    module.RIL.BLOCK, module.RIL.PARA, module.RIL.TEXTLINE, module.RIL.WORD = 'block', 'para', 'line', 'word'
+    iterator = FakeWordIterator(words)
+
+    def iterate_level(it, level):
+        for word in words:
+            iterator.word = word
+            yield iterator
+
+    module.iterate_level = iterate_level
+    module.PyTessBaseAPI.return_value.GetIterator.return_value = iterator
+    module.PyTessBaseAPI.return_value.DetectOrientationScript.return_value = osd
+    return module
+
+
+# tesserocr stand-in the spawned pool workers import: the engine answers with
+# the worker's pid and the first pixel and shape of the page it was sent
+FAKE_TESSEROCR = '''
+import os
+
+
+class PyTessBaseAPI:
+    def __init__(self, lang, oem, **kwargs):
+        self.page = None
+
+    def SetPageSegMode(self, psm):
+        pass
+
+    def SetImageBytes(self, data, width, height, channels, bytes_per_line):
+        self.page = (list(data[:channels]), width, height, channels)
+
+    def GetUTF8Text(self):
+        return repr((os.getpid(),) + self.page)
+'''
+
+
+@mock.patch.object(tesseract_pool, 'TESSERACT_WORKERS', 0)
+class TesseractPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(vars(tesseract_pool._local).clear)
+        self.page = np.zeros((20, 30), np.uint8)
+
+    def test_word_boxes_numbered_like_tesseract(self):
+        words = [('Provisional', (1, 2, 11, 12), {'block', 'para', 'line'}),
+                 ('Diagnosis', (13, 2, 23, 12), set()),
+                 ('HTN', (1, 20, 9, 30), {'line'}),
+                 ('Rx', (1, 40, 5, 50), {'block', 'para', 'line'})]
+        with mock.patch.object(tesseract_pool, 'tesserocr', fake_tesserocr(words)):
+            data = tesseract_pool.image_to_data(self.page, config="--psm 6 --oem 3")
+        self.assertEqual(data['text'], ['Provisional', 'Diagnosis', 'HTN', 'Rx'])
+        self.assertEqual(list(zip(data['block_num'], data['par_num'], data['line_num'], data['word_num'])),
+                         [(1, 1, 1, 1), (1, 1, 1, 2), (1, 1, 2, 1), (2, 1, 1, 1)])
+        self.assertEqual((data['left'][1], data['top'][1], data['width'][1], data['height'][1]), (13, 2, 10, 10))
+
+    def test_engine_is_reused_and_page_sent_as_raw_buffer(self):
+        tesserocr = fake_tesserocr([])
+        with mock.patch.object(tesseract_pool, 'tesserocr', tesserocr):
+            tesseract_pool.image_to_string(self.page, config="--psm 6")
+            tesseract_pool.image_to_string(self.page, config="--psm 7")
+        engine = tesserocr.PyTessBaseAPI.return_value
+        self.assertEqual(tesserocr.PyTessBaseAPI.call_count, 1)
+        self.assertEqual([c.args[0] for c in engine.SetPageSegMode.call_args_list], [6, 7])
+        self.assertEqual(engine.SetImageBytes.call_args.args[1:], (30, 20, 1, 30))
+
+    def test_osd_rotation(self):
+        osd = {'orient_deg': 90, 'orient_conf': 12.5, 'script_name': 'Latin', 'script_conf': 3.0}
+        with mock.patch.object(tesseract_pool, 'tesserocr', fake_tesserocr([], osd)):
+            self.assertEqual(tesseract_pool.image_to_osd(self.page)['rotate'], 270)
+        vars(tesseract_pool._local).clear()
+        with mock.patch.object(tesseract_pool, 'tesserocr', fake_tesserocr([], None)):
+            with self.assertRaises(tesseract_pool.TesseractFailed):
+                tesseract_pool.image_to_osd(self.page)
+
+    def test_bgr_arrays_are_sent_as_rgb(self):
+        tesserocr = fake_tesserocr([])
+        page = np.zeros((20, 30, 3), np.uint8)
+        page[..., 0] = 255
+        with mock.patch.object(tesseract_pool, 'tesserocr', tesserocr):
+            tesseract_pool.image_to_string(page)
+        data = tesserocr.PyTessBaseAPI.return_value.SetImageBytes.call_args.args[0]
+        self.assertEqual(list(data[:3]), [0, 0, 255])
+
+    @mock.patch.object(tesseract_pool, '_pool', None)
+    def test_pool_runs_in_worker_processes(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        with open(os.path.join(folder.name, 'tesserocr.py'), 'w') as f:
+            f.write(FAKE_TESSEROCR)
+        page = np.zeros((20, 30, 3), np.uint8)
+        page[..., 0] = 255
+
+        # Spawned workers start with this process's sys.path
+        with mock.patch('sys.path', [folder.name] + sys.path), \
+                mock.patch.object(tesseract_pool, 'tesserocr', mock.Mock()), \
+                mock.patch.object(tesseract_pool, 'TESSERACT_WORKERS', 2):
+            try:
+                answers = [ast.literal_eval(tesseract_pool.image_to_string(page)) for _ in range(4)]
+            finally:
+                tesseract_pool.get_pool().shutdown()
+        self.assertNotIn(os.getpid(), {answer[0] for answer in answers})
+        self.assertEqual(answers[0][1:], ([0, 0, 255], 30, 20, 3))
+
+    def test_broken_pool_is_shut_down(self):
+        pool = mock.Mock()
+        pool.submit.return_value.result.side_effect = BrokenProcessPool()
+        with mock.patch.object(tesseract_pool, '_pool', pool), \
+                mock.patch.object(tesseract_pool, 'tesserocr', mock.Mock()), \
+                mock.patch.object(tesseract_pool, 'TESSERACT_WORKERS', 2):
+            with self.assertRaises(BrokenProcessPool):
+                tesseract_pool.image_to_string(self.page)
+            self.assertIsNone(tesseract_pool._pool)
+        pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    @mock.patch.object(tesseract_pool, 'TESSERACT_WORKERS', 4)
+    @mock.patch.object(tesseract_pool, 'tesserocr', None)
+    def test_without_tesserocr_falls_back_to_pytesseract_in_process(self):
+        with mock.patch.object(tesseract_pool.pytesseract, 'image_to_string', return_value='HTN\n') as image_to_string, \
+                mock.patch.object(tesseract_pool, 'get_pool') as get_pool:
+            self.assertEqual(tesseract_pool.image_to_string(self.page, config="--psm 6"), 'HTN\n')
+        image_to_string.assert_called_once()
+        get_pool.assert_not_called()
+
+
+# Modules the Flask OCR backend and the FastAPI extractor keep copies of,
+# relative to the repository root
+SHARED_MODULE_COPIES = {
+    'tesseract_pool.py': ['Printed+Handwritten Text Model/ocr-backend',
+                          'Printed Text Model/medical-data-extraction/backend/src'],
+    'orientation.py': ['Printed+Handwritten Text Model/ocr-backend'],
+    'skew.py': ['Printed+Handwritten Text Model/ocr-backend'],
+}
+
+
+class SharedModuleTests(SimpleTestCase):
+    def test_copies_match(self):
+        app_dir = Path(__file__).resolve().parent
+        repo_root = app_dir.parents[2]
+        for name, folders in SHARED_MODULE_COPIES.items():
+            source = (app_dir / name).read_bytes()
+            for folder in folders:
+                copy = repo_root / folder / name
+                if not copy.exists():
+                    continue
+                with self.subTest(copy=str(copy)):
+                    self.assertEqual(copy.read_bytes(), source, f"{copy} differs from diagnosis/{name}")
@@ -1,6 +1,13 @@
 from django.urls import path
-from .views import ProcessImageView
+from .views import (BatchProcessImageView, CacheStatsView, JobStatusView, JobSubmitView, OrientationStatsView,
+                    ProcessImageView, RateLimitStatsView)
 
 urlpatterns = [
     path('process-image/', ProcessImageView.as_view(), name='process-image'),
+    path('process-image/batch/', BatchProcessImageView.as_view(), name='process-image-batch'),
+    path('process-image/jobs/', JobSubmitView.as_view(), name='job-submit'),
+    path('process-image/jobs/<uuid:job_id>/', JobStatusView.as_view(), name='job-status'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('rate-limits/', RateLimitStatsView.as_view(), name='rate-limits'),
+    path('orientation-stats/', OrientationStatsView.as_view(), name='orientation-stats'),
 ]
\ No newline at end of file
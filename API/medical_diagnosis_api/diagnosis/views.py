@@ -1,7 +1,31 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .utils import process_image
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from .batch import BatchError, ndjson_lines, process_batch, read_batch_uploads
+from .cache import get_diagnosis_cache, get_result_cache
+from .jobs import callback_allowed, job_payload, submit_job
+from .models import Job
+from .orientation import orientation_stats
+from .utils import gemini_limiter, ocr_backends, process_image, vision_limiter
+
+
+def server_timing_header(timings):
+    # Per-stage durations in milliseconds, e.g. "skew;dur=41.2, gemini;dur=812.5"
+    return ", ".join(f"{stage};dur={duration}" for stage, duration in timings.items())
+
+
+def requested_ocr_backend(request):
+    # Optional 'ocr_backend' form field, the other OCR_BACKENDS stay fallbacks
+    name = request.data.get('ocr_backend') or None
+    if name is not None and name not in ocr_backends:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    return name
+
 
 class ProcessImageView(APIView):
     def post(self, request):
@@ -9,9 +33,85 @@ class ProcessImageView(APIView):
             return Response({'error': 'No image file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         image_file = request.FILES['image']
-        
         try:
-            result = process_image(image_file)
-            return Response(result, status=status.HTTP_200_OK)
+            ocr_backend = requested_ocr_backend(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        timings = {}
+        try:
+            result = process_image(image_file, timings, ocr_backend)
+            response = Response(result, status=status.HTTP_200_OK)
+            response['Server-Timing'] = server_timing_header(timings)
+            return response
         except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class BatchProcessImageView(APIView):
+    def post(self, request):
+        try:
+            uploads = read_batch_uploads(request.FILES)
+            ocr_backend = requested_ocr_backend(request)
+        except (BatchError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not uploads:
+            return Response({'error': 'No image files provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One JSON result per line, in completion order
+        return StreamingHttpResponse(ndjson_lines(process_batch(uploads, ocr_backend)), content_type='application/x-ndjson')
+
+
+class JobSubmitView(APIView):
+    def post(self, request):
+        if 'image' not in request.FILES:
+            return Response({'error': 'No image file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ocr_backend = requested_ocr_backend(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        callback_url = request.data.get('callback_url', '')
+        if callback_url:
+            try:
+                URLValidator(schemes=['http', 'https'])(callback_url)
+            except ValidationError:
+                return Response({'error': 'Invalid callback_url'}, status=status.HTTP_400_BAD_REQUEST)
+            if not callback_allowed(callback_url):
+                return Response({'error': 'callback_url host is not allowed'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = submit_job(request.FILES['image'], callback_url, ocr_backend)
+        status_url = request.build_absolute_uri(reverse('job-status', args=[job.id]))
+        return Response({'job_id': str(job.id), 'status': job.status, 'status_url': status_url},
+                        status=status.HTTP_202_ACCEPTED, headers={'Location': status_url})
+
+
+class JobStatusView(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id)
+        response = Response(job_payload(job), status=status.HTTP_200_OK)
+        if job.is_finished and job.timings:
+            response['Server-Timing'] = server_timing_header(job.timings)
+        return response
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        stats = {
+            'result_cache': get_result_cache().stats(),
+            'diagnosis_cache': get_diagnosis_cache().stats(),
+        }
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class RateLimitStatsView(APIView):
+    def get(self, request):
+        stats = {limiter.name: limiter.stats() for limiter in (vision_limiter, gemini_limiter)}
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class OrientationStatsView(APIView):
+    # How often the orientation pre-check let pages skip Tesseract OSD
+    def get(self, request):
+        return Response(orientation_stats.stats(), status=status.HTTP_200_OK)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medical_diagnosis_api.settings')
 
 application = get_asgi_application()
+
+# Resume background jobs a previous server process left behind
+from diagnosis.jobs import start_job_backend  # noqa: E402
+
+start_job_backend()
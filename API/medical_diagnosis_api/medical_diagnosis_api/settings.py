@@ -85,5 +85,98 @@ VISION_KEY = os.getenv('VISION_KEY')
 VISION_ENDPOINT = os.getenv('VISION_ENDPOINT')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Skew estimator used by correct_skew: "projection" (coarse to fine) or "rotate"
+SKEW_ENGINE = os.getenv('SKEW_ENGINE', 'projection')
+
+# Background jobs for /api/process-image/jobs/: "thread" runs them on an
+# in-process pool of JOB_WORKERS threads, "database" leaves them queued in the
+# database for `manage.py run_jobs` processes, "immediate" runs them inline
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'thread')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+# Running jobs are touched every JOB_HEARTBEAT seconds. Jobs untouched for
+# JOB_STALE_AFTER seconds (several heartbeats) belong to a worker that went
+# away and are queued again, up to JOB_MAX_ATTEMPTS runs, by run_jobs and by
+# the thread backend (at startup and every JOB_HEARTBEAT seconds)
+JOB_HEARTBEAT = int(os.getenv('JOB_HEARTBEAT', '60'))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Hosts job callbacks may be sent to, same syntax as ALLOWED_HOSTS
+# (".example.com" matches subdomains). Empty: callbacks are refused.
+JOB_CALLBACK_HOSTS = [host.strip() for host in os.getenv('JOB_CALLBACK_HOSTS', '').split(',') if host.strip()]
+
+# Batch endpoint /api/process-image/batch/: CPU stages run on BATCH_PROCESSES
+# worker processes (0 = one per core), network stages on BATCH_THREADS threads
+BATCH_PROCESSES = int(os.getenv('BATCH_PROCESSES', '0'))
+BATCH_THREADS = int(os.getenv('BATCH_THREADS', '8'))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '100'))
+
+# Tesseract calls (OSD, word boxes, the tesseract OCR backend) run on
+# TESSERACT_WORKERS processes that keep the engines loaded (needs tesserocr,
+# 0 = in the calling process). Every server process starts its own pool, so
+# keep this small when running several. Batch workers always use their own
+# engines.
+TESSERACT_WORKERS = int(os.getenv('TESSERACT_WORKERS', '2'))
+
+# Result cache keyed by a hash of the decoded page: "memory" (per-process
+# LRU), "sqlite" (file at RESULT_CACHE_PATH, shared by workers) or "none"
+RESULT_CACHE_BACKEND = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', str(BASE_DIR / 'result_cache.sqlite3'))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(7 * 24 * 60 * 60)))  # seconds
+
+# Gemini ICD-10 answers memoized by normalized diagnosis text, kept across
+# restarts. Seed it with: python manage.py seed_diagnosis_cache pairs.csv
+DIAGNOSIS_CACHE_BACKEND = os.getenv('DIAGNOSIS_CACHE_BACKEND', 'sqlite')
+DIAGNOSIS_CACHE_PATH = os.getenv('DIAGNOSIS_CACHE_PATH', str(BASE_DIR / 'diagnosis_cache.sqlite3'))
+DIAGNOSIS_CACHE_MAX_ENTRIES = int(os.getenv('DIAGNOSIS_CACHE_MAX_ENTRIES', '100000'))
+
+# With GEMINI_BATCH_SIZE above 1, Gemini calls from concurrent requests are
+# coalesced into one prompt of up to GEMINI_BATCH_SIZE diagnoses, waiting at
+# most GEMINI_BATCH_WAIT seconds for the batch to fill. Every call then waits
+# that long when traffic is light, so it is off (1) by default: turn it on
+# when requests arrive faster than the Gemini quota allows.
+GEMINI_BATCH_SIZE = int(os.getenv('GEMINI_BATCH_SIZE', '1'))
+GEMINI_BATCH_WAIT = float(os.getenv('GEMINI_BATCH_WAIT', '0.25'))
+
+# Token buckets for the Azure and Gemini quotas. 'sqlite' shares one budget
+# between every worker process on the host, 'memory' keeps it per process.
+# Requests are spaced at the quota's rate, after an idle spell up to
+# RATE_LIMIT_BURST of them go out at once.
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'sqlite')
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', str(BASE_DIR / 'rate_limit.sqlite3'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '3'))
+
+# Azure Read polling: the first poll comes after AZURE_READ_MIN_POLL seconds
+# (or around the usual operation time once known) and the delay grows up to
+# AZURE_READ_MAX_POLL unless the service sends Retry-After
+AZURE_READ_MIN_POLL = float(os.getenv('AZURE_READ_MIN_POLL', '0.25'))
+AZURE_READ_MAX_POLL = float(os.getenv('AZURE_READ_MAX_POLL', '4'))
+AZURE_READ_TIMEOUT = float(os.getenv('AZURE_READ_TIMEOUT', '30'))
+
+# Handwritten OCR engines, tried in this order: 'azure' (Azure Read),
+# 'tesseract' and 'local' (the CNN-LSTM-CTC model saved at
+# LOCAL_OCR_MODEL_PATH, as Keras or as a faster loading .tflite export,
+# LOCAL_OCR_CHARSET lists its output characters). A
+# request may ask for one backend, the others remain its fallbacks. A backend
+# whose rate budget would make the ROI wait more than OCR_FALLBACK_MAX_WAIT
+# seconds is skipped.
+OCR_BACKENDS = [name.strip() for name in os.getenv('OCR_BACKENDS', 'azure,tesseract').split(',') if name.strip()]
+OCR_FALLBACK_MAX_WAIT = float(os.getenv('OCR_FALLBACK_MAX_WAIT', '5'))
+LOCAL_OCR_MODEL_PATH = os.getenv('LOCAL_OCR_MODEL_PATH', '')
+LOCAL_OCR_CHARSET = os.getenv('LOCAL_OCR_CHARSET', '')
+
+# Preview, processed page and ROI images: 'async' writes them from a
+# background thread (dropped when ARTIFACT_QUEUE_SIZE are already waiting),
+# 'sync' writes them in the request, 'none' turns them off
+ARTIFACT_SINK = os.getenv('ARTIFACT_SINK', 'async')
+ARTIFACT_FOLDER = os.getenv('ARTIFACT_FOLDER', 'processed_images')
+ARTIFACT_QUEUE_SIZE = int(os.getenv('ARTIFACT_QUEUE_SIZE', '100'))
+
+# Offline ICD-10-CM index (built with `manage.py build_icd10_index`). A match
+# at or above ICD10_CONFIDENCE_THRESHOLD is returned without calling Gemini,
+# anything else still goes to Gemini. No index file disables the lookup.
+ICD10_INDEX_PATH = os.getenv('ICD10_INDEX_PATH', str(BASE_DIR / 'icd10_index.pkl'))
+ICD10_CONFIDENCE_THRESHOLD = float(os.getenv('ICD10_CONFIDENCE_THRESHOLD', '0.9'))
+
 # CORS configuration
 CORS_ALLOW_ALL_ORIGINS = True  # Allow all origins
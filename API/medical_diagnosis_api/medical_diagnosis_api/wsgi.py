@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medical_diagnosis_api.settings')
 
 application = get_wsgi_application()
+
+# Resume background jobs a previous server process left behind
+from diagnosis.jobs import start_job_backend  # noqa: E402
+
+start_job_backend()
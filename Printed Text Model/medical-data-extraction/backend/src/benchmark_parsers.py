@@ -0,0 +1,114 @@
+import argparse
+import random
+import re
+import time
+from parser_patient_details import PatientDetailsParser
+from parser_prescription import PrescriptionParser
+
+# Compares parse() against the previous per-call implementation (pattern dict
+# rebuilt on every get_field, uncompiled re.findall per field) on OCR-sized
+# and oversized synthetic documents
+
+PRESCRIPTION_TEXT = """
+Dr John Smith, M.D
+2 Non-Important Street,
+New York, Phone (000)-111-2222
+
+Name: Marta Sharapova Date: 5/11/2022
+
+Address: 9 tennis court, new Russia, DC
+
+Prednisone 20 md
+Lialda 2.4 gram
+
+Directions:
+Prednisone, Taper 5 mg every 3 days,
+Finish in 2.5 weeks 7
+Lialda - take 2 pill everyday for 1 month
+
+Refill: _2_times"""
+
+PATIENT_DETAILS_TEXT = """
+17/12/2020
+
+Patient Medical Record
+
+Patient Information Birth Date
+Jerry Lucas May 2 1998
+(279) 920-8204 " Weight:
+4218 Wheeler Ridge Dr $7
+anaes 14201 Height:
+
+Have you had the Hepatitis B vaccination?
+Yes ,
+
+List any Medical Problems (asthma, seizures, headaches):
+N/A
+
+Do you have medical insurance?
+No
+
+abc"""
+
+LEGACY_PATTERNS = {
+    PrescriptionParser: {
+        "patient_name": {"pattern": "Name:(.*)Date", "flags": 0},
+        "patient_address": {"pattern": "Address:(.*)\n", "flags": 0},
+        "medicines": {"pattern": "Address:[^\n]*(.*)Directions", "flags": re.DOTALL},
+        "directions": {"pattern": "Directions:.(.*)Refill", "flags": re.DOTALL},
+        "refill": {"pattern": r"Refill:.*(\d).*times", "flags": 0},
+    },
+    PatientDetailsParser: {
+        "patient_name": {"pattern": r"Date\n+([a-zA-Z]+\s+[a-zA-Z]+).\D{3}", "flags": 0},
+        "phone_no": {"pattern": r"(\(\d{3}\).\d{3}.\d{4}).+Weight", "flags": 0},
+        "vaccination_status": {"pattern": r"vaccination\?\n+(Yes|No)", "flags": 0},
+        "medical_problems": {"pattern": r"headaches\):\n+(\D+?)\n", "flags": 0},
+        "has_insurance": {"pattern": r"insurance\?\n+(Yes|No)", "flags": 0},
+    },
+}
+
+def legacy_parse(parser_class, text):
+    def get_field(field_name):
+        pattern_dict = dict(LEGACY_PATTERNS[parser_class])
+        pattern_object = pattern_dict.get(field_name)
+        if pattern_object:
+            matches = re.findall(pattern_object["pattern"], text, flags=pattern_object["flags"])
+            if len(matches) > 0:
+                return matches[0].strip()
+    return {name: get_field(name) for name in LEGACY_PATTERNS[parser_class]}
+
+def ocr_noise(lines, seed=0):
+    # Lines of OCR-like junk: words, numbers and stray punctuation
+    rng = random.Random(seed)
+    words = ["mg", "tablet", "Dr", "clinic", "street", "|", "~", "ee", "Phone", "12/05", "dose", "a", "the"]
+    return "\n".join(" ".join(rng.choice(words) for _ in range(rng.randint(3, 12))) for _ in range(lines))
+
+def synthetic_document(text, noise_lines, copies):
+    # The document surrounded by noise and repeated, as when a long referral
+    # or several scanned pages run together
+    noise = ocr_noise(noise_lines)
+    return "\n".join(noise + "\n" + text + "\n" + noise for _ in range(copies))
+
+def seconds_per_parse(parse, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parse()
+    return (time.perf_counter() - start) / repeats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Field extraction speed, compiled field specs vs per-call findall")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    for parser_class, text in [(PrescriptionParser, PRESCRIPTION_TEXT), (PatientDetailsParser, PATIENT_DETAILS_TEXT)]:
+        for noise_lines, copies in [(0, 1), (200, 1), (200, 20)]:
+            document = synthetic_document(text, noise_lines, copies)
+            if copies == 1:
+                # Repeated documents differ on purpose: multi-line fields now
+                # end at the first heading after them, not the last
+                assert parser_class(document).parse() == legacy_parse(parser_class, document)
+            repeats = max(1, args.repeats // copies)
+            legacy = seconds_per_parse(lambda: legacy_parse(parser_class, document), repeats)
+            compiled = seconds_per_parse(lambda: parser_class(document).parse(), repeats)
+            print(f"{parser_class.__name__} ({len(document) // 1024} KB): legacy {legacy * 1e6:.0f} us, "
+                  f"compiled {compiled * 1e6:.0f} us, {legacy / compiled:.1f}x")
@@ -0,0 +1,213 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import argparse
+import csv
+import os
+import time
+import traceback
+import pandas as pd
+import extractor
+from parser_patient_details import PatientDetailsParser
+from parser_prescription import PrescriptionParser
+
+# Batch runner around extractor.extract for backfills. Documents are spread
+# over worker processes, one document per worker at a time (each worker OCRs
+# its pages itself instead of through the extractor's pool). Results are
+# appended to the output as they finish, and every finished document is
+# recorded in a checkpoint file next to the output, so a rerun after a crash
+# skips what is already done. A crash between writing results and the
+# checkpoint can repeat at most the last flushed batch. Retried errors are
+# appended like any other result, and the output is then rewritten with the
+# last row of each document only.
+
+STAGES = ["text_layer", "ocr", "parse"]
+COLUMNS = (["path", "file_format", "status", "error", "seconds"] + [f"{stage}_seconds" for stage in STAGES]
+           + list(dict.fromkeys(list(PrescriptionParser.fields) + list(PatientDetailsParser.fields)
+                                + ["provisional_diagnosis", "page_sources"])))
+
+def list_documents(source, file_format):
+    # [(path, file_format)] from a directory (every PDF below it) or a
+    # manifest: a CSV with a "path" and optional "file_format" column, or
+    # one path per line. Relative manifest paths are relative to the manifest.
+    if os.path.isdir(source):
+        return [(os.path.join(root, name), file_format)
+                for root, _, names in sorted(os.walk(source)) for name in sorted(names)
+                if name.lower().endswith(".pdf")]
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        first_line = f.readline()
+        f.seek(0)
+        if "path" in next(csv.reader([first_line]), []):
+            rows = [(row["path"], row.get("file_format") or file_format) for row in csv.DictReader(f)]
+        else:
+            rows = [(line.strip(), file_format) for line in f if line.strip()]
+    return [(os.path.join(base, path), row_format) for path, row_format in rows]
+
+def init_worker():
+    extractor.OCR_WORKERS = 0
+    extractor.init_ocr_worker()
+
+def process_document(path, file_format):
+    timings = {}
+    start = time.perf_counter()
+    row = {"path": path, "file_format": file_format}
+    try:
+        row.update(extractor.extract(path, file_format, timings))
+        row["status"] = "ok"
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+    row["seconds"] = time.perf_counter() - start
+    for stage in STAGES:
+        row[f"{stage}_seconds"] = timings.get(stage, 0.0)
+    return row
+
+class CSVWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, rows):
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def dedupe(self):
+        # Keep the last row of each path, written to a temporary file that
+        # replaces the output
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = {row["path"]: row for row in csv.DictReader(f)}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+class ParquetWriter:
+    # A directory of part files, one per flushed batch; pandas.read_parquet
+    # reads the directory as one table
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.part = max((int(name[5:-8]) + 1 for name in self.parts()), default=0)
+
+    def parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def write(self, rows):
+        df = pd.DataFrame(rows).reindex(columns=COLUMNS)
+        # Same schema in every part, even when a column is empty in this batch
+        text_columns = [column for column in COLUMNS if not column.endswith("seconds")]
+        df[text_columns] = df[text_columns].astype("string")
+        tmp_path = os.path.join(self.path, f".part-{self.part:05d}.parquet.tmp")
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self.path, f"part-{self.part:05d}.parquet"))
+        self.part += 1
+
+    def dedupe(self):
+        # Keep the last row of each path in one new part, then drop the old
+        # parts. A crash in between leaves duplicates the next dedupe removes.
+        old_parts = self.parts()
+        df = pd.concat([pd.read_parquet(os.path.join(self.path, name)) for name in old_parts])
+        self.write(df.drop_duplicates("path", keep="last").to_dict("records"))
+        for name in old_parts:
+            os.remove(os.path.join(self.path, name))
+
+def make_writer(output):
+    return ParquetWriter(output) if output.endswith(".parquet") else CSVWriter(output)
+
+def load_checkpoint(path, retry_errors=False):
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                status, _, document = line.rstrip("\n").partition("\t")
+                if document and not (retry_errors and status == "error"):
+                    done.add(document)
+    return done
+
+def append_checkpoint(path, rows):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(f"{row['status']}\t{row['path']}\n" for row in rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.start = time.perf_counter()
+
+    def add(self, row):
+        self.done += 1
+        self.errors += row["status"] == "error"
+        for stage in STAGES:
+            self.stage_seconds[stage] += row[f"{stage}_seconds"]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        stages = ", ".join(f"{stage} {seconds / max(1, self.done):.2f}s"
+                           for stage, seconds in self.stage_seconds.items())
+        print(f"[{self.done}/{self.total}] {self.done / elapsed:.2f} docs/sec, {self.errors} errors, "
+              f"per document: {stages}", flush=True)
+
+def run(documents, output, workers, flush_every=20, retry_errors=False):
+    checkpoint = output + ".checkpoint"
+    done = load_checkpoint(checkpoint, retry_errors)
+    pending = [(path, file_format) for path, file_format in documents if path not in done]
+    print(f"{len(documents)} documents, {len(documents) - len(pending)} already done, {len(pending)} to go")
+    if not pending:
+        return
+
+    writer = make_writer(output)
+    extract_all(pending, writer, checkpoint, workers, flush_every)
+    if retry_errors:
+        # Retried documents have their earlier error rows in the output too
+        writer.dedupe()
+
+def extract_all(pending, writer, checkpoint, workers, flush_every):
+    progress = Progress(len(pending))
+    batch = []
+    queue = iter(pending)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        # Keep a couple of documents per worker queued, not the whole backlog
+        running = set()
+        while True:
+            while len(running) < workers * 2:
+                document = next(queue, None)
+                if document is None:
+                    break
+                running.add(pool.submit(process_document, *document))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                row = future.result()
+                batch.append(row)
+                progress.add(row)
+            if len(batch) >= flush_every or not running:
+                writer.write(batch)
+                append_checkpoint(checkpoint, batch)
+                batch = []
+                progress.report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract data from many documents")
+    parser.add_argument("source", help="Directory of PDFs, or a manifest (CSV with a path column, or one path per line)")
+    parser.add_argument("output", help="Results file: .csv, or .parquet (a directory of part files)")
+    parser.add_argument("--file_format", choices=extractor.FILE_FORMATS, default="prescription",
+                        help="Format of documents the manifest does not label")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--flush_every", type=int, default=20, help="Documents per results/checkpoint write")
+    parser.add_argument("--retry_errors", action="store_true", help="Process documents that failed last time again")
+    args = parser.parse_args()
+
+    run(list_documents(args.source, args.file_format), args.output, args.workers, args.flush_every, args.retry_errors)
@@ -1,9 +1,16 @@
-from pdf2image import convert_from_path
+from concurrent.futures import ProcessPoolExecutor
+import subprocess
+import threading
+import time
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
+import tesseract_pool
 import utils
 from parser_patient_details import PatientDetailsParser
 from parser_prescription import PrescriptionParser
 import pandas as pd
+import numpy as np
+import cv2
 import os
 import re
 
@@ -11,15 +18,231 @@ POPPLER_PATH = r"C:/poppler-24.02.0/Library/bin"
 TESSERACT_ENGINE_PATH = r"C:/Program Files/Tesseract-OCR/tesseract.exe"
 pytesseract.pytesseract.tesseract_cmd = TESSERACT_ENGINE_PATH
 
-def extract(file_path, file_format):
-    pages = convert_from_path(file_path, poppler_path=POPPLER_PATH)
-    document_text = ""
+FILE_FORMATS = ["prescription", "patient_details", "provisional_diagnosis"]
 
-    for page in pages:
-        processed_image = utils.preprocess_image(page)
-        text = pytesseract.image_to_string(processed_image, lang="eng")
-        document_text += "\n" + text
+# Pages are rendered and OCR'd inside a pool of worker processes, one page per
+# worker at a time, so a long referral uses every core while only
+# OCR_WORKERS rendered pages exist at once. With OCR_WORKERS=0 pages are
+# OCR'd in the calling process (the bulk runner already runs one document
+# per process).
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
 
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def init_ocr_worker():
+    # One Tesseract thread per process, the pool already fills the cores
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_ENGINE_PATH
+    # Each worker keeps its own Tesseract engines loaded between pages
+    tesseract_pool.TESSERACT_WORKERS = 0
+
+def get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=init_ocr_worker)
+    return _ocr_pool
+
+def ocr_map(fn, *iterables):
+    if OCR_WORKERS == 0:
+        return map(fn, *iterables)
+    return get_ocr_pool().map(fn, *iterables)
+
+def count_pages(file_path):
+    return pdfinfo_from_path(file_path, poppler_path=POPPLER_PATH)["Pages"]
+
+# "adaptive" renders each page straight at the DPI its text needs: a cheap
+# PROBE_DPI render measures the text line height, and the page is rendered
+# so lines are TARGET_LINE_HEIGHT_PX tall (MIN_DPI..MAX_DPI, at most
+# MAX_PAGE_PIXELS). That is two poppler calls per OCR'd page, the probe has
+# about a seventeenth of the pixels of a 300 DPI render. MAX_DPI is the
+# effective resolution of "fixed", so small print is read as before and
+# large print at fewer pixels. "fixed" renders at poppler's default 200 DPI
+# and upscales 1.5x before OCR, one poppler call per page.
+RENDER_MODE = os.getenv("RENDER_MODE", "adaptive")
+FIXED_DPI = 200
+PROBE_DPI = 72
+DEFAULT_LINE_HEIGHT_PT = 10
+TARGET_LINE_HEIGHT_PX = 40
+MIN_DPI = 150
+MAX_DPI = 300
+MAX_PAGE_PIXELS = 25_000_000
+
+def render(file_path, page_number, dpi, grayscale=False):
+    return convert_from_path(file_path, dpi=dpi, first_page=page_number, last_page=page_number,
+                             grayscale=grayscale, poppler_path=POPPLER_PATH)[0]
+
+def render_page(file_path, page_number):
+    # (page image, DPI it was rendered at, upscale left to preprocessing)
+    if RENDER_MODE == "fixed":
+        return render(file_path, page_number, FIXED_DPI), FIXED_DPI, 1.5
+    probe = np.array(render(file_path, page_number, PROBE_DPI, grayscale=True))
+    height_pt, width_pt = probe.shape[0] * 72 / PROBE_DPI, probe.shape[1] * 72 / PROBE_DPI
+    line_height_pt = utils.measure_line_height(probe, PROBE_DPI) or DEFAULT_LINE_HEIGHT_PT
+    dpi = utils.choose_dpi(width_pt, height_pt, line_height_pt, TARGET_LINE_HEIGHT_PX, MIN_DPI, MAX_DPI,
+                           MAX_PAGE_PIXELS)
+    return render(file_path, page_number, dpi, grayscale=True), dpi, 1
+
+def ocr_image(image, dpi, scale):
+    processed_image = utils.preprocess_image(image, scale, utils.threshold_block_size(dpi * scale))
+    return tesseract_pool.image_to_string(processed_image, lang="eng")
+
+def ocr_page(file_path, page_number):
+    # Renders only this page, the image never leaves the worker
+    page, dpi, scale = render_page(file_path, page_number)
+    return ocr_image(page, dpi, scale)
+
+# Fields that can be read from a crop of the page instead of the whole page:
+# the line matching "anchor" and the "lines" lines below it. The lines are
+# found by a fast LAYOUT_DPI pass, then only the crop is OCR'd at full DPI.
+FIELD_REGIONS = {
+    "provisional_diagnosis": {"anchor": r"(?i)provisional\s*diagnosis", "lines": 4},
+}
+LAYOUT_DPI = 100
+
+def find_lines(gray, dpi):
+    # Text lines of the page as (text, top, bottom) in page pixels, top to bottom
+    scale = LAYOUT_DPI / dpi
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    data = tesseract_pool.image_to_data(small, lang="eng")
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        top, bottom = data["top"][i], data["top"][i] + data["height"][i]
+        text, line_top, line_bottom = lines.get(key, ("", top, bottom))
+        lines[key] = ((text + " " + word).strip(), min(line_top, top), max(line_bottom, bottom))
+    factor = 1 / scale if scale < 1 else 1
+    return sorted(((text, int(top * factor), int(bottom * factor)) for text, top, bottom in lines.values()),
+                  key=lambda line: line[1])
+
+def find_region(lines, region):
+    # (top, bottom) of the anchor line and the lines below it, None if the
+    # anchor is not on the page
+    for i, (text, top, bottom) in enumerate(lines):
+        if re.search(region["anchor"], text):
+            last = lines[min(i + region["lines"], len(lines) - 1)]
+            margin = (bottom - top) // 2
+            return max(0, top - margin), max(bottom, last[2]) + margin
+    return None
+
+def ocr_page_fields(file_path, page_number, fields):
+    # {field: text of its crop} for the fields anchored on this page
+    page, dpi, scale = render_page(file_path, page_number)
+    gray = np.array(page.convert("L"))
+    lines = find_lines(gray, dpi)
+    texts = {}
+    for field in fields:
+        region = find_region(lines, FIELD_REGIONS[field])
+        if region:
+            texts[field] = ocr_image(gray[region[0]:region[1]], dpi, scale)
+    return texts
+
+# A page whose embedded text has fewer readable characters than this, or too
+# many unreadable ones (scans with an OCR'd or broken text layer, fonts
+# without a Unicode map), is OCR'd instead
+MIN_TEXT_LAYER_CHARS = 30
+MIN_TEXT_LAYER_READABLE = 0.8
+
+def read_text_layer(file_path):
+    # Embedded text of every page from poppler's pdftotext, which ends each
+    # page with a form feed. Empty when the file has no text layer to read.
+    pdftotext = os.path.join(POPPLER_PATH, "pdftotext") if POPPLER_PATH else "pdftotext"
+    try:
+        result = subprocess.run([pdftotext, "-layout", "-enc", "UTF-8", file_path, "-"],
+                                capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return result.stdout.decode("utf-8", errors="replace").split("\f")
+
+def is_usable_text(text):
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < MIN_TEXT_LAYER_CHARS:
+        return False
+    readable = sum(1 for c in chars if c.isalnum() or c in ".,:;-/()%'\"#&+")
+    return readable / len(chars) >= MIN_TEXT_LAYER_READABLE
+
+def read_pages(file_path, timings):
+    # Usable embedded text of every page, None for the pages to OCR
+    start = time.perf_counter()
+    page_count = count_pages(file_path)
+    text_layer = read_text_layer(file_path)
+    texts = [text_layer[i] if i < len(text_layer) and is_usable_text(text_layer[i]) else None
+             for i in range(page_count)]
+    timings["text_layer"] = timings.get("text_layer", 0) + time.perf_counter() - start
+    return texts
+
+def page_sources(texts):
+    return ["ocr" if text is None else "text_layer" for text in texts]
+
+def extract_text(file_path, timings=None, pages=None):
+    # (document text, how each page was read: "text_layer" or "ocr").
+    # Seconds spent per stage are added to timings. pages is read_pages'
+    # result when the caller already has it.
+    timings = {} if timings is None else timings
+    texts = list(read_pages(file_path, timings) if pages is None else pages)
+    sources = page_sources(texts)
+
+    start = time.perf_counter()
+    ocr_pages = [i + 1 for i, text in enumerate(texts) if text is None]
+    if ocr_pages:
+        ocr_texts = ocr_map(ocr_page, [file_path] * len(ocr_pages), ocr_pages)
+        for page_number, text in zip(ocr_pages, ocr_texts):
+            texts[page_number - 1] = text
+    timings["ocr"] = timings.get("ocr", 0) + time.perf_counter() - start
+    return "".join("\n" + text for text in texts), sources
+
+def extract_fields(file_path, fields, timings=None, pages=None):
+    # Text around each field, OCR'ing only the field crops of pages without a
+    # text layer. (text, page sources), None when a field is not found.
+    timings = {} if timings is None else timings
+    texts = read_pages(file_path, timings) if pages is None else pages
+    sources = page_sources(texts)
+    found = {}
+    for text in texts:
+        for field in fields:
+            if text is not None and re.search(FIELD_REGIONS[field]["anchor"], text):
+                found.setdefault(field, text)
+
+    start = time.perf_counter()
+    missing = [field for field in fields if field not in found]
+    ocr_pages = [i + 1 for i, text in enumerate(texts) if text is None]
+    if missing and ocr_pages:
+        # Pages are read in order, the first page holding a field wins
+        crops = ocr_map(ocr_page_fields, [file_path] * len(ocr_pages), ocr_pages,
+                                   [missing] * len(ocr_pages))
+        for page_texts in crops:
+            for field, text in page_texts.items():
+                found.setdefault(field, text)
+    timings["ocr"] = timings.get("ocr", 0) + time.perf_counter() - start
+    if any(field not in found for field in fields):
+        return None
+    return "".join("\n" + found[field] for field in fields), sources
+
+def extract(file_path, file_format, timings=None):
+    # timings, when given, collects the seconds spent reading the text layer,
+    # on OCR and on parsing
+    timings = {} if timings is None else timings
+    if file_format == "provisional_diagnosis":
+        # Only the diagnosis is needed, so only its crop is OCR'd where possible.
+        # The whole document is OCR'd when a crop was not found, without
+        # reading the page count and text layer again.
+        pages = read_pages(file_path, timings)
+        result = extract_fields(file_path, ["provisional_diagnosis"], timings, pages)
+        document_text, sources = result or extract_text(file_path, timings, pages)
+        start = time.perf_counter()
+        extracted_data = {
+            "provisional_diagnosis": extract_provisional_diagnosis(document_text),
+            "page_sources": ",".join(sources),
+        }
+        timings["parse"] = time.perf_counter() - start
+        return extracted_data
+
+    document_text, sources = extract_text(file_path, timings)
+
+    start = time.perf_counter()
     if file_format == "prescription":
         extracted_data = PrescriptionParser(document_text).parse()
         extracted_data['provisional_diagnosis'] = extract_provisional_diagnosis(document_text)
@@ -28,6 +251,8 @@ def extract(file_path, file_format):
     else:
         raise Exception(f"Invalid file format: {file_format}")
 
+    extracted_data['page_sources'] = ",".join(sources)
+    timings["parse"] = time.perf_counter() - start
     return extracted_data
 
 def extract_provisional_diagnosis(text):
@@ -1,44 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Form, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response
 import uvicorn
-from extractor import extract
-import uuid
+from extractor import FILE_FORMATS, extract
+import asyncio
+import io
 import os
+import tempfile
 import pandas as pd
 
 app = FastAPI()
 
-@app.post("/extract_from_doc")
-def extract_from_doc(file: UploadFile = File(...), file_format: str = Form(...)):
-    content = file.file.read()
-
-    UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
-    if not os.path.exists(UPLOAD_DIR):
-        os.makedirs(UPLOAD_DIR)
+# extract() runs on a small thread pool, off the event loop. Its CPU work
+# (rendering and OCR) already runs in the extractor's process pool, so the
+# threads mostly wait. Once MAX_PENDING_EXTRACTIONS documents are running or
+# queued, new uploads are turned away with 429 instead of piling up.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "4"))
+MAX_PENDING_EXTRACTIONS = int(os.getenv("MAX_PENDING_EXTRACTIONS", str(EXTRACT_WORKERS * 2)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-    FILE_PATH = os.path.join(UPLOAD_DIR, str(uuid.uuid4()) + ".png")
+extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS)
+pending_extractions = 0
 
-    with open(FILE_PATH, "wb") as f:
-        f.write(content)
+EXCEL_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
+async def save_upload(file):
+    # Streams the upload to a temporary file, keeping its extension so the
+    # PDF tools see what it is. Disk writes run on the default executor, off
+    # the event loop.
+    suffix = os.path.splitext(file.filename or "")[1] or ".pdf"
+    loop = asyncio.get_running_loop()
+    f = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
     try:
-        data = extract(FILE_PATH, file_format)
-        df = pd.DataFrame([data])
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await loop.run_in_executor(None, f.write, chunk)
+        await loop.run_in_executor(None, f.close)
+    except BaseException:
+        f.close()
+        os.remove(f.name)
+        raise
+    return f.name
 
-        OUTPUT_DIR = os.path.join(os.getcwd(), "output")
-        if not os.path.exists(OUTPUT_DIR):
-            os.makedirs(OUTPUT_DIR)
+def to_excel(data):
+    buffer = io.BytesIO()
+    pd.DataFrame([data]).to_excel(buffer, index=False)
+    return buffer.getvalue()
 
-        excel_file_path = os.path.join(OUTPUT_DIR, f"{uuid.uuid4()}.xlsx")
-        df.to_excel(excel_file_path, index=False)
+@app.post("/extract_from_doc")
+async def extract_from_doc(file: UploadFile = File(...), file_format: str = Form(...), output: str = Form("json")):
+    global pending_extractions
+    if file_format not in FILE_FORMATS:
+        return JSONResponse({"error": f"Invalid file format: {file_format}"}, status_code=400)
+    if output not in ("json", "excel"):
+        return JSONResponse({"error": f"Invalid output: {output}"}, status_code=400)
+    if pending_extractions >= MAX_PENDING_EXTRACTIONS:
+        return JSONResponse({"error": "Too many documents in progress, try again shortly"}, status_code=429,
+                            headers={"Retry-After": "5"})
+
+    pending_extractions += 1
+    file_path = None
+    try:
+        file_path = await save_upload(file)
+        data = await asyncio.get_running_loop().run_in_executor(extract_executor, extract, file_path, file_format)
 
-        return FileResponse(excel_file_path, filename="extracted_data.xlsx",
-                            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        if output == "excel":
+            return Response(to_excel(data), media_type=EXCEL_MEDIA_TYPE,
+                            headers={"Content-Disposition": 'attachment; filename="extracted_data.xlsx"'})
+        return data
     except Exception as e:
-        return {"error": str(e)}
+        return JSONResponse({"error": str(e)}, status_code=500)
     finally:
-        if os.path.exists(FILE_PATH):
-            os.remove(FILE_PATH)
+        pending_extractions -= 1
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
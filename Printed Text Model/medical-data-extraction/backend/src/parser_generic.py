@@ -1,11 +1,26 @@
 import abc
+import re
 
 
 class MedicalDocParser(metaclass=abc.ABCMeta):
+    # Field name -> (pattern, flags). Subclasses declare their fields here;
+    # the patterns are compiled once, when the subclass is defined, and each
+    # field takes the first group of its first match.
+    fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.patterns = {name: re.compile(pattern, flags) for name, (pattern, flags) in cls.fields.items()}
 
     def __init__(self, text):
         self.text = text
 
-    @abc.abstractmethod
+    def get_field(self, field_name):
+        pattern = self.patterns.get(field_name)
+        if pattern:
+            match = pattern.search(self.text)
+            if match:
+                return match.group(1).strip()
+
     def parse(self):
-        pass
\ No newline at end of file
+        return {name: self.get_field(name) for name in self.patterns}
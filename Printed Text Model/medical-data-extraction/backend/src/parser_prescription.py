@@ -6,40 +6,17 @@ class PrescriptionParser(MedicalDocParser):
     def __init__(self, text):
         MedicalDocParser.__init__(self, text)
 
-    # def parse(self):
-    #     return{
-    #         "patient_name": self.get_name(),
-    #         "patient_address": self.get_address(),
-    #         "medicines": self.get_medicines(),
-    #         "directions": self.get_directions(),
-    #         "refill": self.get_refill()
-    #     }
-        
-    def parse(self):
-        return{
-            "patient_name": self.get_field("patient_name"),
-            "patient_address": self.get_field("patient_address"),
-            "medicines": self.get_field("medicines"),
-            "directions": self.get_field("directions"),
-            "refill": self.get_field("refill")
-        }        
-    
-    def get_field(self, field_name):
-        pattern_dict = {
-            "patient_name": {"pattern": "Name:(.*)Date", "flags": 0},
-            "patient_address": {"pattern": "Address:(.*)\n", "flags": 0},
-            "medicines": {"pattern": "Address:[^\n]*(.*)Directions", "flags": re.DOTALL},
-            "directions": {"pattern": "Directions:.(.*)Refill", "flags": re.DOTALL},
-            "refill": {"pattern": "Refill:.*(\d).*times", "flags": 0},
-        }
-
-        pattern_object = pattern_dict.get(field_name)
-        if pattern_object:
-            matches = re.findall(pattern_object["pattern"], self.text, flags=pattern_object["flags"])
-            if len(matches) > 0:
-                return matches[0].strip()
-
-    # below functions condensed to get_field()
+    fields = {
+        "patient_name": (r"Name:(.*)Date", 0),
+        "patient_address": (r"Address:(.*)\n", 0),
+        # Lazy, so a multi-line field stops at the first heading after it
+        # instead of scanning to the end of the text and backtracking
+        "medicines": (r"Address:[^\n]*(.*?)Directions", re.DOTALL),
+        "directions": (r"Directions:.(.*?)Refill", re.DOTALL),
+        "refill": (r"Refill:.*(\d).*times", 0),
+    }
+
+    # below functions condensed to the field specs above
     # def get_name(self):
     #     pattern = "Name:(.*)Date"
     #     matches = re.findall(pattern, self.text)
@@ -0,0 +1,207 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Tesseract engines kept loaded in long-lived worker processes. pytesseract
+# starts a tesseract binary for every call, which reloads the language data
+# and passes the image through temporary files. Here every worker keeps one
+# engine per (lang, oem) open through the C API (tesserocr) and images reach
+# it as raw pixel buffers. image_to_string, image_to_data and image_to_osd
+# take the same arguments as pytesseract's and return what pytesseract
+# returns with Output.DICT (image_to_data: word rows only). Only --psm and
+# --oem are read from config. Colour arrays are taken as OpenCV's BGR, PIL
+# images as RGB.
+#
+# Every process that calls in starts its own pool of TESSERACT_WORKERS, so
+# the default is small. TESSERACT_WORKERS=0 keeps the engines in the calling
+# process (one per thread), for callers that already are worker processes.
+# Without tesserocr the calls go through pytesseract in the calling process,
+# a pool would only add a hop in front of the tesseract binary.
+#
+# The Django API (diagnosis/tesseract_pool.py), the Flask OCR backend and the
+# FastAPI extractor share this module. Edit the Django copy and copy it over,
+# diagnosis.tests.SharedModuleTests fails when the copies differ.
+TESSERACT_WORKERS = int(os.getenv("TESSERACT_WORKERS", "2"))
+TESSDATA_PATH = os.getenv("TESSDATA_PREFIX")
+
+DEFAULT_PSM = 3
+DEFAULT_OEM = 3
+OSD_PSM = 0
+DATA_KEYS = ["level", "page_num", "block_num", "par_num", "line_num", "word_num",
+             "left", "top", "width", "height", "conf", "text"]
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+class TesseractFailed(RuntimeError):
+    # Plain message only, pytesseract's own errors can't cross process boundaries
+    pass
+
+
+def parse_config(config):
+    psm = re.search(r"--psm\s+(\d+)", config or "")
+    oem = re.search(r"--oem\s+(\d+)", config or "")
+    return int(psm.group(1)) if psm else DEFAULT_PSM, int(oem.group(1)) if oem else DEFAULT_OEM
+
+
+def get_engine(lang, oem):
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    if (lang, oem) not in engines:
+        kwargs = {"path": TESSDATA_PATH} if TESSDATA_PATH else {}
+        engines[(lang, oem)] = tesserocr.PyTessBaseAPI(lang=lang, oem=oem, **kwargs)
+    return engines[(lang, oem)]
+
+
+def set_image(engine, image, psm):
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    engine.SetPageSegMode(psm)
+    engine.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+
+
+def _image_to_string(image, lang, config):
+    if tesserocr is None:
+        return pytesseract.image_to_string(image, lang=lang, config=config)
+    psm, oem = parse_config(config)
+    engine = get_engine(lang, oem)
+    set_image(engine, image, psm)
+    return engine.GetUTF8Text()
+
+
+def _image_to_data(image, lang, config):
+    if tesserocr is None:
+        return pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    psm, oem = parse_config(config)
+    engine = get_engine(lang, oem)
+    set_image(engine, image, psm)
+    engine.Recognize()
+
+    # Numbered like tesseract's TSV output: blocks per page, paragraphs per
+    # block, lines per paragraph, words per line, all from 1
+    data = {key: [] for key in DATA_KEYS}
+    ril = tesserocr.RIL
+    block = par = line = word = 0
+    iterator = engine.GetIterator()
+    if iterator is None:
+        return data
+    for it in tesserocr.iterate_level(iterator, ril.WORD):
+        if it.IsAtBeginningOf(ril.BLOCK):
+            block, par, line, word = block + 1, 0, 0, 0
+        if it.IsAtBeginningOf(ril.PARA):
+            par, line, word = par + 1, 0, 0
+        if it.IsAtBeginningOf(ril.TEXTLINE):
+            line, word = line + 1, 0
+        word += 1
+        box = it.BoundingBox(ril.WORD)
+        if box is None:
+            continue
+        left, top, right, bottom = box
+        for key, value in zip(DATA_KEYS, (5, 1, block, par, line, word, left, top, right - left, bottom - top,
+                                          it.Confidence(ril.WORD), it.GetUTF8Text(ril.WORD) or "")):
+            data[key].append(value)
+    return data
+
+
+def _image_to_osd(image):
+    if tesserocr is None:
+        return pytesseract.image_to_osd(image, config=f"--psm {OSD_PSM}", output_type=pytesseract.Output.DICT)
+    engine = get_engine("eng", DEFAULT_OEM)
+    set_image(engine, image, OSD_PSM)
+    osd = engine.DetectOrientationScript()
+    if not osd:
+        raise TesseractFailed("Too few characters to detect the orientation")
+    return {
+        "orientation": osd["orient_deg"],
+        # Counter-clockwise degrees that make the page upright, as tesseract prints it
+        "rotate": (360 - osd["orient_deg"]) % 360,
+        "orientation_conf": osd["orient_conf"],
+        "script": osd["script_name"],
+        "script_conf": osd["script_conf"],
+    }
+
+
+def _run(fn, *args):
+    try:
+        return fn(*args)
+    except TesseractFailed:
+        raise
+    except Exception as e:
+        raise TesseractFailed(str(e)) from None
+
+
+def _init_worker(tesseract_cmd):
+    # One Tesseract thread per engine, the pool already fills the cores
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if tesserocr is not None:
+        # Load the language data before the first request comes in
+        get_engine("eng", DEFAULT_OEM)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=TESSERACT_WORKERS,
+                # Forking a threaded server that has OpenCV loaded is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(pytesseract.pytesseract.tesseract_cmd,),
+            )
+    return _pool
+
+
+def discard_pool(pool):
+    # A worker died, shut the pool down and let the next call start a fresh one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def as_rgb(image):
+    # Tesseract and PIL expect RGB(A), OpenCV arrays are BGR(A)
+    if isinstance(image, np.ndarray) and image.ndim == 3 and image.shape[2] in (3, 4):
+        return image[..., [2, 1, 0, 3][:image.shape[2]]]
+    return np.asarray(image)
+
+
+def call(fn, *args):
+    if TESSERACT_WORKERS == 0 or tesserocr is None:
+        return _run(fn, *args)
+    pool = get_pool()
+    try:
+        return pool.submit(_run, fn, *args).result()
+    except BrokenProcessPool:
+        discard_pool(pool)
+        raise
+
+
+def image_to_string(image, lang="eng", config=""):
+    return call(_image_to_string, as_rgb(image), lang, config)
+
+
+def image_to_data(image, lang="eng", config=""):
+    return call(_image_to_data, as_rgb(image), lang, config)
+
+
+def image_to_osd(image):
+    return call(_image_to_osd, as_rgb(image))
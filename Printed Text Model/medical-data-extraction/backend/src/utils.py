@@ -1,15 +1,44 @@
 import numpy as np
 import cv2
 
-def preprocess_image(img):
-    gray = cv2.cvtColor(np.array(img), cv2.COLOR_BGR2GRAY)
-    resized = cv2.resize(gray, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_LINEAR)
+def preprocess_image(img, scale=1.5, block_size=65):
+    # scale=1.5 and block_size=65 suit a page rendered at poppler's default
+    # 200 DPI; a page already rendered at its OCR resolution uses scale=1
+    # and a block size for that DPI (threshold_block_size)
+    img = np.array(img)
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    resized = gray if scale == 1 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
     processed_image = cv2.adaptiveThreshold(
         resized,
         255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY,
-        65, # block size (after trial and error)
+        block_size, # block size (after trial and error)
         13  # constant (after trial and error)
     )
-    return processed_image
\ No newline at end of file
+    return processed_image
+
+def threshold_block_size(dpi):
+    # The tuned block of 65 px at 300 DPI (200 DPI upscaled 1.5x), as an odd
+    # size for another DPI
+    return int(round(65 * dpi / 300)) // 2 * 2 + 1
+
+def measure_line_height(gray, dpi):
+    # Median height of the page's text lines in points, from the runs of
+    # inked rows. None when the page has too few lines to tell.
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    inked = np.count_nonzero(binary, axis=1) > max(2, binary.shape[1] // 200)
+    edges = np.diff(np.concatenate([[0], inked.astype(np.int8), [0]]))
+    heights = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    # Drop rules and specks, and pictures taller than an inch
+    heights = heights[(heights >= 2) & (heights <= dpi)]
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights)) * 72 / dpi
+
+def choose_dpi(width_pt, height_pt, line_height_pt, target_px, min_dpi, max_dpi, max_pixels):
+    # DPI at which text lines are target_px tall, within min_dpi..max_dpi, and
+    # never more than max_pixels for the whole page
+    dpi = min(max(target_px * 72 / line_height_pt, min_dpi), max_dpi)
+    budget = (max_pixels / ((width_pt / 72) * (height_pt / 72))) ** 0.5
+    return int(min(dpi, budget))
\ No newline at end of file
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import bulk_extract
+
+
+class Crash(BaseException):
+    # Not an Exception, so it stops the run instead of becoming an error row
+    pass
+
+
+@pytest.fixture()
+def extract(monkeypatch):
+    # Documents are "extracted" in threads of the test process; extract.calls
+    # lists them in order, and the document in extract.crash_on stops the run
+    def fake_extract(path, file_format, timings):
+        fake_extract.calls.append(path)
+        if path == fake_extract.crash_on:
+            raise Crash(path)
+        if path.endswith("broken.pdf"):
+            raise ValueError("no pages")
+        timings.update(text_layer=0.1, ocr=0.2, parse=0.3)
+        return {"provisional_diagnosis": f"diagnosis of {path}", "page_sources": "ocr"}
+
+    fake_extract.calls = []
+    fake_extract.crash_on = None
+    monkeypatch.setattr(bulk_extract, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(bulk_extract, "init_worker", lambda: None)
+    monkeypatch.setattr(bulk_extract.extractor, "extract", fake_extract)
+    return fake_extract
+
+
+def read_output(output):
+    if output.endswith(".parquet"):
+        return pd.read_parquet(output)
+    return pd.read_csv(output)
+
+
+@pytest.mark.parametrize("name", ["results.csv", "results.parquet"])
+def test_interrupted_run_resumes(tmp_path, extract, name):
+    output = str(tmp_path / name)
+    documents = [(f"doc{i}.pdf", "provisional_diagnosis") for i in range(1, 6)] + [("broken.pdf", "prescription")]
+
+    extract.crash_on = "doc4.pdf"
+    with pytest.raises(Crash):
+        bulk_extract.run(documents, output, workers=1, flush_every=2)
+    # Documents finished but not flushed before the crash are neither in the
+    # output nor in the checkpoint
+    flushed = list(read_output(output)["path"])
+    assert flushed and "doc4.pdf" not in flushed
+    assert bulk_extract.load_checkpoint(output + ".checkpoint") == set(flushed)
+
+    extract.calls.clear()
+    extract.crash_on = None
+    bulk_extract.run(documents, output, workers=1, flush_every=2)
+    assert extract.calls == [path for path, _ in documents if path not in flushed]
+
+    results = read_output(output)
+    assert sorted(results["path"]) == sorted(path for path, _ in documents)
+    assert results.set_index("path").loc["doc4.pdf", "provisional_diagnosis"] == "diagnosis of doc4.pdf"
+    assert results.set_index("path").loc["broken.pdf", "status"] == "error"
+
+    # A finished run has nothing left to do
+    extract.calls.clear()
+    bulk_extract.run(documents, output, workers=1, flush_every=2)
+    assert extract.calls == []
+    assert len(read_output(output)) == len(documents)
+
+
+@pytest.mark.parametrize("name", ["results.csv", "results.parquet"])
+def test_errors_are_retried_on_request(tmp_path, extract, name):
+    output = str(tmp_path / name)
+    documents = [("doc1.pdf", "prescription"), ("broken.pdf", "prescription")]
+    bulk_extract.run(documents, output, workers=1)
+
+    extract.calls.clear()
+    bulk_extract.run(documents, output, workers=1, retry_errors=True)
+    assert extract.calls == ["broken.pdf"]
+    # The retry replaces the document's earlier error row
+    results = read_output(output)
+    assert sorted(results["path"]) == ["broken.pdf", "doc1.pdf"]
+
+    # and later batches still land after it
+    bulk_extract.run(documents + [("doc2.pdf", "prescription")], output, workers=1)
+    assert sorted(read_output(output)["path"]) == ["broken.pdf", "doc1.pdf", "doc2.pdf"]
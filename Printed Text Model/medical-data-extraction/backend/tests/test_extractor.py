@@ -0,0 +1,110 @@
+import pytest
+
+import extractor
+
+# Run from medical-data-extraction with backend/src on the path:
+# PYTHONPATH=backend/src python -m pytest backend/tests
+
+TEXT_LAYER_PAGE = """
+Patient Name: Jerry Lucas            Date: 5/11/2022
+Provisional Diagnosis: Essential hypertension, type 2 diabetes
+"""
+
+
+@pytest.fixture()
+def pdf(monkeypatch):
+    # A document whose pages have the given text layers (pages past them have
+    # none), OCR'd pages read as "ocr page <n>" without poppler or Tesseract
+    def make(*text_layer, pages=None):
+        monkeypatch.setattr(extractor, "OCR_WORKERS", 0)
+        monkeypatch.setattr(extractor, "count_pages", lambda file_path: pages or len(text_layer))
+        monkeypatch.setattr(extractor, "read_text_layer", lambda file_path: list(text_layer))
+        monkeypatch.setattr(extractor, "ocr_page", lambda file_path, page_number: f"ocr page {page_number}")
+        return "referral.pdf"
+    return make
+
+
+def test_real_text_layer_is_usable():
+    assert extractor.is_usable_text(TEXT_LAYER_PAGE)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    " \n\t\n  ",
+    "Page 1",
+    # Glyphs of a font without a Unicode map
+    "��� ���� ����� �����������������",
+    "@@ ~~ ^^ || ** {} <> $$ @@ ~~ ^^ || ** {} <> $$ ab",
+])
+def test_missing_or_garbage_text_is_not_usable(text):
+    assert not extractor.is_usable_text(text)
+
+
+def test_page_sources(pdf):
+    file_path = pdf(TEXT_LAYER_PAGE, "   ", "�" * 40)
+    text, sources = extractor.extract_text(file_path)
+    assert sources == ["text_layer", "ocr", "ocr"]
+    assert text == "\n" + TEXT_LAYER_PAGE + "\nocr page 2\nocr page 3"
+
+
+def test_pages_missing_from_the_text_layer_are_ocrd(pdf):
+    file_path = pdf(TEXT_LAYER_PAGE, pages=2)
+    assert extractor.extract_text(file_path)[1] == ["text_layer", "ocr"]
+
+
+def test_page_sources_are_reported(pdf):
+    file_path = pdf("", TEXT_LAYER_PAGE)
+    assert extractor.extract(file_path, "prescription")["page_sources"] == "ocr,text_layer"
+
+
+LINES = [("Patient Name: Jerry Lucas", 100, 130), ("Date: 5/11/2022", 150, 180),
+         ("Provisional Diagnosis:", 300, 340), ("Essential hypertension", 360, 390), ("Type 2 diabetes", 410, 440)]
+
+
+def test_find_region():
+    region = {"anchor": r"(?i)provisional\s*diagnosis", "lines": 4}
+    # Half a line of margin around the anchor line and the lines below it,
+    # as many as the page has
+    assert extractor.find_region(LINES, region) == (280, 460)
+    assert extractor.find_region(LINES, dict(region, lines=1)) == (280, 410)
+    assert extractor.find_region(LINES[:2], region) is None
+
+
+@pytest.fixture()
+def crops(monkeypatch):
+    # OCR'd pages hold the diagnosis crop from page_crops, by page number
+    page_crops = {}
+    monkeypatch.setattr(extractor, "ocr_page_fields",
+                        lambda file_path, page_number, fields: {field: page_crops[page_number]
+                                                                for field in fields if page_number in page_crops})
+    return page_crops
+
+
+def test_extract_fields_prefers_the_text_layer(pdf, crops):
+    file_path = pdf("", TEXT_LAYER_PAGE)
+    crops[1] = "Provisional Diagnosis: dengue"
+    assert extractor.extract_fields(file_path, ["provisional_diagnosis"]) == ("\n" + TEXT_LAYER_PAGE,
+                                                                             ["ocr", "text_layer"])
+
+
+def test_extract_fields_reads_the_first_crop_found(pdf, crops):
+    file_path = pdf(pages=3)
+    crops.update({2: "Provisional Diagnosis: HTN", 3: "Provisional Diagnosis: T2DM"})
+    assert extractor.extract_fields(file_path, ["provisional_diagnosis"]) == ("\nProvisional Diagnosis: HTN",
+                                                                             ["ocr", "ocr", "ocr"])
+
+
+def test_extract_fields_without_the_field(pdf, crops):
+    assert extractor.extract_fields(pdf(pages=2), ["provisional_diagnosis"]) is None
+
+
+def test_fallback_reuses_the_page_count_and_text_layer(pdf, crops, monkeypatch):
+    file_path = pdf(pages=2)
+    calls = []
+    for name in ("count_pages", "read_text_layer"):
+        read = getattr(extractor, name)
+        monkeypatch.setattr(extractor, name, lambda file_path, read=read, name=name: calls.append(name) or read(file_path))
+
+    data = extractor.extract(file_path, "provisional_diagnosis")
+    assert data == {"provisional_diagnosis": "", "page_sources": "ocr,ocr"}
+    assert calls == ["count_pages", "read_text_layer"]
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture()
+def client(monkeypatch):
+    # extract() is replaced by extract.result, or raises extract.error;
+    # extract.paths lists the uploads it was given and their contents
+    def fake_extract(file_path, file_format):
+        with open(file_path, "rb") as f:
+            fake_extract.paths.append((file_path, f.read()))
+        if fake_extract.error:
+            raise fake_extract.error
+        return fake_extract.result
+
+    fake_extract.paths = []
+    fake_extract.error = None
+    fake_extract.result = {"provisional_diagnosis": "HTN", "page_sources": "text_layer"}
+    monkeypatch.setattr(main, "extract", fake_extract)
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+    client = TestClient(main.app)
+    client.extract = fake_extract
+    return client
+
+
+def post(client, file_format="provisional_diagnosis", **data):
+    return client.post("/extract_from_doc", files={"file": ("referral.pdf", b"%PDF-1.7 referral")},
+                       data={"file_format": file_format, **data})
+
+
+def test_extracts_the_upload(client):
+    response = post(client)
+    assert response.status_code == 200
+    assert response.json() == client.extract.result
+
+    # The upload reached extract() whole and was removed afterwards
+    [(file_path, content)] = client.extract.paths
+    assert file_path.endswith(".pdf") and content == b"%PDF-1.7 referral"
+    assert not os.path.exists(file_path)
+
+
+def test_failed_extraction_is_a_server_error(client):
+    client.extract.error = ValueError("no pages")
+    response = post(client)
+    assert response.status_code == 500
+    assert response.json() == {"error": "no pages"}
+    assert not os.path.exists(client.extract.paths[0][0])
+
+
+@pytest.mark.parametrize("file_format, output", [("invoice", "json"), ("prescription", "pdf")])
+def test_invalid_request_is_a_client_error(client, file_format, output):
+    response = post(client, file_format, output=output)
+    assert response.status_code == 400
+    assert "error" in response.json()
+    assert client.extract.paths == []
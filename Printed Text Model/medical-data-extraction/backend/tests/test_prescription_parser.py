@@ -66,4 +66,31 @@ Address: 2 cricket blvd, New Delhi
 
 Directions: Use two tablets daily for three months
 
-Refill: 3 times"""
\ No newline at end of file
+Refill: 3 times"""
+
+def test_parse_document_1():
+    assert PrescriptionParser(document_text_1).parse() == {
+        "patient_name": "Marta Sharapova",
+        "patient_address": "9 tennis court, new Russia, DC",
+        "medicines": "Prednisone 20 md\nLialda 2.4 gram",
+        "directions": "Prednisone, Taper 5 mg every 3 days,\nFinish in 2.5 weeks 7\nLialda - take 2 pill everyday for 1 month",
+        "refill": "2",
+    }
+
+def test_parse_document_2():
+    assert PrescriptionParser(document_text_2).parse() == {
+        "patient_name": "Virat Kohli",
+        "patient_address": "2 cricket blvd, New Delhi",
+        "medicines": "| Omeprazole 40 mg",
+        "directions": "Use two tablets daily for three months",
+        "refill": "3",
+    }
+
+def test_missing_field_is_none():
+    assert PrescriptionParser("Name: Marta Sharapova Date: 5/11/2022").parse()["refill"] is None
+
+def test_multiline_fields_stop_at_first_heading():
+    # Two prescriptions run together: each field comes from the first one
+    parsed = PrescriptionParser(document_text_1 + "\n" + document_text_2).parse()
+    assert parsed["directions"].endswith("for 1 month")
+    assert "Omeprazole" not in parsed["medicines"]
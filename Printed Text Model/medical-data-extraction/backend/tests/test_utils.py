@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import utils
+
+A4_PT = (595, 842)
+
+
+def text_page(dpi, line_height_pt, lines=12):
+    # White A4 page with solid text lines line_height_pt tall, two line
+    # heights apart
+    width, height = (int(side * dpi / 72) for side in A4_PT)
+    page = np.full((height, width), 255, np.uint8)
+    line_px = int(round(line_height_pt * dpi / 72))
+    for i in range(lines):
+        top = line_px * (2 + 2 * i)
+        page[top:top + line_px, width // 10:width * 9 // 10] = 0
+    return page
+
+
+@pytest.mark.parametrize("dpi, block_size", [(300, 65), (150, 33), (600, 131), (72, 17)])
+def test_threshold_block_size(dpi, block_size):
+    assert utils.threshold_block_size(dpi) == block_size
+    assert block_size % 2 == 1
+
+
+@pytest.mark.parametrize("dpi, line_height_pt", [(72, 10), (72, 24), (144, 8)])
+def test_measure_line_height(dpi, line_height_pt):
+    assert utils.measure_line_height(text_page(dpi, line_height_pt), dpi) == pytest.approx(line_height_pt, abs=72 / dpi)
+
+
+def test_measure_line_height_needs_a_few_lines():
+    assert utils.measure_line_height(text_page(72, 10, lines=2), 72) is None
+    assert utils.measure_line_height(np.full((842, 595), 255, np.uint8), 72) is None
+
+
+@pytest.mark.parametrize("line_height_pt, dpi", [
+    (9.6, 300),
+    (12, 240),
+    # Small print is capped at max_dpi, large print at min_dpi
+    (8, 300),
+    (24, 150),
+])
+def test_choose_dpi(line_height_pt, dpi):
+    assert utils.choose_dpi(*A4_PT, line_height_pt, 40, 150, 300, 25_000_000) == dpi
+
+
+def test_choose_dpi_keeps_large_pages_within_the_pixel_budget():
+    # A0 at 300 DPI would be 140 million pixels
+    width_pt, height_pt = 2384, 3370
+    dpi = utils.choose_dpi(width_pt, height_pt, 8, 40, 150, 300, 25_000_000)
+    assert dpi < 150
+    assert (width_pt * dpi / 72) * (height_pt * dpi / 72) <= 25_000_000
@@ -109,10 +109,8 @@ elif st.session_state['page'] == "Process":
             headers = {}
             response = requests.post(URL, headers=headers, data=payload, files=files)
 
-            if response.status_code == 200:
-                excel_file = io.BytesIO(response.content)
-                excel_file.seek(0)
-                df = pd.read_excel(excel_file)
+            if response.status_code == 200 and 'error' not in response.json():
+                df = pd.DataFrame([response.json()])
 
                 # MODIFIED: Only keep 'provisional_diagnosis' column and add 'file_name' column
                 df = df[['provisional_diagnosis']]
@@ -2,7 +2,7 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import numpy as np
 import cv2
-import pytesseract
+import tesseract_pool
 from fuzzywuzzy import fuzz
 import os
 
@@ -35,7 +35,7 @@ def preprocess_image(img):
 
 def extract_text_with_boxes(image):
     processed_image = preprocess_image(image)
-    data = pytesseract.image_to_data(processed_image, output_type=pytesseract.Output.DICT)
+    data = tesseract_pool.image_to_data(processed_image)
     
     extracted_data = []
     for i in range(len(data['text'])):
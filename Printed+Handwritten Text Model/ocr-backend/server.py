@@ -1,31 +1,23 @@
 import cv2
 import numpy as np
 import pytesseract
+import tesseract_pool
+from orientation import line_profiles, orientation_stats, precheck_orientation
+from skew import estimate_skew
 from fuzzywuzzy import fuzz
-from scipy.ndimage import rotate
 import os
 
 # Ensure you have Tesseract installed and specify the path to Tesseract
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
 # Step 1: Skew correction
-def correct_skew(image, delta=1, limit=5):
-    def determine_score(arr, angle):
-        data = rotate(arr, angle, reshape=False, order=0)
-        histogram = np.sum(data, axis=1, dtype=float)
-        score = np.sum((histogram[1:] - histogram[:-1]) ** 2, dtype=float)
-        return histogram, score
-
+# The estimators live in skew.py, a copy of the Django API's diagnosis/skew.py.
+# A profiles dict receives the row and column ink profiles of the
+# straightened page, for the orientation pre-check
+def correct_skew(image, delta=1, limit=5, engine="projection", profiles=None):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
-
-    scores = []
-    angles = np.arange(-limit, limit + delta, delta)
-    for angle in angles:
-        _, score = determine_score(thresh, angle)
-        scores.append(score)
-
-    best_angle = angles[scores.index(max(scores))]
+    best_angle = estimate_skew(thresh, delta=delta, limit=limit, engine=engine, profiles=profiles)
 
     (h, w) = image.shape[:2]
     center = (w // 2, h // 2)
@@ -35,16 +27,22 @@ def correct_skew(image, delta=1, limit=5):
     return corrected
 
 # Step 2: Orientation correction
-def correct_image_orientation(image):
+# Tesseract OSD only runs when the pre-check can't tell the page is upright
+def correct_image_orientation(image, profiles=None):
     (h, w) = image.shape[:2]
 
     # Skip orientation correction for images smaller than 700x700
     if h < 700 or w < 700:
+        orientation_stats.record('small')
         return image
 
-    config = "--psm 0"  # Page segmentation mode for orientation detection
-    osd = pytesseract.image_to_osd(image, config=config)
-    angle = int(osd.split("Rotate: ")[1].split("\n")[0])
+    if profiles is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        profiles = line_profiles(cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1])
+    angle = precheck_orientation(profiles)
+    orientation_stats.record('osd' if angle is None else 'precheck')
+    if angle is None:
+        angle = int(tesseract_pool.image_to_osd(image)["rotate"])
 
     if angle != 0:
         center = (w // 2, h // 2)
@@ -54,8 +52,8 @@ def correct_image_orientation(image):
     return image
 
 # Step 3: Preprocess image
-def preprocess_image(img):
-    corrected_img = correct_image_orientation(img)
+def preprocess_image(img, profiles=None):
+    corrected_img = correct_image_orientation(img, profiles)
     gray = cv2.cvtColor(np.array(corrected_img), cv2.COLOR_BGR2GRAY)
     orig_height, orig_width = gray.shape
     height, width = orig_height, orig_width
@@ -77,11 +75,11 @@ def preprocess_image(img):
     return processed_image, scale_factor, orig_width, orig_height
 
 # Step 4: Extract text with bounding boxes
-def extract_text_with_boxes(image):
-    processed_image, scale_factor, orig_width, orig_height = preprocess_image(image)
+def extract_text_with_boxes(image, profiles=None):
+    processed_image, scale_factor, orig_width, orig_height = preprocess_image(image, profiles)
     config = "--psm 6 --oem 3"
 
-    data = pytesseract.image_to_data(processed_image, output_type=pytesseract.Output.DICT, config=config)
+    data = tesseract_pool.image_to_data(processed_image, config=config)
 
     extracted_data = []
     for i in range(len(data['text'])):
@@ -161,10 +159,11 @@ def process_images(input_folder, output_folder):
                 continue
 
             # Step 1: Skew correction
-            skew_corrected_image = correct_skew(image)
+            profiles = {}
+            skew_corrected_image = correct_skew(image, profiles=profiles)
 
             # Step 2: Extract text and draw diagnosis box for larger images
-            extracted_image, extracted_data = extract_text_with_boxes(skew_corrected_image)
+            extracted_image, extracted_data = extract_text_with_boxes(skew_corrected_image, profiles)
             
             # Step 3: Initialize ROIs list and check image size for bounding box
             rois = []
@@ -195,11 +194,16 @@ def process_images(input_folder, output_folder):
 
             print(f"Processed: {filename}")
 
-# Example usage
-input_folder = "./input2/"  # Folder containing the input images
-output_folder = "./output"  # Folder where the ROIs will be saved
+    stats = orientation_stats.stats()
+    print(f"Orientation: OSD skipped for {stats['precheck']} of {stats['precheck'] + stats['osd']} pages "
+          f"({stats['osd_skip_rate']:.0%}), {stats['small']} too small to check")
+
+# Example usage (guarded, the Tesseract worker processes import this module)
+if __name__ == "__main__":
+    input_folder = "./input2/"  # Folder containing the input images
+    output_folder = "./output"  # Folder where the ROIs will be saved
 
-# Ensure the output folder exists
-os.makedirs(output_folder, exist_ok=True)
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
 
-process_images(input_folder, output_folder)
+    process_images(input_folder, output_folder)
@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+from scipy.ndimage import rotate
+
+try:
+    from .orientation import profiles_from_points
+except ImportError:
+    # Flat import in the Flask OCR backend's copy
+    from orientation import profiles_from_points
+
+# Skew estimators used by utils.correct_skew. Both take the inverted Otsu
+# threshold of the page and return the angle (in degrees, same sign convention
+# as scipy.ndimage.rotate / cv2.getRotationMatrix2D) that best straightens it.
+# A profiles dict passed to the projection engine receives the row and column
+# profiles of the straightened page, for the orientation pre-check.
+#
+# The Django API (diagnosis/skew.py) and the Flask OCR backend share this
+# module. Edit the Django copy and copy it over,
+# diagnosis.tests.SharedModuleTests fails when the copies differ.
+
+SKEW_ENGINES = ("projection", "rotate")
+
+# Longest side of the page used for the coarse and the refinement passes
+COARSE_MAX_SIDE = 600
+FINE_MAX_SIDE = 1200
+FINE_STEP = 0.1
+
+
+def profile_score(histogram):
+    return np.sum((histogram[1:] - histogram[:-1]) ** 2, dtype=float)
+
+
+# Original estimator: full resolution rotate of the whole page per angle
+def estimate_skew_rotate(thresh, delta=1, limit=5):
+    scores = []
+    angles = np.arange(-limit, limit + delta, delta)
+    for angle in angles:
+        data = rotate(thresh, angle, reshape=False, order=0)
+        histogram = np.sum(data, axis=1, dtype=float)
+        scores.append(profile_score(histogram))
+
+    return float(angles[scores.index(max(scores))])
+
+
+def _downsample(thresh, max_side):
+    (h, w) = thresh.shape[:2]
+    scale = min(1.0, max_side / float(max(h, w)))
+    if scale < 1.0:
+        thresh = cv2.resize(thresh, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return thresh
+
+
+def _foreground(thresh):
+    # Foreground pixel coordinates relative to the page centre, weighted by
+    # their (area averaged) intensity so downsampling keeps stroke mass
+    ys, xs = np.nonzero(thresh)
+    weights = thresh[ys, xs].astype(np.float64)
+    (h, w) = thresh.shape[:2]
+    return ys - (h // 2), xs - (w // 2), weights
+
+
+def _projection_scores(ys, xs, weights, angles):
+    # Projection profile of the page rotated by each angle without rotating
+    # any pixels: each foreground pixel is binned by the row it would land on
+    n_bins = int(np.ceil(np.hypot(ys.max(initial=0) - ys.min(initial=0), xs.max(initial=0) - xs.min(initial=0)))) + 3
+    offset = n_bins // 2
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64)
+
+    scores = []
+    for angle in angles:
+        theta = np.deg2rad(angle)
+        rows = np.rint(ys * np.cos(theta) - xs * np.sin(theta)).astype(np.int64) + offset
+        histogram = np.bincount(rows, weights=weights, minlength=n_bins)
+        scores.append(profile_score(histogram))
+    return np.array(scores)
+
+
+# Coarse to fine estimator: search the full range on a small copy of the page,
+# then refine only around the best coarse angle on a larger copy
+def estimate_skew_projection(thresh, delta=1, limit=5, fine_step=FINE_STEP, profiles=None):
+    coarse_angles = np.arange(-limit, limit + delta, delta, dtype=np.float64)
+    ys, xs, weights = _foreground(_downsample(thresh, COARSE_MAX_SIDE))
+    if weights.size == 0:
+        return 0.0
+
+    coarse_scores = _projection_scores(ys, xs, weights, coarse_angles)
+    best_coarse = coarse_angles[int(np.argmax(coarse_scores))]
+
+    low = max(-limit, best_coarse - delta)
+    high = min(limit, best_coarse + delta)
+    fine_angles = np.arange(low, high + fine_step / 2, fine_step)
+    ys, xs, weights = _foreground(_downsample(thresh, FINE_MAX_SIDE))
+    fine_scores = _projection_scores(ys, xs, weights, fine_angles)
+
+    angle = round(float(fine_angles[int(np.argmax(fine_scores))]), 2) + 0.0
+    if profiles is not None:
+        profiles.update(profiles_from_points(ys, xs, weights, angle))
+    return angle
+
+
+def estimate_skew(thresh, delta=1, limit=5, engine="projection", profiles=None):
+    if engine == "projection":
+        return estimate_skew_projection(thresh, delta=delta, limit=limit, profiles=profiles)
+    if engine == "rotate":
+        return estimate_skew_rotate(thresh, delta=delta, limit=limit)
+    raise ValueError(f"Unknown skew engine: {engine}")
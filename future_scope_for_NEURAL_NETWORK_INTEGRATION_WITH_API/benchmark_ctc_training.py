@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import Adam
+
+from models.cnn_lstm_ctc import create_model, create_training_model
+from utils.ctc_decoding import CHARSET
+from utils.data_loader import make_dataset
+from utils.experiments import BUCKET_BOUNDARIES
+from utils.vocabulary import CharVocabulary
+
+
+def write_labelled_dataset(dataset_dir, count, max_length=24, seed=0):
+    """
+    Writes `count` random 32x128 PNGs whose labels have a long-tailed length
+    distribution (mostly short words, some long phrases), like handwritten
+    diagnosis lines.
+    """
+    rng = np.random.default_rng(seed)
+    letters = CHARSET.replace(' ', '').replace('_', '')
+    for i in range(count):
+        length = int(min(max_length, 1 + rng.geometric(0.15)))
+        label = "".join(rng.choice(list(letters), size=length))
+        # Labels come from the file name, so keep path separators out of them
+        label = label.replace('/', 'x')
+        image = rng.integers(0, 256, size=(32, 128), dtype=np.uint8)
+        cv2.imwrite(os.path.join(dataset_dir, f"{label}_{i}.png"), image)
+
+
+def pad_to(dataset, max_length, blank):
+    # Every batch padded to the longest label in the dataset, the way a
+    # single label array for the whole dataset would be
+    def pad(batch):
+        padding = max_length - tf.shape(batch['label'])[1]
+        batch['label'] = tf.pad(batch['label'], [[0, 0], [0, padding]], constant_values=blank)
+        return batch
+    return dataset.map(pad)
+
+
+def epoch_seconds(dataset, epochs):
+    """
+    Average seconds per training epoch, after one warm-up epoch.
+    """
+    vocabulary = CharVocabulary()
+    training_model = create_training_model(create_model((32, 128, 1), vocabulary.num_classes))
+    training_model.compile(optimizer=Adam())
+    training_model.fit(dataset, epochs=1, verbose=0)
+    start = time.perf_counter()
+    training_model.fit(dataset, epochs=epochs, verbose=0)
+    return (time.perf_counter() - start) / epochs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU epoch time of CTC training with and without length buckets")
+    parser.add_argument('--images', type=int, default=1024, help='Size of the synthetic dataset')
+    parser.add_argument('--batch_size', type=int, default=32, help='Training batch size')
+    parser.add_argument('--epochs', type=int, default=2, help='Timed epochs per run')
+    args = parser.parse_args()
+
+    tf.config.set_visible_devices([], 'GPU')
+    vocabulary = CharVocabulary()
+    with tempfile.TemporaryDirectory() as dataset_dir:
+        write_labelled_dataset(dataset_dir, args.images)
+        max_length = max(len(vocabulary.encode(name.split('_')[0])) for name in os.listdir(dataset_dir))
+
+        naive = epoch_seconds(pad_to(make_dataset(dataset_dir, args.batch_size, seed=0), max_length,
+                                     vocabulary.blank), args.epochs)
+        print(f"[INFO] padded to the longest label ({max_length}): {naive:.2f} s/epoch")
+
+        bucketed = epoch_seconds(make_dataset(dataset_dir, args.batch_size, seed=0,
+                                              bucket_boundaries=BUCKET_BOUNDARIES), args.epochs)
+        print(f"[INFO] bucketed by label length {BUCKET_BOUNDARIES}: {bucketed:.2f} s/epoch, "
+              f"{naive / bucketed:.2f}x")
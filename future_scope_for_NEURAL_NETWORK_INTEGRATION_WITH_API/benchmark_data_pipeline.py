@@ -0,0 +1,99 @@
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from utils.data_loader import list_samples, make_dataset
+from utils.dataset_cache import compile_dataset, make_cached_dataset
+from utils.image_preprocessing import preprocess_image
+
+
+def write_synthetic_dataset(dataset_dir, count, seed=0):
+    """
+    Writes `count` grayscale PNGs of varying line sizes, named "label_index.png"
+    like the IAM forms.
+    """
+    rng = np.random.default_rng(seed)
+    words = ['fever', 'cough', 'Diabetes', 'hypertension', 'Asthma', 'migraine']
+    for i in range(count):
+        height = int(rng.integers(32, 96))
+        width = int(rng.integers(96, 600))
+        image = rng.integers(0, 256, size=(height, width), dtype=np.uint8)
+        cv2.imwrite(os.path.join(dataset_dir, f"{words[i % len(words)]}_{i}.png"), image)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_epoch(dataset):
+    """
+    One epoch through a training dataset.
+
+    Returns:
+        float: Images per second.
+    """
+    start = time.perf_counter()
+    images = 0
+    for batch in dataset:
+        images += int(tf.shape(batch['image'])[0])
+    return images / (time.perf_counter() - start)
+
+
+def benchmark_in_memory(dataset_dir):
+    """
+    Every image decoded into memory before preprocessing, the way
+    run_experiment prepares its inputs. (load_data itself fails on images of
+    different sizes, so the decoded images are kept in a list.)
+
+    Returns:
+        float: Images per second.
+    """
+    start = time.perf_counter()
+    paths, _ = list_samples(dataset_dir)
+    images = [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in paths]
+    processed = np.stack([preprocess_image(image) for image in images])
+    return len(processed) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and peak memory of the training data pipeline")
+    parser.add_argument('--dataset_dir', type=str, default=None,
+                        help='Dataset to read (a synthetic one is generated by default)')
+    parser.add_argument('--images', type=int, default=2000, help='Size of the synthetic dataset')
+    parser.add_argument('--batch_size', type=int, default=16, help='Training batch size')
+    parser.add_argument('--mode', choices=['stream', 'in_memory', 'cached'], default='stream',
+                        help='make_dataset, decode everything up front, or make_cached_dataset over compiled shards')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Compiled dataset for --mode cached (compiled into a temporary directory by default)')
+    args = parser.parse_args()
+
+    # Run each mode in its own process: peak RSS never goes down
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = args.dataset_dir
+        if dataset_dir is None and not args.cache_dir:
+            dataset_dir = os.path.join(tmp, 'images')
+            os.makedirs(dataset_dir)
+            write_synthetic_dataset(dataset_dir, args.images)
+        cache_dir = args.cache_dir
+        if args.mode == 'cached' and cache_dir is None:
+            cache_dir = os.path.join(tmp, 'compiled')
+            start = time.perf_counter()
+            compile_dataset(dataset_dir, cache_dir)
+            print(f"[INFO] compile_dataset took {time.perf_counter() - start:.1f} s")
+
+        baseline = peak_rss_mb()
+        if args.mode == 'in_memory':
+            throughput = benchmark_in_memory(dataset_dir)
+        elif args.mode == 'cached':
+            throughput = benchmark_epoch(make_cached_dataset(cache_dir, batch_size=args.batch_size))
+        else:
+            throughput = benchmark_epoch(make_dataset(dataset_dir, batch_size=args.batch_size))
+        print(f"[INFO] {args.mode}: {throughput:.1f} images/s, peak RSS {peak_rss_mb():.0f} MB "
+              f"(+{peak_rss_mb() - baseline:.0f} MB over start)")
@@ -0,0 +1,140 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmark_inference import random_rois
+from export_model import QUANTIZATIONS, export_tflite
+from lite_model import LiteModel
+from models.cnn_lstm_ctc import create_model
+from utils.ctc_decoding import CHARSET, decode
+from utils.data_loader import make_dataset
+from utils.image_preprocessing import preprocess_image
+from utils.vocabulary import CharVocabulary
+
+# Start-up time is measured in a fresh interpreter: import, load, first prediction
+COLD_START = {
+    'keras': (
+        "import numpy as np, tensorflow as tf\n"
+        "model = tf.keras.models.load_model({path!r}, compile=False)\n"
+        "model(np.zeros((1,) + model.input_shape[1:], np.float32), training=False)\n"
+    ),
+    'tflite': (
+        "import numpy as np\n"
+        "from lite_model import LiteModel\n"
+        "model = LiteModel({path!r})\n"
+        "model.predict(np.zeros((1,) + model.input_shape[1:], np.float32))\n"
+    ),
+}
+
+
+def cold_start_seconds(kind, path):
+    script = "import time\nstart = time.perf_counter()\n" + COLD_START[kind].format(path=path) + \
+             "print(time.perf_counter() - start)\n"
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def latency_ms(predict, batch, repeats=50):
+    """
+    Average milliseconds per image, predicting one image at a time.
+    """
+    predict(batch[:1])
+    start = time.perf_counter()
+    for i in range(repeats):
+        predict(batch[i % len(batch):i % len(batch) + 1])
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def character_error_rate(predictions, labels):
+    """
+    Edit distance between predictions and labels over the label characters.
+    """
+    errors = 0
+    for prediction, label in zip(predictions, labels):
+        previous = list(range(len(label) + 1))
+        for i, char in enumerate(prediction, 1):
+            current = [i]
+            for j, expected in enumerate(label, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != expected)))
+            previous = current
+        errors += previous[-1]
+    return errors / max(1, sum(len(label) for label in labels))
+
+
+def evaluation_set(dataset_dir, count, height, width):
+    """
+    Preprocessed images and their labels, from the dataset or synthetic
+    (unlabelled) ROIs.
+    """
+    if dataset_dir is None:
+        images = np.stack([preprocess_image(roi, target_size=(width, height)) for roi in random_rois(count)])
+        return images, None
+    vocabulary = CharVocabulary()
+    images, labels = [], []
+    for batch in make_dataset(dataset_dir, batch_size=count, target_size=(width, height), shuffle=False).take(1):
+        images = batch['image'].numpy()
+        labels = [vocabulary.decode(ids[:length]) for ids, length in
+                  zip(batch['label'].numpy(), batch['label_length'].numpy())]
+    return images, labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy and latency of the exported model against Keras")
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='Saved Keras model (an untrained model of the same architecture by default)')
+    parser.add_argument('--dataset_dir', type=str, default=None,
+                        help='Labelled images for the character error rate (synthetic ROIs by default)')
+    parser.add_argument('--images', type=int, default=128, help='Images to evaluate')
+    parser.add_argument('--report', type=str, default=None, help='Also write the report to this Markdown file')
+    args = parser.parse_args()
+
+    tf.config.set_visible_devices([], 'GPU')
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path
+        if model_path is None:
+            model_path = os.path.join(tmp, 'model.keras')
+            create_model((32, 128, 1), len(CHARSET) + 1).save(model_path)
+        model = tf.keras.models.load_model(model_path, compile=False)
+        height, width = model.input_shape[1:3]
+        images, labels = evaluation_set(args.dataset_dir, args.images, height, width)
+
+        infer = tf.function(lambda batch: model(batch, training=False),
+                            input_signature=[tf.TensorSpec([None, height, width, 1], tf.float32)])
+        reference = infer(images).numpy()
+        reference_text = decode(reference)
+
+        rows = [('keras', os.path.getsize(model_path), cold_start_seconds('keras', model_path),
+                 latency_ms(lambda batch: infer(batch).numpy(), images), 0.0, 1.0,
+                 character_error_rate(reference_text, labels) if labels else None)]
+
+        for quantize in QUANTIZATIONS:
+            path = os.path.join(tmp, f"model.{quantize}.tflite")
+            size = export_tflite(model, path, quantize)
+            lite = LiteModel(path)
+            probabilities = lite.predict(images)
+            text = decode(probabilities)
+            rows.append((f"tflite {quantize}", size, cold_start_seconds('tflite', path), latency_ms(lite.predict, images),
+                         float(np.abs(probabilities - reference).max()),
+                         float(np.mean([a == b for a, b in zip(text, reference_text)])),
+                         character_error_rate(text, labels) if labels else None))
+
+    lines = [
+        "| format | size (MB) | cold start (s) | latency (ms/image) | max prob diff | same text as keras | CER |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for name, size, start, latency, diff, agreement, cer in rows:
+        lines.append(f"| {name} | {size / 1e6:.2f} | {start:.2f} | {latency:.2f} | {diff:.4f} | {agreement:.1%} | "
+                     f"{'n/a' if cer is None else f'{cer:.3f}'} |")
+    report = "\n".join(lines)
+    print(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(report + "\n")
+        print(f"[INFO] Report written to {args.report}")
@@ -0,0 +1,80 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from inference_server import InferenceServer
+from models.cnn_lstm_ctc import create_model
+from utils.ctc_decoding import CHARSET
+
+
+def random_rois(count, height=48, width=200, seed=0):
+    """
+    Synthetic grayscale ROIs of a typical handwritten diagnosis line size.
+    """
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(height, width), dtype=np.uint8) for _ in range(count)]
+
+
+def benchmark_single(server, images):
+    """
+    One model call per image, the way load_and_predict works (minus the
+    per-call model load).
+
+    Returns:
+        float: Images per second.
+    """
+    start = time.perf_counter()
+    for image in images:
+        server.predict_batch([image])
+    return len(images) / (time.perf_counter() - start)
+
+
+def benchmark_batched(server, images, concurrency):
+    """
+    `concurrency` client threads calling predict() at once, gathered into
+    micro-batches by the server.
+
+    Returns:
+        float: Images per second.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(server.predict, images))
+    return len(images) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single vs micro-batched CPU inference throughput")
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='Saved model to benchmark (an untrained model of the same architecture by default)')
+    parser.add_argument('--requests', type=int, default=512, help='Number of ROIs to predict')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients for the batched run')
+    parser.add_argument('--batch_sizes', type=str, default='8,16,32', help='Comma separated max batch sizes')
+    parser.add_argument('--max_latency_ms', type=float, default=10, help='Micro-batch latency budget')
+    parser.add_argument('--decoder', choices=['greedy', 'beam'], default='greedy', help='CTC decoding method')
+    args = parser.parse_args()
+
+    tf.config.set_visible_devices([], 'GPU')
+    if args.model_path:
+        model = tf.keras.models.load_model(args.model_path, compile=False)
+    else:
+        model = create_model((32, 128, 1), len(CHARSET) + 1)
+
+    images = random_rois(args.requests)
+
+    server = InferenceServer(model, max_batch_size=1, decoder=args.decoder)
+    single = benchmark_single(server, images)
+    server.close()
+    print(f"[INFO] single requests: {single:.1f} images/s")
+
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        server = InferenceServer(model, max_batch_size=batch_size, max_latency_ms=args.max_latency_ms,
+                                 decoder=args.decoder)
+        batched = benchmark_batched(server, images, args.concurrency)
+        stats = server.stats()
+        server.close()
+        print(f"[INFO] micro-batched (max {batch_size}, {args.concurrency} clients): {batched:.1f} images/s, "
+              f"avg batch {stats['avg_batch_size']}, {batched / single:.1f}x single")
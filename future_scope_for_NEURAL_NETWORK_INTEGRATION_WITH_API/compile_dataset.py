@@ -0,0 +1,23 @@
+import argparse
+import time
+
+from utils.dataset_cache import compile_dataset
+
+# Decode and resize the dataset once, so training runs read memory-mapped
+# shards (utils.dataset_cache.make_cached_dataset) instead of PNGs.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a handwriting dataset into memory-mapped shards")
+    parser.add_argument('dataset_dir', type=str, help='Directory of "label_name.png" images')
+    parser.add_argument('output_dir', type=str, help='Directory for the shards and index.json')
+    parser.add_argument('--width', type=int, default=128, help='Model input width')
+    parser.add_argument('--height', type=int, default=32, help='Model input height')
+    parser.add_argument('--shard_size', type=int, default=4096, help='Samples per shard')
+    parser.add_argument('--workers', type=int, default=None, help='Decoding threads (one per CPU by default)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = compile_dataset(args.dataset_dir, args.output_dir, (args.width, args.height), args.shard_size,
+                            workers=args.workers)
+    print(f"[INFO] Compiled {index['samples']} images into {len(index['shards'])} shards "
+          f"in {time.perf_counter() - start:.1f} s")
@@ -1,10 +1,15 @@
 from tensorflow.keras.optimizers import Adam
-from models.cnn_lstm_ctc import create_model, ctc_loss
-from utils.data_loader import load_data
-from utils.image_preprocessing import preprocess_image
+from models.cnn_lstm_ctc import create_model, create_training_model
+from utils.data_loader import make_dataset
+from utils.dataset_cache import make_cached_dataset
+from utils.vocabulary import CharVocabulary
 import matplotlib.pyplot as plt
 
-def run_experiment(dataset_dir, epochs=20, batch_size=16, learning_rate=0.001):
+# Label lengths at which batches are split into buckets
+BUCKET_BOUNDARIES = [4, 8, 12, 16, 24]
+
+def run_experiment(dataset_dir, epochs=20, batch_size=16, learning_rate=0.001, cache_dir=None,
+                   bucket_boundaries=BUCKET_BOUNDARIES):
     """
     Runs an experiment for training a model with specified parameters.
 
@@ -13,26 +18,37 @@ def run_experiment(dataset_dir, epochs=20, batch_size=16, learning_rate=0.001):
         epochs (int): Number of epochs for training.
         batch_size (int): Size of the training batches.
         learning_rate (float): Learning rate for the optimizer.
+        cache_dir (str): Dataset compiled by compile_dataset.py, read instead
+            of dataset_dir when given.
+        bucket_boundaries (list of int): Label lengths at which batches are
+            split into buckets, None to pad every batch as it comes.
     
     Returns:
         model: The trained model.
     """
-    # Load data
-    images, labels = load_data(dataset_dir)
-    images = [preprocess_image(img) for img in images]
+    # Character-level classes, the same ones the inference decoders use
+    vocabulary = CharVocabulary()
+
+    # Stream the data as {'image', 'label', 'label_length'} batches
+    if cache_dir:
+        dataset = make_cached_dataset(cache_dir, batch_size, bucket_boundaries=bucket_boundaries)
+    else:
+        dataset = make_dataset(dataset_dir, batch_size, charset=vocabulary.charset,
+                               bucket_boundaries=bucket_boundaries)
 
     # Define model parameters
-    input_shape = (128, 32, 1)  # Image input size
-    output_size = len(set(labels)) + 1  # Number of unique characters + CTC blank
+    input_shape = (32, 128, 1)  # (height, width, channels) of preprocess_image output
+    output_size = vocabulary.num_classes  # Every character + CTC blank
 
     # Create the model
     model = create_model(input_shape, output_size)
 
-    # Compile model with Adam optimizer and CTC loss
-    model.compile(optimizer=Adam(learning_rate=learning_rate), loss=ctc_loss)
+    # Compile the training wrapper with Adam; the CTC loss is part of the model
+    training_model = create_training_model(model)
+    training_model.compile(optimizer=Adam(learning_rate=learning_rate))
 
     # Train the model
-    history = model.fit(images, labels, epochs=epochs, batch_size=batch_size)
+    history = training_model.fit(dataset, epochs=epochs)
 
     # Plot training loss
     plot_loss(history)
@@ -56,4 +72,4 @@ def plot_loss(history):
 if __name__ == "__main__":
     dataset_dir = 'data/iam_handwritten_forms/'
     trained_model = run_experiment(dataset_dir, epochs=30, batch_size=16, learning_rate=0.0005)
-    trained_model.save('cnn_lstm_ctc_model.h5')
+    trained_model.save('cnn_lstm_ctc_model.keras')
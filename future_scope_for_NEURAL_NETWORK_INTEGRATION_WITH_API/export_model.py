@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+
+import tensorflow as tf
+
+# Converts the trained Keras model into a TFLite flatbuffer that lite_model.py
+# loads without TensorFlow.
+
+QUANTIZATIONS = ['none', 'float16', 'int8']
+
+
+def export_tflite(model, output_path, quantize='none', batch_size=1):
+    """
+    Export a model to TFLite.
+
+    Args:
+        model (tf.keras.Model or str): The model, or the path of a saved model.
+        output_path (str): Path of the .tflite file to write.
+        quantize (str): 'none' keeps float32 weights, 'float16' halves them,
+            'int8' stores weights as int8 and runs the dense and LSTM kernels
+            with dynamically quantized activations.
+        batch_size (int): Fixed batch size of the exported graph. A static
+            shape lets the converter fuse the LSTMs into native TFLite kernels.
+
+    Returns:
+        int: Size of the written file in bytes.
+    """
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantize}")
+    if isinstance(model, str):
+        print(f"[INFO] Loading model from {model}...")
+        model = tf.keras.models.load_model(model, compile=False)
+
+    height, width, channels = model.input_shape[1:]
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        # Freezing through a SavedModel turns the weights into constants
+        model.export(saved_model_dir, input_signature=[tf.TensorSpec([batch_size, height, width, channels], tf.float32)],
+                     verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantize != 'none':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantize == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        flatbuffer = converter.convert()
+
+    with open(output_path, 'wb') as f:
+        f.write(flatbuffer)
+    print(f"[INFO] Wrote {output_path} ({len(flatbuffer) / 1e6:.1f} MB, quantize={quantize})")
+    return len(flatbuffer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the CNN-LSTM-CTC model to TFLite")
+    parser.add_argument('--model_path', type=str, required=True, help='Path to the saved Keras model')
+    parser.add_argument('--output', type=str, default=None, help='Path of the .tflite file (next to the model by default)')
+    parser.add_argument('--quantize', choices=QUANTIZATIONS, default='int8', help='Weight quantization')
+    parser.add_argument('--batch_size', type=int, default=1, help='Fixed batch size of the exported graph')
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.model_path)[0]}.{args.quantize}.tflite"
+    tf.config.set_visible_devices([], 'GPU')
+    export_tflite(args.model_path, output, args.quantize, args.batch_size)
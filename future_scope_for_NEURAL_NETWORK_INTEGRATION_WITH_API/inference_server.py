@@ -0,0 +1,237 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from utils.ctc_decoding import CHARSET, decode
+from utils.image_preprocessing import preprocess_image
+
+
+class InferenceServer:
+    """
+    Long-lived CPU inference for the CNN-LSTM-CTC model.
+
+    The model is loaded and warmed up once. Concurrent predict() calls are
+    gathered by a background thread into micro-batches of up to max_batch_size
+    images, waiting at most max_latency_ms for a batch to fill, and each batch
+    runs through the model in a single call.
+
+    Args:
+        model (tf.keras.Model or str): The model, or the path of a saved model.
+        max_batch_size (int): Largest number of images run together.
+        max_latency_ms (float): Longest time the first image of a batch waits
+            for others to join.
+        decoder (str): CTC decoding, 'greedy' or 'beam'.
+        beam_width (int): Beam width for the 'beam' decoder.
+        charset (str): Characters of the model's non-blank output classes.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_latency_ms=10, decoder='greedy', beam_width=10,
+                 charset=CHARSET):
+        if isinstance(model, str):
+            print(f"[INFO] Loading model from {model}...")
+            model = tf.keras.models.load_model(model, compile=False)
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.decoder = decoder
+        self.beam_width = beam_width
+        self.charset = charset
+
+        # Model input is (batch, height, width, channels). One traced graph
+        # serves every batch size instead of running the LSTMs eagerly.
+        self.height, self.width = model.input_shape[1:3]
+        self.infer = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=[tf.TensorSpec([None, self.height, self.width, 1], tf.float32)],
+        )
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.closed = False
+
+        self.warm_up()
+        self.thread = threading.Thread(target=self._run, name='ctc-inference', daemon=True)
+        self.thread.start()
+
+    def preprocess(self, image):
+        """
+        Grayscale, resize and normalize one image for the model.
+
+        Args:
+            image (numpy.ndarray): Grayscale or BGR image.
+
+        Returns:
+            numpy.ndarray: (height, width, 1) float32 array.
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return preprocess_image(image, target_size=(self.width, self.height))
+
+    def warm_up(self):
+        """
+        Run one full-size batch so the first real request does not pay for
+        graph building and memory allocation.
+        """
+        start = time.perf_counter()
+        self.run_batch(np.zeros((self.max_batch_size, self.height, self.width, 1), dtype=np.float32))
+        print(f"[INFO] Warm-up took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def run_batch(self, batch):
+        """
+        Run the model on a preprocessed batch and decode every sample.
+
+        Args:
+            batch (numpy.ndarray): (batch_size, height, width, 1) float32 array.
+
+        Returns:
+            list of str: Decoded text per sample.
+        """
+        probabilities = self.infer(tf.convert_to_tensor(batch, tf.float32)).numpy()
+        return decode(probabilities, self.charset, self.decoder, self.beam_width)
+
+    def predict_batch(self, images):
+        """
+        Predict a list of images in one model call, without the queue.
+        """
+        return self.run_batch(np.stack([self.preprocess(image) for image in images]))
+
+    def submit(self, image):
+        """
+        Queue one image for the next micro-batch.
+
+        Args:
+            image (numpy.ndarray): Grayscale or BGR image.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the decoded text.
+        """
+        if self.closed:
+            raise RuntimeError("Inference server is closed")
+        future = Future()
+        # Preprocessing happens in the caller's thread, off the batching thread
+        self.requests.put((self.preprocess(image), future))
+        return future
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout)
+
+    def _collect(self):
+        # Block for the first request, then take whatever arrives before the
+        # batch is full or the latency budget is spent
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            futures = [future for _, future in batch]
+            try:
+                texts = self.run_batch(np.stack([image for image, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for future, text in zip(futures, texts):
+                future.set_result(text)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'images': self.images,
+            'avg_batch_size': round(self.images / self.batches, 2) if self.batches else 0.0,
+            'queued': self.requests.qsize(),
+        }
+
+    def close(self):
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join()
+
+
+def make_handler(server):
+    class PredictHandler(BaseHTTPRequestHandler):
+        # POST /predict with an encoded image as the body returns {"text": ...},
+        # GET /health returns the batching stats
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self._send_json(404, {'error': 'Not found'})
+            self._send_json(200, server.stats())
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._send_json(404, {'error': 'Not found'})
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                return self._send_json(400, {'error': 'Unable to decode image'})
+            self._send_json(200, {'text': server.predict(image)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve(server, host='127.0.0.1', port=8500):
+    """
+    Expose an InferenceServer over HTTP. Every connection gets its own thread,
+    so concurrent requests land in the same micro-batches.
+    """
+    httpd = ThreadingHTTPServer((host, port), make_handler(server))
+    print(f"[INFO] Serving on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU inference server for the CNN-LSTM-CTC model")
+    parser.add_argument('--model_path', type=str, required=True, help='Path to the saved model')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8500, help='Port to listen on')
+    parser.add_argument('--max_batch_size', type=int, default=32, help='Largest micro-batch')
+    parser.add_argument('--max_latency_ms', type=float, default=10, help='Longest wait for a micro-batch to fill')
+    parser.add_argument('--decoder', choices=['greedy', 'beam'], default='greedy', help='CTC decoding method')
+    parser.add_argument('--beam_width', type=int, default=10, help='Beam width for --decoder beam')
+    args = parser.parse_args()
+
+    tf.config.set_visible_devices([], 'GPU')
+    serve(InferenceServer(args.model_path, args.max_batch_size, args.max_latency_ms, args.decoder, args.beam_width),
+          args.host, args.port)
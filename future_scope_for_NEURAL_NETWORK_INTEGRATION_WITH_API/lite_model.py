@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from utils.ctc_decoding import CHARSET, decode
+from utils.image_preprocessing import preprocess_image
+
+# Runs a model exported by export_model.py without TensorFlow. The LiteRT
+# interpreter (pip install ai-edge-litert, or the older tflite-runtime) loads
+# in milliseconds; full TensorFlow is only imported if neither is installed.
+
+
+def load_interpreter(model_path, num_threads=None):
+    """
+    A TFLite interpreter for the model, from the lightest runtime available.
+
+    Args:
+        model_path (str): Path to the .tflite file.
+        num_threads (int): CPU threads for the interpreter (one per CPU by default).
+
+    Returns:
+        Interpreter: The interpreter, with tensors allocated.
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            print("[INFO] No LiteRT runtime installed, falling back to TensorFlow")
+            from tensorflow.lite import Interpreter
+    interpreter = Interpreter(model_path=model_path, num_threads=num_threads or os.cpu_count())
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+class LiteModel:
+    """
+    The exported CNN-LSTM-CTC model on the TFLite interpreter.
+
+    The exported graph has a fixed batch size (the LSTMs only fuse into TFLite
+    kernels with static shapes), so predict() runs a batch in chunks of that
+    size.
+
+    Args:
+        model_path (str): Path to the .tflite file.
+        num_threads (int): CPU threads for the interpreter.
+        charset (str): Characters of the model's non-blank output classes.
+    """
+
+    def __init__(self, model_path, num_threads=None, charset=CHARSET):
+        self.interpreter = load_interpreter(model_path, num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size, self.height, self.width = self.input['shape'][:3]
+        self.charset = charset
+        # Same shape convention as a Keras model
+        self.input_shape = (None, self.height, self.width, 1)
+
+    def predict(self, batch):
+        """
+        Run the model on a preprocessed batch.
+
+        Args:
+            batch (numpy.ndarray): (count, height, width, 1) float32 array.
+
+        Returns:
+            numpy.ndarray: (count, time_steps, classes) softmax outputs.
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = []
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            count = len(chunk)
+            if count < self.batch_size:
+                chunk = np.concatenate([chunk, np.zeros((self.batch_size - count,) + chunk.shape[1:], np.float32)])
+            self.interpreter.set_tensor(self.input['index'], chunk)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self.output['index'])[:count])
+        return np.concatenate(outputs)
+
+    def predict_text(self, images, decoder='greedy', beam_width=10):
+        """
+        Preprocess, run and decode grayscale images.
+
+        Args:
+            images (list of numpy.ndarray): Grayscale images of any size.
+            decoder (str): CTC decoding, 'greedy' or 'beam'.
+            beam_width (int): Beam width for the 'beam' decoder.
+
+        Returns:
+            list of str: Decoded text per image.
+        """
+        batch = np.stack([preprocess_image(image, target_size=(self.width, self.height)) for image in images])
+        return decode(self.predict(batch), self.charset, decoder, beam_width)
@@ -1,7 +1,9 @@
 import argparse
+import cv2
 from tensorflow.keras.models import load_model
 from utils.data_loader import load_data
 from utils.image_preprocessing import preprocess_image
+from utils.ctc_decoding import decode
 from experiments import run_experiment
 import os
 
@@ -23,26 +25,31 @@ def train_model(dataset_dir, epochs, batch_size, learning_rate, save_model_path)
         model.save(save_model_path)
         print(f"[INFO] Model saved at {save_model_path}")
 
-def load_and_predict(model_path, image_path):
+def load_and_predict(model_path, image_path, decoder='greedy'):
     """
     Load a pre-trained model and make predictions on a new image.
 
+    For more than one image, keep an InferenceServer (inference_server.py)
+    running instead: it loads the model once and batches requests.
+
     Args:
         model_path (str): Path to the saved model file.
         image_path (str): Path to the image file.
+        decoder (str): CTC decoding, 'greedy' or 'beam'.
 
     Returns:
         prediction (str): Predicted text.
     """
     print("[INFO] Loading model...")
-    model = load_model(model_path)
+    model = load_model(model_path, compile=False)
 
     print("[INFO] Preprocessing image...")
-    image = preprocess_image(image_path)
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    height, width = model.input_shape[1:3]
+    image = preprocess_image(image, target_size=(width, height))[None]
 
     print("[INFO] Making prediction...")
-    # Note: Prediction output logic can vary, this is just an example.
-    prediction = model.predict(image)
+    prediction = decode(model.predict(image, verbose=0), method=decoder)[0]
     print(f"Prediction: {prediction}")
     return prediction
 
@@ -55,6 +62,7 @@ if __name__ == "__main__":
     parser.add_argument('--dataset_dir', type=str, default=None, help='Path to the dataset directory')
     parser.add_argument('--model_path', type=str, default=None, help='Path to load or save the model')
     parser.add_argument('--image_path', type=str, default=None, help='Path to the image for prediction')
+    parser.add_argument('--decoder', choices=['greedy', 'beam'], default='greedy', help='CTC decoding method')
     parser.add_argument('--epochs', type=int, default=20, help='Number of training epochs')
     parser.add_argument('--batch_size', type=int, default=16, help='Training batch size')
     parser.add_argument('--learning_rate', type=float, default=0.001, help='Learning rate for the optimizer')
@@ -77,4 +85,4 @@ if __name__ == "__main__":
         if not args.model_path or not args.image_path:
             print("[ERROR] --model_path and --image_path are required for prediction.")
         else:
-            load_and_predict(args.model_path, args.image_path)
+            load_and_predict(args.model_path, args.image_path, args.decoder)
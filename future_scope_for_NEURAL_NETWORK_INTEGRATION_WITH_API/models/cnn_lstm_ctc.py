@@ -13,7 +13,9 @@ def create_model(input_shape, output_size):
     x = layers.MaxPooling2D(pool_size=(2, 2))(x)
     x = layers.Dropout(0.25)(x)
 
-    # Reshape for LSTM
+    # Reshape for LSTM, with the image width as the time axis so the text is
+    # read left to right
+    x = layers.Permute((2, 1, 3))(x)
     shape = tf.keras.backend.int_shape(x)
     x = layers.Reshape(target_shape=(shape[1], shape[2] * shape[3]))(x)
 
@@ -27,5 +29,45 @@ def create_model(input_shape, output_size):
     model = tf.keras.Model(inputs, x)
     return model
 
-def ctc_loss(y_true, y_pred):
-    return tf.keras.backend.ctc_batch_cost(y_true, y_pred)
+class CTCLossLayer(layers.Layer):
+    """
+    Adds the CTC loss of a batch to the model and passes the predictions on.
+
+    Every sample is scored against its own label length, so the blank padding
+    of shorter labels in a batch is never part of the loss. All samples have
+    the full number of time steps, since the images share one size. The blank
+    is the last class.
+    """
+
+    def call(self, labels, label_length, y_pred):
+        batch_size = tf.shape(y_pred)[0]
+        logit_length = tf.fill([batch_size], tf.shape(y_pred)[1])
+        loss = tf.nn.ctc_loss(
+            labels=tf.cast(labels, tf.int32),
+            # ctc_loss applies log-softmax, which leaves log-probabilities unchanged
+            logits=tf.math.log(y_pred + 1e-7),
+            label_length=tf.cast(tf.reshape(label_length, [-1]), tf.int32),
+            logit_length=logit_length,
+            logits_time_major=False,
+            blank_index=-1,
+        )
+        self.add_loss(tf.reduce_mean(loss))
+        return y_pred
+
+def create_training_model(model):
+    """
+    Wraps a prediction model with the CTC loss for training.
+
+    Args:
+        model (tf.keras.Model): The model from create_model.
+
+    Returns:
+        tf.keras.Model: A model taking {'image', 'label', 'label_length'}
+            batches (see utils.data_loader.make_dataset). Compile it without a
+            loss; the weights are shared with `model`, which is the one to save.
+    """
+    image = layers.Input(shape=model.input_shape[1:], name='image')
+    label = layers.Input(shape=(None,), dtype='int32', name='label')
+    label_length = layers.Input(shape=(), dtype='int32', name='label_length')
+    y_pred = CTCLossLayer()(label, label_length, model(image))
+    return tf.keras.Model({'image': image, 'label': label, 'label_length': label_length}, y_pred)
@@ -0,0 +1,95 @@
+import numpy as np
+
+# Characters of the IAM handwriting set, in the order of the model's output
+# classes. Following Keras' ctc_batch_cost, the blank is the last class.
+CHARSET = " !\"#&'()*+,-./0123456789:;?ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def greedy_decode(probabilities, charset=CHARSET):
+    """
+    Decode CTC outputs by taking the best class at every time step.
+
+    Args:
+        probabilities (numpy.ndarray): Softmax outputs, (time_steps, classes)
+            for one sample or (batch_size, time_steps, classes) for a batch.
+        charset (str): Characters of the non-blank classes, in class order.
+
+    Returns:
+        str or list of str: The decoded text, one string per sample for a batch.
+    """
+    if probabilities.ndim == 3:
+        return [greedy_decode(sample, charset) for sample in probabilities]
+
+    blank = len(charset)
+    best = np.argmax(probabilities, axis=-1)
+    # Keep a class where it differs from the previous step and is not blank
+    keep = np.ones(len(best), dtype=bool)
+    keep[1:] = best[1:] != best[:-1]
+    keep &= best != blank
+    return "".join(charset[index] for index in best[keep])
+
+
+def beam_search_decode(probabilities, charset=CHARSET, beam_width=10):
+    """
+    Decode CTC outputs with prefix beam search.
+
+    Slower than greedy decoding but can recover text whose best path splits
+    its probability across several alignments.
+
+    Args:
+        probabilities (numpy.ndarray): Softmax outputs, (time_steps, classes)
+            for one sample or (batch_size, time_steps, classes) for a batch.
+        charset (str): Characters of the non-blank classes, in class order.
+        beam_width (int): Number of prefixes kept after every time step.
+
+    Returns:
+        str or list of str: The decoded text, one string per sample for a batch.
+    """
+    if probabilities.ndim == 3:
+        return [beam_search_decode(sample, charset, beam_width) for sample in probabilities]
+
+    blank = len(charset)
+    log_probs = np.log(np.clip(probabilities, 1e-12, 1.0))
+    # Each prefix (tuple of class ids) carries the log probability of ending
+    # in a blank and of ending in its last character
+    beams = {(): (0.0, -np.inf)}
+
+    for step in log_probs:
+        # Only extend with classes that can matter at this step
+        candidates = np.argsort(step)[-beam_width:]
+        next_beams = {}
+
+        def add(prefix, blank_score, char_score):
+            old_blank, old_char = next_beams.get(prefix, (-np.inf, -np.inf))
+            next_beams[prefix] = (np.logaddexp(old_blank, blank_score), np.logaddexp(old_char, char_score))
+
+        for prefix, (blank_score, char_score) in beams.items():
+            total = np.logaddexp(blank_score, char_score)
+            for index in candidates:
+                p = step[index]
+                if index == blank:
+                    add(prefix, total + p, -np.inf)
+                    continue
+                extended = prefix + (int(index),)
+                if prefix and prefix[-1] == index:
+                    # A repeat only extends after a blank, otherwise it collapses
+                    add(extended, -np.inf, blank_score + p)
+                    add(prefix, -np.inf, char_score + p)
+                else:
+                    add(extended, -np.inf, total + p)
+
+        beams = dict(sorted(next_beams.items(), key=lambda item: -np.logaddexp(*item[1]))[:beam_width])
+
+    best = max(beams.items(), key=lambda item: np.logaddexp(*item[1]))[0]
+    return "".join(charset[index] for index in best)
+
+
+def decode(probabilities, charset=CHARSET, method='greedy', beam_width=10):
+    """
+    Decode CTC outputs with the named method ('greedy' or 'beam').
+    """
+    if method == 'greedy':
+        return greedy_decode(probabilities, charset)
+    if method == 'beam':
+        return beam_search_decode(probabilities, charset, beam_width)
+    raise ValueError(f"Unknown CTC decoder: {method}")
@@ -1,6 +1,34 @@
 import os
 import cv2
 import numpy as np
+import tensorflow as tf
+
+from utils.ctc_decoding import CHARSET
+
+def label_from_filename(file):
+    # Assuming filename format is "label_filename.png"
+    return file.split('_')[0]
+
+def list_samples(dataset_dir):
+    """
+    Lists the image paths and labels under the dataset directory without
+    reading any image.
+
+    Args:
+        dataset_dir (str): Path to the dataset directory.
+
+    Returns:
+        paths (list): Paths of the PNG images.
+        labels (list): Corresponding labels for the images.
+    """
+    paths = []
+    labels = []
+    for root, dirs, files in os.walk(dataset_dir):
+        for file in sorted(files):
+            if file.endswith(".png"):
+                paths.append(os.path.join(root, file))
+                labels.append(label_from_filename(file))
+    return paths, labels
 
 def load_data(dataset_dir):
     """
@@ -26,7 +54,97 @@ def load_data(dataset_dir):
                 images.append(img)
                 
                 # Load the label (assuming label is part of the filename, adjust as needed)
-                label = file.split('_')[0]  # Example: assuming filename format is "label_filename.png"
-                labels.append(label)
+                labels.append(label_from_filename(file))
 
     return np.array(images), np.array(labels)
+
+def make_char_table(charset=CHARSET):
+    # Character -> class id, characters outside the charset map to -1
+    return tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(
+            tf.constant(list(charset)), tf.range(len(charset), dtype=tf.int32)),
+        default_value=-1,
+    )
+
+def encode_label(label, table):
+    # Class ids of the label's characters, unknown characters dropped
+    ids = table.lookup(tf.strings.unicode_split(label, 'UTF-8'))
+    return tf.boolean_mask(ids, ids >= 0)
+
+def load_and_preprocess(path, target_size=(128, 32)):
+    """
+    Reads and preprocesses one image inside the tf.data graph, matching
+    image_preprocessing.preprocess_image (grayscale, bilinear resize, 0..1).
+
+    Args:
+        path (tf.Tensor): Path of a PNG image.
+        target_size (tuple): (width, height) of the model input.
+
+    Returns:
+        tf.Tensor: (height, width, 1) float32 image.
+    """
+    width, height = target_size
+    image = tf.io.decode_png(tf.io.read_file(path), channels=1)
+    image = tf.image.resize(image, (height, width), method='bilinear')
+    return image / 255.0
+
+def make_dataset(dataset_dir, batch_size=16, target_size=(128, 32), charset=CHARSET, shuffle_buffer=10000,
+                 shuffle=True, seed=None, bucket_boundaries=None):
+    """
+    Streams the dataset instead of loading it into memory.
+
+    Only the file list is held in memory. Paths are shuffled, then images are
+    decoded and preprocessed in parallel as batches are needed, labels are
+    encoded to class ids and padded per batch, and the next batches are
+    prefetched while the current one trains. Peak memory depends on the
+    batch size and prefetch depth, not on the dataset size.
+
+    Args:
+        dataset_dir (str): Path to the dataset directory.
+        batch_size (int): Size of the training batches.
+        target_size (tuple): (width, height) of the model input.
+        charset (str): Characters of the model's non-blank output classes.
+        shuffle_buffer (int): Number of paths in the shuffle buffer.
+        shuffle (bool): Reshuffle the paths every epoch.
+        seed (int): Shuffle seed.
+        bucket_boundaries (list of int): Label lengths splitting the batches
+            into buckets (each boundary starts a new bucket), so each batch
+            only pads labels up to the longest label in its bucket (no
+            bucketing by default).
+
+    Returns:
+        tf.data.Dataset: Batches of {'image': (batch, height, width, 1) float32,
+            'label': (batch, max_label_length) int32 padded with the blank id,
+            'label_length': (batch,) int32}.
+    """
+    paths, labels = list_samples(dataset_dir)
+    table = make_char_table(charset)
+    blank = len(charset)
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, max(1, len(paths))), seed=seed, reshuffle_each_iteration=True)
+
+    def load(path, label):
+        ids = encode_label(label, table)
+        return {
+            'image': load_and_preprocess(path, target_size),
+            'label': ids,
+            'label_length': tf.shape(ids)[0],
+        }
+
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    width, height = target_size
+    padded_shapes = {'image': [height, width, 1], 'label': [None], 'label_length': []}
+    padding_values = {'image': 0.0, 'label': blank, 'label_length': 0}
+    if bucket_boundaries:
+        dataset = dataset.bucket_by_sequence_length(
+            lambda sample: sample['label_length'],
+            bucket_boundaries,
+            [batch_size] * (len(bucket_boundaries) + 1),
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+        )
+    else:
+        dataset = dataset.padded_batch(batch_size, padded_shapes=padded_shapes, padding_values=padding_values)
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,177 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from utils.ctc_decoding import CHARSET
+from utils.data_loader import list_samples
+from utils.vocabulary import CharVocabulary
+
+# A compiled dataset is a directory of fixed-size shards plus index.json. Each
+# shard holds its images as a (count, height, width) uint8 .npy, already
+# resized, and its labels as a (count, max_label_length) int32 .npy of class
+# ids padded with the blank id, with their lengths alongside. The .npy files
+# are opened memory-mapped, so training reads pages straight from the page
+# cache instead of decoding PNGs.
+
+INDEX_FILE = 'index.json'
+
+
+def read_and_resize(path, target_size):
+    # Same resize as preprocess_image, kept as uint8 until training
+    return cv2.resize(cv2.imread(path, cv2.IMREAD_GRAYSCALE), target_size)
+
+
+def compile_dataset(dataset_dir, output_dir, target_size=(128, 32), shard_size=4096, charset=CHARSET, workers=None):
+    """
+    Decodes and resizes every image once and writes the shards and index.
+
+    Args:
+        dataset_dir (str): Path to the dataset directory.
+        output_dir (str): Directory for the shards and index.json.
+        target_size (tuple): (width, height) of the model input.
+        shard_size (int): Samples per shard.
+        charset (str): Characters of the model's non-blank output classes.
+        workers (int): Decoding threads (one per CPU by default).
+
+    Returns:
+        dict: The index.
+    """
+    paths, labels = list_samples(dataset_dir)
+    vocabulary = CharVocabulary(charset)
+    max_label_length = max((len(vocabulary.encode(label)) for label in labels), default=0)
+    width, height = target_size
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for start in range(0, len(paths), shard_size):
+            count = min(shard_size, len(paths) - start)
+            name = f"shard_{len(shards):05d}"
+            images = np.lib.format.open_memmap(
+                os.path.join(output_dir, f"{name}_images.npy"), mode='w+', dtype=np.uint8, shape=(count, height, width)
+            )
+            for i, image in enumerate(pool.map(read_and_resize, paths[start:start + count],
+                                               [target_size] * count)):
+                images[i] = image
+            images.flush()
+            del images
+
+            label_ids, lengths = vocabulary.encode_batch(labels[start:start + count], max_label_length)
+            np.save(os.path.join(output_dir, f"{name}_labels.npy"), label_ids)
+            np.save(os.path.join(output_dir, f"{name}_lengths.npy"), lengths)
+            shards.append({'name': name, 'count': count})
+            print(f"[INFO] Wrote {name} ({start + count}/{len(paths)} images)")
+
+    index = {
+        'target_size': [width, height],
+        'charset': charset,
+        'max_label_length': max_label_length,
+        'samples': len(paths),
+        'shards': shards,
+    }
+    # Written last, so an interrupted compile is never mistaken for a complete one
+    with open(os.path.join(output_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def load_index(cache_dir):
+    with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def open_shard(cache_dir, name):
+    """
+    Opens one shard memory-mapped.
+
+    Returns:
+        tuple: (images, labels, lengths) arrays backed by the shard files.
+    """
+    return tuple(
+        np.load(os.path.join(cache_dir, f"{name}_{part}.npy"), mmap_mode='r')
+        for part in ('images', 'labels', 'lengths')
+    )
+
+
+def iterate_batches(cache_dir, batch_size=16, shuffle=True, rng=None, bucket_boundaries=None):
+    """
+    Yields batches from the shards, visiting shards and the samples inside
+    each shard in a random order every epoch. Only the pages of the current
+    shard that a batch touches are read.
+
+    With bucket_boundaries, each batch only takes samples whose label length
+    falls in the same bucket, so little of a batch's label tensor is padding.
+
+    Yields:
+        dict: 'image' (batch, height, width) uint8, 'label' (batch,
+            longest label in the batch) int32, 'label_length' (batch,) int32.
+    """
+    index = load_index(cache_dir)
+    rng = rng or np.random.default_rng()
+    shards = list(index['shards'])
+    if shuffle:
+        rng.shuffle(shards)
+    for shard in shards:
+        images, labels, lengths = open_shard(cache_dir, shard['name'])
+        order = rng.permutation(shard['count']) if shuffle else np.arange(shard['count'])
+        if bucket_boundaries:
+            buckets = np.digitize(lengths[order], bucket_boundaries)
+            batches = []
+            for bucket in np.unique(buckets):
+                members = order[buckets == bucket]
+                batches += [members[start:start + batch_size] for start in range(0, len(members), batch_size)]
+            if shuffle:
+                rng.shuffle(batches)
+        else:
+            batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        for batch in batches:
+            # Sorted indices keep the reads within a batch sequential
+            batch = np.sort(batch)
+            batch_lengths = lengths[batch]
+            yield {
+                'image': images[batch],
+                'label': labels[batch, :max(int(batch_lengths.max()), 1)],
+                'label_length': batch_lengths,
+            }
+
+
+def make_cached_dataset(cache_dir, batch_size=16, shuffle=True, seed=None, bucket_boundaries=None):
+    """
+    Training batches from a compiled dataset, in the same format as
+    data_loader.make_dataset.
+
+    Args:
+        cache_dir (str): Directory written by compile_dataset.
+        batch_size (int): Size of the training batches.
+        shuffle (bool): Reshuffle shards and samples every epoch.
+        seed (int): Shuffle seed.
+        bucket_boundaries (list of int): Label lengths splitting the batches
+            into buckets, as in data_loader.make_dataset (no bucketing by
+            default).
+
+    Returns:
+        tf.data.Dataset: Batches of {'image': (batch, height, width, 1) float32,
+            'label': (batch, max_label_length) int32 padded with the blank id,
+            'label_length': (batch,) int32}.
+    """
+    width, height = load_index(cache_dir)['target_size']
+    # One generator for every epoch, so a seeded run still reshuffles
+    rng = np.random.default_rng(seed)
+    dataset = tf.data.Dataset.from_generator(
+        lambda: iterate_batches(cache_dir, batch_size, shuffle, rng, bucket_boundaries),
+        output_signature={
+            'image': tf.TensorSpec([None, height, width], tf.uint8),
+            'label': tf.TensorSpec([None, None], tf.int32),
+            'label_length': tf.TensorSpec([None], tf.int32),
+        },
+    )
+
+    def to_float(batch):
+        batch['image'] = tf.cast(batch['image'], tf.float32)[..., tf.newaxis] / 255.0
+        return batch
+
+    return dataset.map(to_float, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
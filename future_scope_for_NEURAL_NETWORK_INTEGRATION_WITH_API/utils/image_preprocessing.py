@@ -1,18 +1,19 @@
 import cv2
 import numpy as np
 
-def preprocess_image(image):
+def preprocess_image(image, target_size=(128, 32)):
     """
     Preprocess the image by resizing, normalizing, and preparing for model input.
 
     Args:
         image (numpy.ndarray): The input image (grayscale).
+        target_size (tuple): (width, height) of the model input.
 
     Returns:
         processed_image (numpy.ndarray): Preprocessed image ready for model input.
     """
-    # Resize image to the target size (128x32)
-    image_resized = cv2.resize(image, (128, 32))
+    # Resize image to the target size (128x32 by default)
+    image_resized = cv2.resize(image, target_size)
 
     # Normalize pixel values (0 to 1 range)
     image_normalized = image_resized.astype(np.float32) / 255.0
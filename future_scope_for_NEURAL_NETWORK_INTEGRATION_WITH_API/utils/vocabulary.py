@@ -0,0 +1,87 @@
+import numpy as np
+
+from utils.ctc_decoding import CHARSET
+
+
+class CharVocabulary:
+    """
+    Maps text to the model's CTC classes and back.
+
+    Every character of the charset is one output class, in charset order, and
+    the CTC blank is the class after the last character (Keras convention).
+
+    Args:
+        charset (str): Characters of the non-blank classes, in class order.
+    """
+
+    def __init__(self, charset=CHARSET):
+        self.charset = charset
+        self.ids = {char: i for i, char in enumerate(charset)}
+
+    @classmethod
+    def from_labels(cls, labels):
+        """
+        A vocabulary of the characters that occur in the labels, sorted.
+        """
+        return cls("".join(sorted(set("".join(labels)))))
+
+    @property
+    def blank(self):
+        return len(self.charset)
+
+    @property
+    def num_classes(self):
+        # Output size of the model: every character plus the blank
+        return len(self.charset) + 1
+
+    def __len__(self):
+        return len(self.charset)
+
+    def encode(self, text):
+        """
+        Class ids of the text's characters. Characters outside the charset
+        are dropped.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            list of int: Class ids.
+        """
+        return [self.ids[char] for char in text if char in self.ids]
+
+    def encode_batch(self, texts, max_length=None):
+        """
+        Encodes texts into a padded label tensor for CTC.
+
+        Args:
+            texts (list of str): The texts.
+            max_length (int): Width of the label tensor (the longest label by
+                default).
+
+        Returns:
+            labels (numpy.ndarray): (len(texts), max_length) int32 class ids,
+                padded with the blank id.
+            lengths (numpy.ndarray): (len(texts),) int32 label lengths.
+        """
+        encoded = [self.encode(text) for text in texts]
+        lengths = np.array([len(ids) for ids in encoded], dtype=np.int32)
+        if max_length is None:
+            max_length = int(lengths.max()) if len(lengths) else 0
+        labels = np.full((len(encoded), max_length), self.blank, dtype=np.int32)
+        for i, ids in enumerate(encoded):
+            labels[i, :len(ids)] = ids[:max_length]
+        return labels, np.minimum(lengths, max_length)
+
+    def decode(self, ids):
+        """
+        Text of a label's class ids, ignoring the blank and padding. Unlike
+        CTC decoding, repeated ids are kept.
+
+        Args:
+            ids (list of int): Class ids.
+
+        Returns:
+            str: The text.
+        """
+        return "".join(self.charset[i] for i in ids if 0 <= i < len(self.charset))